@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core.metrics import render_prometheus
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(render_prometheus(),
+                             media_type='text/plain; version=0.0.4')
@@ -1,37 +1,91 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 
+from api.v1.responses import json_response
+from core.stripe_scheduler import admin_priority
+from models.catalog import CatalogSyncSummary
 from models.history import (
-    BillingHistory, UserSubscriptions, SubscriptionUpdate
+    BillingHistoryPage, UserSubscriptions, SubscriptionUpdate
 )
 from services.admin_services import (
     BillingHistoryService,
     get_billing_history_service,
 )
+from models.migration import SubscriptionMigrationSummary
+from services.catalog_sync import CatalogSyncService, get_catalog_sync_service
+from services.subscription_migration import (
+    SubscriptionMigrationService,
+    get_subscription_migration_service,
+)
+from services.subscription_mirror import (
+    SubscriptionMirrorService,
+    get_subscription_mirror_service,
+)
+
+# Stripe calls of admin requests must not delay checkout and webhooks.
+router = APIRouter(dependencies=[Depends(admin_priority)])
+
 
-router = APIRouter()
+NDJSON = 'application/x-ndjson'
 
 
 # todo проверить токен на право админа
+@router.get('/billing-history/export',
+            response_class=StreamingResponse,
+            summary='Выгрузка истории всех пользователей',
+            description='История всех пользователей за период в формате NDJSON',
+            tags=['Admin'])
+async def export_history(
+        date_from: datetime,
+        date_to: datetime,
+        product_service: BillingHistoryService = Depends(
+            get_billing_history_service
+        )
+) -> StreamingResponse:
+    return StreamingResponse(
+        product_service.stream_history(date_from, date_to),
+        media_type=NDJSON,
+    )
+
+
 @router.get('/billing-history/{user_uuid}',
-            response_model=List[BillingHistory],
+            response_model=BillingHistoryPage,
             summary='История пользователя',
-            description='История пользователя',
+            description='История пользователя постранично, '
+                        'next_cursor передается в cursor следующего запроса',
             tags=['Admin'])
 async def get_user_history(
+        user_uuid: UUID,
+        limit: int = Query(50, ge=1, le=500),
+        cursor: Optional[str] = None,
+        product_service: BillingHistoryService = Depends(
+            get_billing_history_service
+        )
+) -> Response:
+    return json_response(await product_service.get_user_history(
+        user_uuid, limit, cursor
+    ))
+
+
+@router.get('/billing-history/{user_uuid}/export',
+            response_class=StreamingResponse,
+            summary='Выгрузка истории пользователя',
+            description='Вся история пользователя в формате NDJSON',
+            tags=['Admin'])
+async def export_user_history(
         user_uuid: UUID,
         product_service: BillingHistoryService = Depends(
             get_billing_history_service
         )
-) -> List[BillingHistory]:
-    user_history = await product_service.get_user_history(
-        user_uuid
+) -> StreamingResponse:
+    return StreamingResponse(
+        product_service.stream_user_history(user_uuid),
+        media_type=NDJSON,
     )
-    if not user_history:
-        return []
-    return user_history
 
 
 @router.get('/subscriptions/{user_uuid}',
@@ -41,16 +95,14 @@ async def get_user_history(
             tags=['Admin'])
 async def get_user_subscriptions(
         user_uuid: UUID,
+        live: bool = Query(False, description='Запросить подписки из Stripe'),
         product_service: BillingHistoryService = Depends(
             get_billing_history_service
         )
-) -> List[UserSubscriptions]:
-    user_subscriptions = await product_service.get_user_subscriptions(
-        user_uuid
-    )
-    if not user_subscriptions:
-        return []
-    return user_subscriptions
+) -> Response:
+    return json_response(await product_service.get_user_subscriptions(
+        user_uuid, live
+    ))
 
 
 @router.put('/subscriptions',
@@ -69,3 +121,75 @@ async def update_user_subscriptions(
         item.price_uuid,
         item.subscription_id
     )
+
+
+@router.post('/subscriptions/migrations/{migration_id}',
+             response_model=SubscriptionMigrationSummary,
+             summary='Массовая смена тарифов',
+             description='Сохраняет строки миграции и запускает ее в фоне. '
+                         'Повторный запрос с тем же migration_id продолжает '
+                         'миграцию, с dry_run только проверяет строки '
+                         'запроса, ничего не сохраняя',
+             tags=['Admin'])
+async def migrate_subscriptions(
+        migration_id: str,
+        items: List[SubscriptionUpdate],
+        background_tasks: BackgroundTasks,
+        dry_run: bool = Query(False, description='Не менять подписки'),
+        retry_failed: bool = Query(False, description='Повторить неудачные'),
+        migration_service: SubscriptionMigrationService = Depends(
+            get_subscription_migration_service
+        )
+) -> SubscriptionMigrationSummary:
+    if dry_run:
+        return await migration_service.check(migration_id, items)
+    # A running migration answers 409 now, not from the background task.
+    await migration_service.ensure_idle(migration_id)
+    await migration_service.submit(migration_id, items)
+    background_tasks.add_task(
+        migration_service.run_in_background, migration_id,
+        retry_failed=retry_failed,
+    )
+    return await migration_service.summary(migration_id)
+
+
+@router.get('/subscriptions/migrations/{migration_id}',
+            response_model=SubscriptionMigrationSummary,
+            summary='Ход массовой смены тарифов',
+            description='Количество строк миграции по статусам',
+            tags=['Admin'])
+async def get_subscription_migration(
+        migration_id: str,
+        migration_service: SubscriptionMigrationService = Depends(
+            get_subscription_migration_service
+        )
+) -> SubscriptionMigrationSummary:
+    return await migration_service.summary(migration_id)
+
+
+@router.post('/subscriptions/reconcile',
+             response_model=int,
+             summary='Сверка подписок со Stripe',
+             description='Перезагружает локальные подписки из Stripe, '
+                         'возвращает количество обновленных подписок',
+             tags=['Admin'])
+async def reconcile_subscriptions(
+        stripe_customer_id: Optional[str] = None,
+        mirror_service: SubscriptionMirrorService = Depends(
+            get_subscription_mirror_service
+        )
+) -> int:
+    return await mirror_service.reconcile(stripe_customer_id)
+
+
+@router.post('/catalog/sync',
+             response_model=CatalogSyncSummary,
+             summary='Синхронизация каталога со Stripe',
+             description='Загружает продукты и цены из Stripe и обновляет '
+                         'локальный каталог, с dry_run только считает изменения',
+             tags=['Admin'])
+async def sync_catalog(
+        dry_run: bool = Query(False, description='Не записывать изменения'),
+        sync_service: CatalogSyncService = Depends(get_catalog_sync_service)
+) -> CatalogSyncSummary:
+    return await sync_service.sync(dry_run)
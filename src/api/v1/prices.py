@@ -3,10 +3,12 @@ from http import HTTPStatus
 from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
 
+from api.v1.responses import etag_response
 from core.message_constants import NOT_DATA_RECURRING, PRICE_NOT_FOUND
 from models.prices import Price, TypeRecurring, TypePrice
+from services.catalog_cache import CatalogCache, get_catalog_cache
 from services.prices_service import get_price_service, PriceService
 from grpc_auth_client.dependencies import get_permissions
 
@@ -20,12 +22,14 @@ router = APIRouter()
             tags=['Prices'])
 async def get_prices(
         uuid: UUID,
-        price_service: PriceService = Depends(get_price_service)
+        request: Request,
+        price_service: PriceService = Depends(get_price_service),
+        catalog: CatalogCache = Depends(get_catalog_cache),
 ) -> List[Price]:
-    prices = await price_service.get_all_in_product(uuid)
-    if not prices:
-        return []
-    return prices
+    async def load():
+        return await price_service.get_all_in_product(uuid) or []
+
+    return await etag_response(request, catalog, load)
 
 
 class Interval(Enum):
@@ -79,14 +83,19 @@ async def create_price(
             tags=['Prices'])
 async def get_price_id(
         uuid: UUID,
+        request: Request,
         price_service: PriceService = Depends(get_price_service),
+        catalog: CatalogCache = Depends(get_catalog_cache),
         permissions=Depends(get_permissions)
 ) -> Price:
-    price = await price_service.get_one(uuid)
-    if not price:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
-                            detail=PRICE_NOT_FOUND)
-    return price
+    async def load():
+        price = await price_service.get_one(uuid)
+        if not price:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
+                                detail=PRICE_NOT_FOUND)
+        return price
+
+    return await etag_response(request, catalog, load)
 
 # TODO надо определиться, будем ли что-то править для прайса
 
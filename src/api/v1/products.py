@@ -2,10 +2,12 @@ from http import HTTPStatus
 from typing import List
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 
+from api.v1.responses import etag_response
 from core.message_constants import PRODUCT_NOT_FOUND, PRODUCT_ALREADY_EXISTS
 from models.products import Product
+from services.catalog_cache import CatalogCache, get_catalog_cache
 from services.products_service import get_products_service, ProductService
 
 router = APIRouter()
@@ -16,12 +18,19 @@ router = APIRouter()
             summary='Список продуктов',
             description='Список продуктов',
             tags=['Products'])
-async def get_products(product_service: ProductService = Depends(get_products_service)) -> List[Product]:
-    products = await product_service.get_all()
-    if not products:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
-                            detail=PRODUCT_NOT_FOUND)
-    return products
+async def get_products(
+        request: Request,
+        product_service: ProductService = Depends(get_products_service),
+        catalog: CatalogCache = Depends(get_catalog_cache),
+) -> List[Product]:
+    async def load():
+        products = await product_service.get_all()
+        if not products:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
+                                detail=PRODUCT_NOT_FOUND)
+        return products
+
+    return await etag_response(request, catalog, load)
 
 
 @router.post('/',
@@ -52,13 +61,18 @@ async def create_products(
             tags=['Products'])
 async def get_product_id(
         uuid: UUID,
-        product_service: ProductService = Depends(get_products_service)
+        request: Request,
+        product_service: ProductService = Depends(get_products_service),
+        catalog: CatalogCache = Depends(get_catalog_cache),
 ) -> Product:
-    product = await product_service.get_one(uuid)
-    if not product:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
-                            detail=PRODUCT_NOT_FOUND)
-    return product
+    async def load():
+        product = await product_service.get_one(uuid)
+        if not product:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
+                                detail=PRODUCT_NOT_FOUND)
+        return product
+
+    return await etag_response(request, catalog, load)
 
 
 @router.put('/{uuid}',
@@ -0,0 +1,39 @@
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable
+
+import orjson
+from fastapi import Request, Response
+
+from core.profiling import timed
+from services.catalog_cache import CatalogCache
+from utils.json_dumps import orjson_default
+
+
+def json_response(data) -> Response:
+    """Serialise ``data`` with orjson, bypassing ``response_model``.
+
+    For routes returning trusted records (``models.records``): FastAPI
+    would otherwise validate and encode every item again. The route keeps
+    its ``response_model`` for the OpenAPI schema.
+    """
+    with timed('serialization'):
+        content = orjson.dumps(data, default=orjson_default)
+    return Response(content, media_type='application/json')
+
+
+async def etag_response(request: Request, catalog: CatalogCache,
+                        load: Callable[[], Awaitable[Any]]) -> Response:
+    """JSON response of catalog data with the catalog version as ETag.
+
+    If ``If-None-Match`` carries it the answer is 304, before ``load``
+    runs. ``load`` raises for a missing object.
+    """
+    etag = catalog.etag()
+    headers = {'ETag': etag}
+    if_none_match = request.headers.get('if-none-match', '')
+    if etag in (tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    data = await load()
+    with timed('serialization'):
+        content = orjson.dumps(data, default=orjson_default)
+    return Response(content, media_type='application/json', headers=headers)
@@ -1,24 +1,55 @@
 import uuid
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional
 
-import stripe
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from starlette import status
 from starlette.responses import RedirectResponse, Response
 
-from core.config import Settings, STATIC_DIR
+from core.config import get_settings, STATIC_DIR
 from core.message_constants import WH_NOT_VERIFIED, SUCCESS
+from core.profiling import timed
+from core.static_files import static_url
+from core.stripe_config import get_stripe
+from core.stripe_gateway import StripeGateway
 from grpc_auth_client.dependencies import get_user_id
+from services.catalog_cache import CatalogCache, get_catalog_cache
 from services.products_service import ProductService, get_products_service
 from services.subscription_service import SubscriptionService, get_subscription_service
-from services.webhook_service import WebhookSubscriptionService, get_webhook_service
+from services.webhook_queue import WebhookEventQueue, get_webhook_queue
 
-templates = Jinja2Templates(directory=STATIC_DIR)
 router = APIRouter()
-settings = Settings()
-stripe.api_key = settings.stripe_key
+settings = get_settings()
+
+PAGES = ('index.html', 'success.html', 'canceled.html')
+
+
+@lru_cache()
+def get_templates():
+    # Jinja is only needed by the HTML pages, load it with the first one.
+    from fastapi.templating import Jinja2Templates
+
+    templates = Jinja2Templates(directory=STATIC_DIR)
+    templates.env.globals['static_url'] = static_url
+    # Compile every page once, templates only change with a deploy.
+    templates.env.auto_reload = False
+    for name in PAGES:
+        templates.env.get_template(name)
+    return templates
+
+
+def render(name: str, **context) -> str:
+    template = get_templates().get_template(name)
+    with timed('serialization'):
+        return template.render(**context)
+
+
+async def _shown_products(product_service: ProductService) -> Optional[List]:
+    products = await product_service.get_all()
+    if not products:
+        return None
+    return [product for product in products if product.active]
 
 
 @router.get(
@@ -26,51 +57,50 @@ stripe.api_key = settings.stripe_key
     response_class=HTMLResponse,
 )
 async def index(
-        request: Request,
         product_service: ProductService = Depends(get_products_service),
         subscription_service: SubscriptionService = Depends(get_subscription_service),
+        catalog: CatalogCache = Depends(get_catalog_cache),
         user_id: uuid.UUID = Depends(get_user_id),
 ):
-    """Start page endpoint for subscriptions."""
+    """Start page endpoint for subscriptions.
+
+    The products shown only depend on the catalog and are kept per
+    catalog version; the compiled template renders them with the user id.
+    """
     customer = await subscription_service.check_user_has_subscription(user_id)
     if customer:
-        return templates.TemplateResponse(
-            'index.html',
-            {
-                'request': request,
-                'has_subscription': True,
-                'customer_id': customer.stripe_customer_id,
-            }
-        )
-    if products := await product_service.get_all():
-        return templates.TemplateResponse(
+        return HTMLResponse(render(
             'index.html',
-            {
-                'request': request,
-                'products': products,
-                'user_id': user_id,
-            }
-        )
+            has_subscription=True,
+            customer_id=customer.stripe_customer_id,
+        ))
+    products = await catalog.get_or_load(
+        ('page', 'index.html'), lambda: _shown_products(product_service)
+    )
+    if products is not None:
+        return HTMLResponse(render(
+            'index.html', products=products, user_id=user_id,
+        ))
 
 
-@router.get('/checkout-session', response_model=stripe.checkout.Session)
+@router.get('/checkout-session', response_model=dict)
 async def get_checkout_session(
         sessionId: str,
+        stripe_loc: StripeGateway = Depends(get_stripe),
 ):
-    stripe.api_key = settings.stripe_key
     id = sessionId
-    checkout_session = stripe.checkout.Session.retrieve(id)
+    checkout_session = await stripe_loc.request('checkout.Session.retrieve', id)
     return checkout_session
 
 
 @router.get('/canceled', response_class=HTMLResponse)
 async def canceled_payment(request: Request):
-    return templates.TemplateResponse('canceled.html', {'request': request})
+    return get_templates().TemplateResponse('canceled.html', {'request': request})
 
 
 @router.get('/success', response_class=HTMLResponse)
 async def success_payment(request: Request, session_id: str):
-    return templates.TemplateResponse('success.html', {'request': request, 'session_id': session_id})
+    return get_templates().TemplateResponse('success.html', {'request': request, 'session_id': session_id})
 
 
 @router.post('/create-checkout-session')
@@ -80,9 +110,9 @@ async def create_checkout_session(
         subscription_service: SubscriptionService = Depends(get_subscription_service),
 ):
     try:
-        checkout_session = await subscription_service.create_subscription_session(user_id, product_id)
+        checkout_url = await subscription_service.create_subscription_session(user_id, product_id)
         return RedirectResponse(
-            checkout_session.url,
+            checkout_url,
             status.HTTP_303_SEE_OTHER
         )
     except Exception as e:
@@ -90,8 +120,12 @@ async def create_checkout_session(
 
 
 @router.post('/create-customer-portal-session')
-async def customer_portal_user(customer_id: str):
-    session = stripe.billing_portal.Session.create(
+async def customer_portal_user(
+        customer_id: str,
+        stripe_loc: StripeGateway = Depends(get_stripe),
+):
+    session = await stripe_loc.request(
+        'billing_portal.Session.create',
         customer=customer_id,
         return_url='https://www.kinopoisk.ru/',
     )
@@ -101,15 +135,19 @@ async def customer_portal_user(customer_id: str):
     )
 
 
-@router.post('/create-portal-session', response_model=stripe.checkout.Session)
-async def customer_portal_session(session_id: str):
+@router.post('/create-portal-session', response_model=dict)
+async def customer_portal_session(
+        session_id: str,
+        stripe_loc: StripeGateway = Depends(get_stripe),
+):
     """Redirect to customer subscriptions cp."""
     checkout_session_id = session_id
-    checkout_session = stripe.checkout.Session.retrieve(checkout_session_id)
+    checkout_session = await stripe_loc.request('checkout.Session.retrieve', checkout_session_id)
 
     return_url = 'https://www.kinopoisk.ru/'
 
-    portalSession = stripe.billing_portal.Session.create(
+    portalSession = await stripe_loc.request(
+        'billing_portal.Session.create',
         customer=checkout_session.customer,
         return_url=return_url,
     )
@@ -123,7 +161,8 @@ async def customer_portal_session(session_id: str):
 async def webhook_received(
         request: Request,
         stripe_signature: Optional[str] = Header(None),
-        webhook_service: WebhookSubscriptionService = Depends(get_webhook_service),
+        webhook_queue: WebhookEventQueue = Depends(get_webhook_queue),
+        stripe_loc: StripeGateway = Depends(get_stripe),
 ):
     webhook_secret = settings.stripe_webhook_secret
     request_data = await request.body()
@@ -132,14 +171,12 @@ async def webhook_received(
         # Retrieve the event by verifying the signature using the raw body and secret if webhook signing is configured.
         signature = stripe_signature
         try:
-            event = stripe.Webhook.construct_event(
-                payload=request_data,
-                sig_header=signature,
-                secret=webhook_secret,
+            event = stripe_loc.construct_event(
+                request_data, signature, webhook_secret
             )
         except Exception as e:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
-        await webhook_service.handling_event(event)
+        await webhook_queue.ingest(event.to_dict_recursive())
 
         return Response(SUCCESS, status_code=status.HTTP_200_OK)
 
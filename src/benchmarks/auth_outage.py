@@ -0,0 +1,110 @@
+"""Auth service outage: circuit breaker and stale token cache.
+
+Runs ``get_auth_info`` against the fake auth gRPC server, then stops the
+server and checks that known tokens are served from the stale cache,
+that the breaker opens after ``failures`` unhealthy answers and then
+fails fast without calling the server, and that an unknown token gets a
+503. After restarting the server and waiting for the reset timeout, one
+trial call must close the breaker again. Exits non-zero on a failed
+check.
+
+Usage (from ``src``): python -m benchmarks.auth_outage [failures]
+"""
+import asyncio
+import sys
+import time
+import uuid
+from http import HTTPStatus
+
+from fastapi import HTTPException
+
+from benchmarks.fakes.auth_server import FakeAuthServicer, start_server
+from benchmarks.startup import free_port
+from core.config import get_settings
+from grpc_auth_client.breaker import CircuitBreaker
+from grpc_auth_client.cache import TokenCache
+from grpc_auth_client.channel import create_channel
+from grpc_auth_client.dependencies import get_auth_info
+from grpc_auth_client.protos import auth_pb2_grpc
+
+TTL = 0.2
+RESET_TIMEOUT = 1.0
+
+failed = []
+
+
+def check(name: str, ok: bool, detail: str = ''):
+    print(f'{"ok  " if ok else "FAIL"} {name}{f" ({detail})" if detail else ""}')
+    if not ok:
+        failed.append(name)
+
+
+async def status_of(lookup) -> int:
+    try:
+        await lookup
+    except HTTPException as error:
+        return error.status_code
+    return HTTPStatus.OK
+
+
+async def main(failures: int) -> int:
+    port = free_port()
+    servicer = FakeAuthServicer()
+    server = await start_server(port, servicer)
+    channel = create_channel(get_settings().copy(
+        update={'auth_grpc_target': f'127.0.0.1:{port}'}
+    ))
+    stub = auth_pb2_grpc.AuthStub(channel)
+    cache = TokenCache(maxsize=100, ttl=TTL, negative_ttl=TTL,
+                       stale_ttl=60)
+    breaker = CircuitBreaker(failure_threshold=failures,
+                             reset_timeout=RESET_TIMEOUT)
+    user = str(uuid.uuid4())
+
+    def lookup(token: str):
+        return get_auth_info(token, stub, cache, breaker)
+
+    try:
+        info = await lookup(f'{user}:subscriber')
+        check('lookup while the server is up',
+              info.user_id == user and info.permissions == ['subscriber'])
+        check('invalid token is rejected',
+              await status_of(lookup('invalid')) == HTTPStatus.UNAUTHORIZED)
+
+        await server.stop(None)
+        await asyncio.sleep(TTL)
+        for number in range(failures):
+            info = await lookup(f'{user}:subscriber')
+            check(f'stale answer during the outage, call {number + 1}',
+                  info.user_id == user)
+        check('breaker open', breaker.is_open,
+              f'{breaker.failures} failures')
+
+        calls = servicer.calls
+        started = time.perf_counter()
+        info = await lookup(f'{user}:subscriber')
+        elapsed = (time.perf_counter() - started) * 1000
+        check('open breaker answers from the stale cache without a call',
+              info.user_id == user and servicer.calls == calls and elapsed < 10,
+              f'{elapsed:.1f} ms')
+        check('unknown token during the outage gets 503',
+              await status_of(lookup(str(uuid.uuid4())))
+              == HTTPStatus.SERVICE_UNAVAILABLE)
+
+        servicer = FakeAuthServicer()
+        server = await start_server(port, servicer)
+        await asyncio.sleep(RESET_TIMEOUT)
+        info = await lookup(f'{user}:subscriber')
+        check('trial call after the reset timeout closes the breaker',
+              not breaker.is_open and servicer.calls > 0
+              and info.user_id == user)
+    finally:
+        await channel.close()
+        await server.stop(None)
+
+    print('ok' if not failed else f'{len(failed)} checks failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)))
@@ -0,0 +1,89 @@
+"""Per-request cost of resolving the service dependencies.
+
+Resolves the dependencies of a subscription-service endpoint with
+FastAPI's own ``solve_dependencies``, once through the former
+``lru_cache`` factory chain (subscription -> price -> products, each
+factory with its own ``Depends`` arguments) and once through the app
+scoped ``ServiceContainer`` lookup. No database or Stripe is needed:
+services are only built, never called.
+
+Usage (from ``src``): python -m benchmarks.dependency_overhead [rounds]
+"""
+import asyncio
+import sys
+import time
+from functools import lru_cache
+
+from fastapi import Depends, FastAPI
+from fastapi.dependencies.utils import get_dependant, solve_dependencies
+from starlette.requests import Request
+
+from core.db import get_pg
+from core.stripe_config import get_stripe
+from services.catalog_cache import catalog_cache, get_catalog_cache
+from services.container import ServiceContainer
+from services.prices_service import PriceService
+from services.products_service import ProductService
+from services.subscription_service import (
+    SubscriptionService,
+    get_subscription_service,
+)
+
+
+@lru_cache()
+def legacy_products_service(db=Depends(get_pg), stripe_loc=Depends(get_stripe),
+                            catalog=Depends(get_catalog_cache)):
+    return ProductService(db, stripe_loc, catalog)
+
+
+@lru_cache()
+def legacy_price_service(db=Depends(get_pg),
+                         products_service=Depends(legacy_products_service),
+                         stripe_loc=Depends(get_stripe),
+                         catalog=Depends(get_catalog_cache)):
+    return PriceService(db, products_service, stripe_loc, catalog)
+
+
+@lru_cache()
+def legacy_subscription_service(db=Depends(get_pg),
+                                price_service=Depends(legacy_price_service),
+                                product_service=Depends(legacy_products_service),
+                                stripe_loc=Depends(get_stripe)):
+    return SubscriptionService(db, price_service, product_service, stripe_loc,
+                               None)
+
+
+async def legacy_endpoint(service=Depends(legacy_subscription_service)):
+    return service
+
+
+async def container_endpoint(service=Depends(get_subscription_service)):
+    return service
+
+
+async def resolve(app: FastAPI, endpoint, rounds: int) -> float:
+    dependant = get_dependant(path='/', call=endpoint)
+    scope = {'type': 'http', 'app': app, 'method': 'GET', 'path': '/',
+             'headers': [], 'query_string': b''}
+    started = time.perf_counter()
+    for _ in range(rounds):
+        values, errors, *_ = await solve_dependencies(
+            request=Request(scope), dependant=dependant,
+            dependency_overrides_provider=app,
+        )
+        assert not errors, errors
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+async def main(rounds: int):
+    app = FastAPI()
+    app.state.services = ServiceContainer(None, None, catalog_cache, None, None)
+    for name, endpoint in (('lru_cache factories', legacy_endpoint),
+                           ('service container', container_endpoint)):
+        # Sync factories run in the thread pool, warm it up first.
+        await resolve(app, endpoint, 10)
+        print(f'{name:22} {await resolve(app, endpoint, rounds):8.1f} us/request')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,122 @@
+"""Check that the service queries are served by indexes.
+
+Every read query built in ``services/`` is captured with a recording
+database and, together with the queries registered in ``core.queries``, run
+through ``EXPLAIN`` against the configured Postgres with sequential scans
+disabled. A plan that still has a ``Seq Scan`` on one of the
+hot tables has no usable index and the script exits with status 1.
+
+Usage (from ``src`` with migrations applied): python -m benchmarks.explain_indexes
+"""
+import asyncio
+import datetime
+import json
+import sys
+import uuid
+from contextlib import suppress
+
+import asyncpg
+from sqlalchemy import DateTime
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import Select
+
+from core.db import db_postgres_dsn
+from core.queries import QUERIES, to_asyncpg
+from services.admin_services import BillingHistoryService
+from services.catalog_cache import CatalogCache
+from services.prices_service import PriceService
+from services.products_service import ProductService
+# Registers the queries of the subscription and webhook services.
+import services.subscription_service  # noqa: F401
+import services.webhook_service  # noqa: F401
+
+HOT_TABLES = {'stripe_customer', 'price', 'billing_history', 'subscription'}
+
+
+class RecordingDatabase:
+    def __init__(self):
+        self.queries = []
+
+    async def fetch_one(self, query, values=None):
+        self.queries.append(query)
+
+    async def fetch_all(self, query, values=None):
+        self.queries.append(query)
+        return []
+
+    async def execute(self, query, values=None):
+        self.queries.append(query)
+
+
+async def collect_queries() -> dict:
+    db = RecordingDatabase()
+    some_id = uuid.uuid4()
+    # A fresh cache per run, so every lookup reaches the database.
+    products = ProductService(db, None, CatalogCache(max_age=60))
+    prices = PriceService(db, products, None, CatalogCache(max_age=60))
+    calls = {
+        'ProductService.check_product': products.check_product('name'),
+        'PriceService.get_all_in_product': prices.get_all_in_product(some_id),
+        'BillingHistoryService.get_user_history':
+            BillingHistoryService(db, None).get_user_history(some_id, 50),
+        'BillingHistoryService.get_user_subscriptions':
+            BillingHistoryService(db, None).get_user_subscriptions(some_id),
+    }
+    queries = {f'queries.{name}': query.query for name, query in QUERIES.items()}
+    for name, call in calls.items():
+        db.queries.clear()
+        # Lookups return nothing, so handlers stop right after them.
+        with suppress(AttributeError, TypeError):
+            await call
+        for number, query in enumerate(db.queries):
+            if isinstance(query, Select):
+                queries[f'{name}#{number}'] = query
+    return queries
+
+
+def sample_args(names, compiled) -> list:
+    """Values for the parameters of a registered query, by column type."""
+    args = []
+    for name in names:
+        value = compiled.params[name]
+        if value is None:
+            column_type = compiled.binds[name].type
+            if isinstance(column_type, postgresql.UUID):
+                value = uuid.uuid4()
+            elif isinstance(column_type, DateTime):
+                value = datetime.datetime.now(datetime.timezone.utc)
+            else:
+                value = column_type.python_type()
+        args.append(value)
+    return args
+
+
+def seq_scans(plan: dict):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from seq_scans(child)
+
+
+async def main() -> int:
+    queries = await collect_queries()
+    connection = await asyncpg.connect(db_postgres_dsn)
+    failed = 0
+    try:
+        await connection.execute('SET enable_seqscan = off')
+        for name, query in queries.items():
+            sql, names, compiled = to_asyncpg(query)
+            args = sample_args(names, compiled)
+            plan = json.loads(await connection.fetchval(
+                f'EXPLAIN (FORMAT JSON) {sql}', *args
+            ))[0]['Plan']
+            scans = HOT_TABLES.intersection(seq_scans(plan))
+            print(f"{'FAIL' if scans else 'ok':4} {name} {sorted(scans) or ''}")
+            failed += bool(scans)
+    finally:
+        await connection.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
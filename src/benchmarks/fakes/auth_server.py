@@ -0,0 +1,53 @@
+"""Stand-in for the auth gRPC service.
+
+Tokens look like ``<user_uuid>`` or ``<user_uuid>:<perm1>,<perm2>``; the
+token ``invalid`` is rejected with UNAUTHENTICATED.
+
+Usage: python -m benchmarks.fakes.auth_server [port]
+"""
+import asyncio
+import sys
+
+import grpc
+
+from grpc_auth_client.protos import auth_pb2, auth_pb2_grpc
+
+
+class FakeAuthServicer(auth_pb2_grpc.AuthServicer):
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls = 0
+
+    async def _parse(self, request, context):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if request.token == 'invalid':
+            await context.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid token')
+        user_id, _, permissions = request.token.partition(':')
+        return user_id, [item for item in permissions.split(',') if item]
+
+    async def GetUser(self, request, context):
+        user_id, _ = await self._parse(request, context)
+        return auth_pb2.User(user_id=user_id)
+
+    async def GetPermissions(self, request, context):
+        _, permissions = await self._parse(request, context)
+        return auth_pb2.Permissions(permissions=permissions)
+
+
+async def start_server(port: int, servicer: FakeAuthServicer = None) -> grpc.aio.Server:
+    server = grpc.aio.server()
+    auth_pb2_grpc.add_AuthServicer_to_server(servicer or FakeAuthServicer(), server)
+    server.add_insecure_port(f'127.0.0.1:{port}')
+    await server.start()
+    return server
+
+
+async def main(port: int):
+    server = await start_server(port)
+    await server.wait_for_termination()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50051))
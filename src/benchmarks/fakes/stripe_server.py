@@ -0,0 +1,248 @@
+"""Stand-in for the Stripe API, with injectable rate limiting.
+
+Point ``STRIPE_API_BASE`` at it. Objects live in memory: list, retrieve,
+create and modify work for any resource path (``/v1/products``,
+``/v1/checkout/sessions`` ...), list pagination follows
+``starting_after``. Subscriptions unknown to the store are made up on
+retrieve, active with one item, so bulk jobs can run against any ids.
+
+Rate limiting: at most ``rate`` requests per second are served, the
+others are answered 429 with ``Retry-After``; ``fail_ratio`` adds random
+429s on top. ``GET /_stats`` returns the counts per path and status.
+
+Usage: python -m benchmarks.fakes.stripe_server [port] [--rate N]
+       [--fail-ratio P] [--latency SECONDS] [--products N]
+"""
+import asyncio
+import random
+import re
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+from urllib.parse import parse_qsl
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+PREFIXES = {
+    'products': 'prod', 'prices': 'price', 'customers': 'cus',
+    'subscriptions': 'sub', 'invoices': 'in', 'events': 'evt',
+    'checkout/sessions': 'cs', 'billing_portal/sessions': 'bps',
+}
+KEY_PART = re.compile(r'\[([^\]]*)\]')
+
+
+def parse_form(pairs) -> dict:
+    """Decode Stripe's ``a[b][0][c]=v`` form encoding into nested values."""
+    result: dict = {}
+    for key, value in pairs:
+        head = key.split('[', 1)[0]
+        parts = [head] + KEY_PART.findall(key)
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return _lists(result)
+
+
+def _lists(node):
+    if not isinstance(node, dict):
+        return node
+    if node and all(key.isdigit() for key in node):
+        return [_lists(node[key]) for key in sorted(node, key=int)]
+    return {key: _lists(value) for key, value in node.items()}
+
+
+def error(status: int, message: str, kind: str = 'invalid_request_error',
+          headers: Optional[dict] = None) -> JSONResponse:
+    return JSONResponse({'error': {'type': kind, 'message': message}},
+                        status_code=status, headers=headers)
+
+
+class FakeStripe:
+    def __init__(self, rate: Optional[float] = None, fail_ratio: float = 0.0,
+                 latency: float = 0.0):
+        self.rate = rate
+        self.fail_ratio = fail_ratio
+        self.latency = latency
+        self.objects: Dict[str, Dict[str, dict]] = {}
+        self.stats: Counter = Counter()
+        self._window = (0, 0)
+
+    def seed_catalog(self, products: int, prices_per_product: int = 2):
+        now = int(time.time())
+        for number in range(products):
+            product = self.store('products', {
+                'name': f'Product {number}', 'active': True,
+                'description': None, 'created': now, 'updated': now,
+            })
+            for interval_count in range(1, prices_per_product + 1):
+                self.store('prices', {
+                    'product': product['id'], 'active': True,
+                    'type': 'recurring', 'currency': 'usd',
+                    'unit_amount': 500 * interval_count, 'nickname': None,
+                    'metadata': {},
+                    'recurring': {'interval': 'month',
+                                  'interval_count': interval_count,
+                                  'usage_type': 'licensed'},
+                })
+
+    def store(self, resource: str, values: dict, object_id: str = None) -> dict:
+        object_id = object_id or (
+            f'{PREFIXES.get(resource, "obj")}_{uuid.uuid4().hex[:14]}'
+        )
+        item = {'id': object_id, 'object': resource.split('/')[-1].rstrip('s'),
+                'created': int(time.time()), **values}
+        self.objects.setdefault(resource, {})[object_id] = item
+        return item
+
+    def _throttled(self) -> bool:
+        if self.fail_ratio and random.random() < self.fail_ratio:
+            return True
+        if self.rate is None:
+            return False
+        second = int(time.monotonic())
+        start, served = self._window
+        if second != start:
+            start, served = second, 0
+        if served >= self.rate:
+            self._window = (start, served)
+            return True
+        self._window = (start, served + 1)
+        return False
+
+    async def handle(self, request: Request):
+        path = request.path_params['path']
+        template = re.sub(r'/[a-z]+_[A-Za-z0-9_]+', '/{id}', path)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._throttled():
+            self.stats[(request.method, template, 429)] += 1
+            return error(429, 'Too many requests', 'rate_limit_error',
+                         headers={'Retry-After': '1'})
+        response = await self._answer(request, path)
+        self.stats[(request.method, template, response.status_code)] += 1
+        return response
+
+    async def _answer(self, request: Request, path: str) -> JSONResponse:
+        resource, object_id = path, None
+        match = re.match(r'(.+)/([a-z]+_[A-Za-z0-9_]+)$', path)
+        if match:
+            resource, object_id = match.groups()
+        objects = self.objects.setdefault(resource, {})
+        if request.method == 'POST':
+            values = parse_form(parse_qsl((await request.body()).decode()))
+            values.pop('expand', None)
+            if object_id is None:
+                return JSONResponse(self._create(resource, values))
+            item = objects.get(object_id) or self._made_up(resource, object_id)
+            if item is None:
+                return error(404, f'No such object: {object_id}')
+            self._modify(resource, item, values)
+            return JSONResponse(item)
+        if object_id is not None:
+            item = objects.get(object_id) or self._made_up(resource, object_id)
+            if item is None:
+                return error(404, f'No such object: {object_id}')
+            return JSONResponse(item)
+        return JSONResponse(self._list(resource, request.query_params))
+
+    def _create(self, resource: str, values: dict) -> dict:
+        if resource == 'checkout/sessions':
+            session_id = f'cs_{uuid.uuid4().hex}'
+            values = {
+                'url': f'https://checkout.stripe.test/pay/{session_id}',
+                'status': 'open',
+                **values,
+            }
+            values['expires_at'] = int(values.get('expires_at')
+                                       or time.time() + 86400)
+            return self.store(resource, values, session_id)
+        if resource == 'billing_portal/sessions':
+            values['url'] = 'https://billing.stripe.test/session'
+        return self.store(resource, values)
+
+    def _modify(self, resource: str, item: dict, values: dict):
+        if resource == 'subscriptions' and 'items' in values:
+            for change in values.pop('items'):
+                for current in item['items']['data']:
+                    if current['id'] == change.get('id'):
+                        current['price'] = {'id': change['price']}
+                        item['plan'] = {'id': change['price']}
+        item.update(values)
+
+    def _made_up(self, resource: str, object_id: str) -> Optional[dict]:
+        if resource != 'subscriptions':
+            return None
+        prices = list(self.objects.get('prices', {})) or ['price_fake']
+        price_id = prices[0]
+        now = int(time.time())
+        return self.store(resource, {
+            'status': 'active',
+            'customer': f'cus_{object_id[4:]}',
+            'plan': {'id': price_id},
+            'items': {'object': 'list', 'data': [
+                {'id': f'si_{object_id[4:]}', 'price': {'id': price_id}},
+            ]},
+            'current_period_start': now,
+            'current_period_end': now + 30 * 86400,
+            'cancel_at_period_end': False,
+            'ended_at': None,
+        }, object_id)
+
+    def _list(self, resource: str, params) -> dict:
+        items = list(self.objects.get(resource, {}).values())
+        after = params.get('starting_after')
+        if after:
+            ids = [item['id'] for item in items]
+            items = items[ids.index(after) + 1:] if after in ids else []
+        limit = int(params.get('limit', 10))
+        return {'object': 'list', 'url': f'/v1/{resource}',
+                'data': items[:limit], 'has_more': len(items) > limit}
+
+
+def create_app(fake: FakeStripe) -> Starlette:
+    async def stats(request: Request):
+        return JSONResponse([
+            {'method': method, 'path': path, 'status': status, 'count': count}
+            for (method, path, status), count in sorted(fake.stats.items())
+        ])
+
+    app = Starlette(routes=[
+        Route('/_stats', stats),
+        Route('/v1/{path:path}', fake.handle, methods=['GET', 'POST']),
+    ])
+    app.state.fake = fake
+    return app
+
+
+async def start_server(port: int, fake: FakeStripe) -> uvicorn.Server:
+    """Serve ``fake`` in the running loop; stop with ``server.should_exit``."""
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(fake), host='127.0.0.1', port=port, log_level='warning',
+    ))
+    asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server
+
+
+def main(args):
+    def option(name, default, kind=float):
+        return kind(args[args.index(name) + 1]) if name in args else default
+
+    fake = FakeStripe(rate=option('--rate', None),
+                      fail_ratio=option('--fail-ratio', 0.0),
+                      latency=option('--latency', 0.0))
+    fake.seed_catalog(option('--products', 3, int))
+    uvicorn.run(create_app(fake), host='127.0.0.1',
+                port=int(args[0]) if args and args[0].isdigit() else 12111)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
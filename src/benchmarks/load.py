@@ -0,0 +1,404 @@
+"""Load test of the whole app against local stand-ins of its dependencies.
+
+Starts the fake Stripe server and the fake auth gRPC server in this
+process, loads the fake catalog into Postgres with the catalog sync,
+then runs ``main:app`` under uvicorn pointed at them and drives it with
+these mixes, in order:
+
+``catalog``
+    product list, prices of a product and the subscription start page.
+``checkout``
+    checkout sessions of new users, some clicked twice.
+``webhooks``
+    signed event streams of many customers at once (checkout completed,
+    subscription created, invoices, updates); the time runs until the
+    queue has applied every event.
+``admin_history``
+    history pages and subscriptions of the customers of ``webhooks``.
+
+For every mix it prints throughput, p50/p99 latency, errors and the
+statements sent to Postgres per request, read from ``db_queries_total``
+of the app's ``/metrics`` (for ``webhooks`` including the background
+processing). ``--save`` writes the numbers to a JSON file and
+``--compare`` prints the change against such a file, e.g. the one saved
+before a change. Rows created by the run are deleted afterwards.
+
+Usage (from ``src``, Postgres reachable with migrations applied):
+    python -m benchmarks.load [--scale N] [--only NAME,...]
+        [--save PATH] [--compare PATH]
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+import httpx
+import orjson
+from sqlalchemy import delete, func, select
+
+from benchmarks.fakes import auth_server
+from benchmarks.fakes.stripe_server import FakeStripe, start_server
+from benchmarks.startup import SRC_DIR, free_port
+from benchmarks.webhook_replay import customer_stream
+from core.db import db_init
+from core.stripe_gateway import StripeGateway
+from db.sql_model import (
+    AuthOutbox,
+    BillingHistory,
+    CheckoutSession,
+    Price,
+    Product,
+    StripeCustomer,
+    StripeEvent,
+    StripeEventStatus,
+    Subscription,
+)
+from services.catalog_cache import catalog_cache
+from services.catalog_sync import CatalogSyncService
+
+SCENARIOS = ('catalog', 'checkout', 'webhooks', 'admin_history')
+WEBHOOK_SECRET = 'whsec_benchmark'
+CONCURRENCY = 20
+COMPARED = ('rps', 'p50_ms', 'p99_ms', 'queries_per_request')
+
+
+def signed(event: dict):
+    """Body and ``Stripe-Signature`` header as Stripe would send them."""
+    body = orjson.dumps(event)
+    timestamp = int(time.time())
+    digest = hmac.new(WEBHOOK_SECRET.encode(),
+                      f'{timestamp}.'.encode() + body,
+                      hashlib.sha256).hexdigest()
+    return body, {'Stripe-Signature': f't={timestamp},v1={digest}',
+                  'Content-Type': 'application/json'}
+
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, database, fake: FakeStripe):
+        self.client = client
+        self.database = database
+        self.fake = fake
+        self.run = uuid.uuid4().hex[:8]
+        self.products: List[str] = []
+        # Users of the checkout sessions.
+        self.users: List[str] = []
+        # Webhook customers and their users.
+        self.customers: List[str] = []
+        self.customer_users: List[str] = []
+
+    async def db_queries(self) -> float:
+        response = await self.client.get('/metrics')
+        for line in response.text.splitlines():
+            if line.startswith('db_queries_total '):
+                return float(line.split()[1])
+        return 0.0
+
+    async def drive(self, calls, concurrency: int = CONCURRENCY):
+        """Run the request factories ``calls`` with ``concurrency`` clients.
+
+        Returns the latency of every request and how many failed.
+        """
+        pending = iter(calls)
+        latencies, errors = [], 0
+
+        async def client():
+            nonlocal errors
+            for call in pending:
+                started = time.perf_counter()
+                try:
+                    response = await call()
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                latencies.append(time.perf_counter() - started)
+                errors += failed
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, errors
+
+    async def measure(self, scenario, scale: int) -> dict:
+        queries = await self.db_queries()
+        started = time.perf_counter()
+        latencies, errors = await scenario(self, scale)
+        elapsed = time.perf_counter() - started
+        queries = await self.db_queries() - queries
+        cuts = (statistics.quantiles(latencies, n=100)
+                if len(latencies) > 1 else [0.0] * 99)
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(cuts[49] * 1000, 1),
+            'p99_ms': round(cuts[98] * 1000, 1),
+            # The /metrics scrape itself does not query Postgres.
+            'queries_per_request': round(queries / max(len(latencies), 1), 2),
+        }
+
+
+async def catalog(bench: Bench, scale: int):
+    client = bench.client
+    users = [str(uuid.uuid4()) for _ in range(50)]
+    calls = []
+    for _ in range(300 * scale):
+        kind = random.random()
+        if kind < 0.5:
+            calls.append(lambda: client.get('/api/v1/products/'))
+        elif kind < 0.8:
+            product = random.choice(bench.products)
+            calls.append(lambda product=product: client.get(
+                f'/api/v1/prices/product/{product}'))
+        else:
+            token = random.choice(users)
+            calls.append(lambda token=token: client.get(
+                '/api/v1/subscription/',
+                headers={'Authorization': f'Bearer {token}'}))
+    return await bench.drive(calls)
+
+
+async def checkout(bench: Bench, scale: int):
+    client = bench.client
+    calls = []
+    for _ in range(100 * scale):
+        user = str(uuid.uuid4())
+        bench.users.append(user)
+        product = random.choice(bench.products)
+        params = {'product_id': product, 'user_id': user}
+        # Every fifth user clicks twice, the second click reuses the session.
+        for _ in range(2 if random.random() < 0.2 else 1):
+            calls.append(lambda params=params: client.post(
+                '/api/v1/subscription/create-checkout-session', params=params))
+    return await bench.drive(calls)
+
+
+async def webhooks(bench: Bench, scale: int):
+    stripe_price_id = next(iter(bench.fake.objects['prices']))
+    streams = []
+    gateway = SimpleNamespace(subscriptions={})
+    for number in range(20 * scale):
+        customer_id, _, events = customer_stream(
+            bench.run, number, stripe_price_id, gateway
+        )
+        bench.customers.append(customer_id)
+        bench.customer_users.append(
+            events[0]['data']['object']['metadata']['user_id']
+        )
+        streams.append(events)
+    # Retrieving a subscription answers its final state.
+    for subscription_id, subscription in gateway.subscriptions.items():
+        bench.fake.store('subscriptions', subscription, subscription_id)
+
+    latencies, errors = [], 0
+
+    async def feed(events):
+        # Stripe delivers the events of one customer in order.
+        nonlocal errors
+        for event in events:
+            body, headers = signed({**event, 'object': 'event'})
+            started = time.perf_counter()
+            response = await bench.client.post(
+                '/api/v1/subscription/webhook', content=body, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+
+    await asyncio.gather(*(feed(events) for events in streams))
+    while await bench.database.fetch_val(
+        select(func.count()).select_from(StripeEvent).where(
+            StripeEvent.customer_id.in_(bench.customers),
+            StripeEvent.status == StripeEventStatus.pending.value,
+        )
+    ):
+        await asyncio.sleep(0.05)
+    errors += await bench.database.fetch_val(
+        select(func.count()).select_from(StripeEvent).where(
+            StripeEvent.customer_id.in_(bench.customers),
+            StripeEvent.status == StripeEventStatus.failed.value,
+        )
+    )
+    return latencies, errors
+
+
+async def admin_history(bench: Bench, scale: int):
+    if not bench.customers:
+        print('admin_history: loading the webhook events first')
+        await webhooks(bench, scale)
+    client = bench.client
+    calls = []
+    for _ in range(200 * scale):
+        user = random.choice(bench.customer_users)
+        if random.random() < 0.7:
+            calls.append(lambda user=user: client.get(
+                f'/api/v1/admin/billing-history/{user}'))
+        else:
+            calls.append(lambda user=user: client.get(
+                f'/api/v1/admin/subscriptions/{user}'))
+    return await bench.drive(calls)
+
+
+async def load_catalog(database, fake: FakeStripe, port: int):
+    gateway = StripeGateway(
+        api_key='sk_test_fake', max_workers=4, max_concurrency=4, timeout=10,
+        api_base=f'http://127.0.0.1:{port}', rate=1000, burst=100,
+        rate_limit_retries=0,
+    )
+    try:
+        await CatalogSyncService(database, gateway, catalog_cache).sync()
+    finally:
+        gateway.close()
+    return [str(row.id) for row in await database.fetch_all(
+        select(Product.id).where(
+            Product.stripe_product_id.in_(list(fake.objects['products']))
+        )
+    )]
+
+
+def start_app(stripe_port: int,
+              auth_port: int) -> Tuple[subprocess.Popen, int]:
+    port = free_port()
+    env = {
+        **os.environ,
+        'STRIPE_KEY': 'sk_test_fake',
+        'STRIPE_API_BASE': f'http://127.0.0.1:{stripe_port}',
+        'STRIPE_RATE': '1000',
+        'STRIPE_BURST': '100',
+        'AUTH_GRPC_TARGET': f'127.0.0.1:{auth_port}',
+        'WEBHOOK_SECRET': WEBHOOK_SECRET,
+    }
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+         '--no-access-log'],
+        cwd=SRC_DIR, env=env,
+    )
+    return app, port
+
+
+async def wait_ready(app: subprocess.Popen, client: httpx.AsyncClient,
+                     deadline: float = 30.0):
+    started = time.perf_counter()
+    while time.perf_counter() - started < deadline:
+        if app.poll() is not None:
+            raise SystemExit('the app exited during startup')
+        try:
+            if (await client.get('/metrics')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit(f'the app did not answer within {deadline} s')
+
+
+async def cleanup(bench: Bench):
+    database = bench.database
+    users = [uuid.UUID(user) for user in bench.users + bench.customer_users]
+    customer_rows = select(StripeCustomer.id).where(
+        StripeCustomer.stripe_customer_id.in_(bench.customers)
+    )
+    await database.execute(delete(BillingHistory).where(
+        BillingHistory.stripe_customer.in_(customer_rows)))
+    await database.execute(delete(AuthOutbox).where(
+        AuthOutbox.user_id.in_(users)))
+    await database.execute(delete(Subscription).where(
+        Subscription.stripe_customer_id.in_(bench.customers)))
+    await database.execute(delete(StripeCustomer).where(
+        StripeCustomer.stripe_customer_id.in_(bench.customers)))
+    await database.execute(delete(StripeEvent).where(
+        StripeEvent.customer_id.in_(bench.customers)))
+    await database.execute(delete(CheckoutSession).where(
+        CheckoutSession.user_id.in_(users)))
+    stripe_products = list(bench.fake.objects.get('products', {}))
+    await database.execute(delete(Price).where(
+        Price.stripe_product_id.in_(stripe_products)))
+    await database.execute(delete(Product).where(
+        Product.stripe_product_id.in_(stripe_products)))
+
+
+def report(results: dict, baseline: Optional[dict] = None):
+    print(f'\n{"scenario":14} {"requests":>8} {"errors":>6} {"rps":>8} '
+          f'{"p50 ms":>8} {"p99 ms":>8} {"queries/req":>11}')
+    for name, result in results.items():
+        print(f'{name:14} {result["requests"]:8} {result["errors"]:6} '
+              f'{result["rps"]:8} {result["p50_ms"]:8} {result["p99_ms"]:8} '
+              f'{result["queries_per_request"]:11}')
+        before = (baseline or {}).get(name)
+        if before:
+            changes = []
+            for key in COMPARED:
+                if before.get(key):
+                    change = (result[key] - before[key]) / before[key] * 100
+                    changes.append(f'{key} {change:+.0f}%')
+            print(f'{"":14} vs baseline: {", ".join(changes)}')
+
+
+async def main(scale: int, only: List[str], save: Optional[str] = None,
+               compare: Optional[str] = None):
+    baseline = None
+    if compare:
+        with open(compare) as file:
+            baseline = json.load(file)['scenarios']
+    fake = FakeStripe()
+    fake.seed_catalog(5)
+    stripe_port, auth_port = free_port(), free_port()
+    stripe = await start_server(stripe_port, fake)
+    auth = await auth_server.start_server(auth_port)
+    database = db_init()
+    await database.connect()
+    app = None
+    try:
+        products = await load_catalog(database, fake, stripe_port)
+        app, port = start_app(stripe_port, auth_port)
+        async with httpx.AsyncClient(
+            base_url=f'http://127.0.0.1:{port}', timeout=60,
+            limits=httpx.Limits(max_connections=100),
+        ) as client:
+            await wait_ready(app, client)
+            bench = Bench(client, database, fake)
+            bench.products = products
+            scenarios = {'catalog': catalog, 'checkout': checkout,
+                         'webhooks': webhooks, 'admin_history': admin_history}
+            results = {}
+            try:
+                for name in SCENARIOS:
+                    if name in only:
+                        results[name] = await bench.measure(scenarios[name],
+                                                            scale)
+            finally:
+                await cleanup(bench)
+        report(results, baseline)
+        if save:
+            with open(save, 'w') as file:
+                json.dump({
+                    'scale': scale,
+                    'created': time.strftime('%Y-%m-%d %H:%M'),
+                    'scenarios': results,
+                }, file, indent=2)
+            print(f'\nsaved to {save}')
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait()
+        await database.disconnect()
+        await auth.stop(None)
+        stripe.should_exit = True
+        await asyncio.sleep(0.2)
+
+
+if __name__ == '__main__':
+    def option(name, default=None):
+        args = sys.argv[1:]
+        return args[args.index(name) + 1] if name in args else default
+
+    asyncio.run(main(
+        scale=int(option('--scale', 1)),
+        only=option('--only', ','.join(SCENARIOS)).split(','),
+        save=option('--save'),
+        compare=option('--compare'),
+    ))
@@ -0,0 +1,97 @@
+"""Compare per-call compilation with the compiled query registry.
+
+For every query of ``core.queries`` the script times what ``databases``
+does on each call (build the ``select`` and compile it) against the
+registry path (bind the arguments of the already compiled SQL). With
+``--execute`` both paths also run the query against the configured
+Postgres: ``databases.fetch_one`` versus ``CompiledQuery.fetch_one``.
+
+Usage (from ``src``): python -m benchmarks.query_compile [--execute] [rounds]
+"""
+import asyncio
+import sys
+import time
+import uuid
+
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+
+from core.db import db_init, db_postgres_url
+from core.queries import QUERIES
+# Importing the services registers their queries.
+import services.prices_service  # noqa: F401
+import services.products_service  # noqa: F401
+import services.subscription_service  # noqa: F401
+import services.webhook_service  # noqa: F401
+
+SAMPLE_VALUES = {
+    'id': uuid.uuid4(),
+    'user_id': uuid.uuid4(),
+    'stripe_customer_id': 'cus_benchmark',
+    'stripe_price_id': 'price_benchmark',
+}
+
+
+def per_call_query(compiled_query):
+    """The registered query with the sample values inlined, as services did."""
+    return compiled_query.query.params(**{
+        name: SAMPLE_VALUES[name]
+        for name in compiled_query.names if name in SAMPLE_VALUES
+    })
+
+
+def timed(func, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+async def timed_async(func, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await func()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def compile_report(rounds: int):
+    backend = PostgresBackend(db_postgres_url)
+    connection = PostgresConnection(backend, backend._dialect)
+    print(f'{"query":28} {"compile us":>12} {"registry us":>12}')
+    for name, compiled_query in QUERIES.items():
+        values = {k: v for k, v in SAMPLE_VALUES.items() if k in compiled_query.names}
+        per_call = timed(
+            lambda: connection._compile(per_call_query(compiled_query)), rounds
+        )
+        registry = timed(lambda: compiled_query.args(values), rounds)
+        print(f'{name:28} {per_call:12.1f} {registry:12.1f}')
+
+
+async def execute_report(rounds: int):
+    database = db_init()
+    await database.connect()
+    try:
+        print(f'\n{"query":28} {"databases us":>12} {"registry us":>12}')
+        for name, compiled_query in QUERIES.items():
+            values = {k: v for k, v in SAMPLE_VALUES.items() if k in compiled_query.names}
+            per_call = await timed_async(
+                lambda: database.fetch_one(per_call_query(compiled_query)), rounds
+            )
+            registry = await timed_async(
+                lambda: compiled_query.fetch_one(database, **values), rounds
+            )
+            print(f'{name:28} {per_call:12.1f} {registry:12.1f}')
+    finally:
+        await database.disconnect()
+
+
+def main(args):
+    execute = '--execute' in args
+    numbers = [arg for arg in args if arg.isdigit()]
+    rounds = int(numbers[0]) if numbers else 2000
+    compile_report(rounds)
+    if execute:
+        asyncio.run(execute_report(rounds))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+"""Cost of serialising a large history page: pydantic vs slotted records.
+
+Builds ``rows`` synthetic ``billing_history`` rows and serialises them the
+way a route did before and does now:
+
+* ``pydantic``: ``BillingHistory`` models in a ``BillingHistoryPage``,
+  then what FastAPI does with a ``response_model`` (validate the returned
+  page again, ``jsonable_encoder``, orjson in the app's ``ORJSONResponse``);
+* ``records``: ``HistoryRecord``s in a ``HistoryPageRecord`` dumped by
+  orjson, as ``json_response`` does.
+
+CPU time is the best of ``rounds`` runs, allocations are the tracemalloc
+peak of one run. Both outputs are checked to decode to the
+same document.
+
+Usage (from ``src``): python -m benchmarks.serialization [rows] [rounds]
+"""
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+
+from models.history import BillingHistory, BillingHistoryPage
+from models.records import HistoryPageRecord
+from services.admin_services import history_record
+
+
+def make_rows(count: int):
+    started = datetime(2022, 1, 1)
+    user_id = uuid.uuid4()
+    return [SimpleNamespace(
+        id=uuid.uuid4(),
+        created_at=started + timedelta(minutes=number),
+        name='Premium',
+        stripe_subscription_id=f'sub_{number:08d}',
+        subscription_status='active',
+        event_type='invoice.paid',
+        user_id=user_id,
+    ) for number in range(count)]
+
+
+def with_pydantic(rows) -> bytes:
+    page = BillingHistoryPage(
+        items=[BillingHistory(**asdict(history_record(row))) for row in rows],
+        next_cursor=None,
+    )
+    # FastAPI's serialize_response: the returned model is turned back into
+    # a dict, validated against response_model and encoded.
+    validated = BillingHistoryPage.validate(page.dict())
+    return ORJSONResponse(jsonable_encoder(validated)).body
+
+
+def with_records(rows) -> bytes:
+    page = HistoryPageRecord(
+        items=[history_record(row) for row in rows], next_cursor=None,
+    )
+    return orjson.dumps(page)
+
+
+def measure(serialise, rows, rounds: int):
+    best = min(_timed(serialise, rows) for _ in range(rounds))
+    tracemalloc.start()
+    body = serialise(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return body, best, peak
+
+
+def _timed(serialise, rows) -> float:
+    started = time.process_time()
+    serialise(rows)
+    return time.process_time() - started
+
+
+def main(count: int, rounds: int):
+    rows = make_rows(count)
+    results = {}
+    print(f'{count} rows, best of {rounds}')
+    print(f'{"":10} {"cpu ms":>9} {"peak MiB":>9} {"bytes":>9}')
+    for name, serialise in (('pydantic', with_pydantic),
+                            ('records', with_records)):
+        body, cpu, peak = measure(serialise, rows, rounds)
+        results[name] = body
+        print(f'{name:10} {cpu * 1000:9.1f} {peak / 2 ** 20:9.1f} '
+              f'{len(body):9d}')
+    assert (json.loads(results['pydantic'])
+            == json.loads(results['records'])), 'outputs differ'
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*(args + [10000, 5][len(args):]))
@@ -0,0 +1,96 @@
+"""Cold start report: module import times and time to first request.
+
+The import part runs ``python -X importtime -c 'import main'`` in a fresh
+interpreter and lists the slowest modules. With ``--serve`` the app is
+started under uvicorn (Postgres has to be reachable for the startup
+hooks) and the time from spawning the process to the first successful
+response of ``path`` is measured.
+
+Usage (from ``src``): python -m benchmarks.startup [--serve] [--top N] [path]
+"""
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            rows.append((name, int(own), int(cumulative), len(indent) // 2))
+    return rows
+
+
+def import_report(top: int):
+    rows = import_times()
+    total = next(cumulative for name, _, cumulative, _ in rows if name == 'main')
+    print(f'import main: {total / 1000:.1f} ms')
+    print(f'\n{"slowest packages":40} {"cumulative ms":>14}')
+    packages = [row for row in rows if row[3] == 1]
+    for name, _, cumulative, _ in sorted(packages, key=lambda row: -row[2])[:top]:
+        print(f'{name:40} {cumulative / 1000:14.1f}')
+    print(f'\n{"slowest modules":40} {"self ms":>14}')
+    for name, own, _, _ in sorted(rows, key=lambda row: -row[1])[:top]:
+        print(f'{name:40} {own / 1000:14.1f}')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def first_request(path: str, deadline: float = 30.0):
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port)],
+        cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - started < deadline:
+            if server.poll() is not None:
+                print(server.stderr.read().decode()[-2000:])
+                raise SystemExit('the app exited during startup')
+            try:
+                with urllib.request.urlopen(
+                    f'http://127.0.0.1:{port}{path}', timeout=1
+                ) as response:
+                    elapsed = time.perf_counter() - started
+                    print(f'\nfirst response {response.status} from {path} '
+                          f'after {elapsed * 1000:.0f} ms')
+                    return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise SystemExit(f'no response within {deadline} s')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(args):
+    top = 15
+    if '--top' in args:
+        top = int(args[args.index('--top') + 1])
+    paths = [arg for arg in args if arg.startswith('/')]
+    import_report(top)
+    if '--serve' in args:
+        first_request(paths[0] if paths else '/api/openapi.json')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
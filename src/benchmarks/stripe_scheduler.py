@@ -0,0 +1,136 @@
+"""Checkout latency while a batch job floods Stripe, with and without pacing.
+
+Starts the fake Stripe server in process with an account limit of
+``limit`` requests per second. A batch flood of ``Subscription.retrieve``
+calls runs next to a steady stream of interactive
+``checkout.Session.create`` calls, first through a gateway paced below
+the limit, then through one that is not (rate far above the limit, so
+only the 429 handling holds it back). Prints the latency percentiles of
+both lanes and the 429s the fake answered.
+
+Then checks that the paced run got no 429, that its checkout p99 is
+below half of the unpaced one, and that queued callers are served
+strictly by priority and in arrival order within a lane. Exits non-zero
+on a failed check.
+
+Usage (from ``src``): python -m benchmarks.stripe_scheduler [limit] [batch]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks.fakes.stripe_server import FakeStripe, start_server
+from benchmarks.startup import free_port
+from core.stripe_gateway import StripeGateway
+from core.stripe_scheduler import Priority, StripeScheduler
+
+failed = []
+
+
+def check(name: str, ok: bool, detail: str = ''):
+    print(f'{"ok  " if ok else "FAIL"} {name}{f" ({detail})" if detail else ""}')
+    if not ok:
+        failed.append(name)
+
+
+async def timed(call, latencies):
+    started = time.perf_counter()
+    await call
+    latencies.append(time.perf_counter() - started)
+
+
+def percentiles(latencies) -> str:
+    if len(latencies) < 2:
+        return 'n/a'
+    cuts = statistics.quantiles(latencies, n=100)
+    return (f'p50 {cuts[49] * 1000:7.0f} ms  p99 {cuts[98] * 1000:7.0f} ms  '
+            f'n={len(latencies)}')
+
+
+def p99(latencies) -> float:
+    return statistics.quantiles(latencies, n=100)[98]
+
+
+async def scenario(name, fake, port, rate, batch):
+    gateway = StripeGateway(
+        api_key='sk_test_fake', max_workers=32, max_concurrency=32,
+        timeout=60, api_base=f'http://127.0.0.1:{port}', rate=rate,
+        burst=max(1, int(rate) // 4), rate_limit_retries=10,
+    )
+    fake.stats.clear()
+    batch_latency, checkout_latency = [], []
+    started = time.perf_counter()
+    flood = asyncio.gather(*(
+        timed(gateway.request('Subscription.retrieve', f'sub_bench{number}',
+                              priority=Priority.batch), batch_latency)
+        for number in range(batch)
+    ))
+    checkouts = []
+    while not flood.done():
+        checkouts.append(asyncio.ensure_future(timed(gateway.request(
+            'checkout.Session.create', mode='subscription',
+            line_items=[{'price': 'price_fake', 'quantity': 1}],
+        ), checkout_latency)))
+        await asyncio.sleep(0.1)
+    await flood
+    await asyncio.gather(*checkouts)
+    gateway.close()
+    throttled = sum(count for (_, _, status), count in fake.stats.items()
+                    if status == 429)
+    print(f'\n{name}: {time.perf_counter() - started:.1f}s, '
+          f'{throttled} answers 429')
+    print(f'  checkout  {percentiles(checkout_latency)}')
+    print(f'  batch     {percentiles(batch_latency)}')
+    return throttled, checkout_latency
+
+
+async def priority_order():
+    """Served order of callers queued behind an empty bucket."""
+    scheduler = StripeScheduler(rate=100, burst=1)
+    await scheduler.acquire(Priority.interactive)
+    served = []
+
+    async def call(priority, number):
+        await scheduler.acquire(priority)
+        served.append((priority, number))
+
+    # Queued lowest priority first, two callers per lane.
+    calls = [asyncio.ensure_future(call(priority, number))
+             for priority in reversed(Priority) for number in range(2)]
+    await asyncio.gather(*calls)
+    return served
+
+
+async def main(limit: int, batch: int):
+    fake = FakeStripe(rate=limit)
+    port = free_port()
+    server = await start_server(port, fake)
+    try:
+        paced_429, paced = await scenario(
+            'paced below the limit', fake, port, limit * 0.8, batch)
+        # Let the fake's window of the first run expire.
+        await asyncio.sleep(1)
+        _, unpaced = await scenario('unpaced', fake, port, 10000, batch)
+    finally:
+        server.should_exit = True
+        await asyncio.sleep(0.2)
+
+    print()
+    check('no 429 when paced', paced_429 == 0, f'{paced_429} answers 429')
+    check('paced checkout p99 below half of the unpaced one',
+          p99(paced) < p99(unpaced) / 2,
+          f'{p99(paced) * 1000:.0f} ms vs {p99(unpaced) * 1000:.0f} ms')
+    served = await priority_order()
+    expected = [(priority, number)
+                for priority in Priority for number in range(2)]
+    check('queued callers served by priority, then arrival',
+          served == expected,
+          ', '.join(f'{priority.name}{number}' for priority, number in served))
+    print('ok' if not failed else f'{len(failed)} checks failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    sys.exit(asyncio.run(main(*(args + [50, 300][len(args):]))))
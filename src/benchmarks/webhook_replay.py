@@ -0,0 +1,278 @@
+"""Replay shuffled Stripe event streams through the webhook queue.
+
+Generates a lifecycle per synthetic customer (checkout completed,
+subscription created, invoices paid, subscription updates) with
+redeliveries and a checkout event delivered twice at once. After the
+checkout events a customer's events arrive shuffled, as Stripe does not
+guarantee their order, and customers are fed concurrently so their
+streams interleave randomly. With several ``processes`` the events are
+spread over as many queues, each with its own database pool, and only
+the advisory locks keep a customer serialised. When every event is
+processed the script checks the final state: one ``stripe_customer`` row
+per customer, one history row per invoice and subscription event, the
+mirror on the last subscription status by event time and no failed
+event. Replay data is deleted afterwards.
+
+Usage (from ``src`` with migrations applied):
+    python -m benchmarks.webhook_replay [customers] [processes]
+"""
+import asyncio
+import random
+import sys
+import time
+import uuid
+
+from sqlalchemy import delete, func, select
+
+from core.db import db_init
+from db.sql_model import (
+    AuthOutbox,
+    BillingHistory,
+    Price,
+    Product,
+    StripeCustomer,
+    StripeEvent,
+    StripeEventStatus,
+    Subscription,
+)
+from services.auth_outbox import AuthOutboxService
+from services.subscription_mirror import SubscriptionMirrorService
+from services.subscription_status import SubscriptionStatusCache
+from services.webhook_queue import WebhookEventQueue
+from services.webhook_service import WebhookSubscriptionService
+
+STATUSES = ('active', 'past_due', 'active', 'canceled')
+
+
+class FakeStripeGateway:
+    """Answers ``Subscription.retrieve`` with the final generated state."""
+
+    def __init__(self):
+        self.subscriptions = {}
+
+    async def request(self, endpoint, *args, **params):
+        await asyncio.sleep(0.001)
+        return self.subscriptions[args[0]]
+
+
+def subscription_object(subscription_id, customer_id, price_id, status):
+    return {
+        'id': subscription_id,
+        'customer': customer_id,
+        'status': status,
+        'plan': {'id': price_id},
+        'current_period_start': 1660000000,
+        'current_period_end': 1662678400,
+        'cancel_at_period_end': status == 'canceled',
+    }
+
+
+def customer_stream(run, number, price_id, gateway):
+    customer_id = f'cus_{run}_{number}'
+    subscription_id = f'sub_{run}_{number}'
+    user_id = str(uuid.uuid4())
+
+    created = iter(range(1660000000, 1660000000 + 100))
+
+    def event(kind, data):
+        return {'id': f'evt_{uuid.uuid4().hex}', 'type': kind, 'data': data,
+                'created': next(created)}
+
+    checkout = {'object': {'id': f'cs_{run}_{number}',
+                           'customer': customer_id,
+                           'metadata': {'user_id': user_id}}}
+    events = [
+        event('checkout.session.completed', checkout),
+        # A second session of the same customer races on the mapping.
+        event('checkout.session.completed', checkout),
+        event('customer.subscription.created', {'object': subscription_object(
+            subscription_id, customer_id, price_id, 'active')}),
+    ]
+    status = 'active'
+    for month, new_status in enumerate(STATUSES[1:], start=1):
+        events.append(event('invoice.paid', {'object': {
+            'id': f'in_{run}_{number}_{month}',
+            'customer': customer_id,
+            'subscription': subscription_id,
+            'status': 'paid',
+            'paid': True,
+            'period_end': 1662678400,
+            'lines': {'data': [{'price': {'id': price_id}}]},
+        }}))
+        events.append(event('customer.subscription.updated', {
+            'object': subscription_object(
+                subscription_id, customer_id, price_id, new_status),
+            'previous_attributes': {'status': status},
+        }))
+        status = new_status
+    gateway.subscriptions[subscription_id] = subscription_object(
+        subscription_id, customer_id, price_id, status)
+    return customer_id, status, events
+
+
+async def feed(queues, events):
+    """Deliver one customer's events shuffled, with random gaps.
+
+    The checkout events come first, as the other events need the
+    customer mapping. Customers are fed concurrently, so their streams
+    interleave differently on every run. With several processes each
+    event goes to a random one, as behind a load balancer.
+    """
+    # Both checkout events at once race on the customer mapping.
+    await asyncio.gather(*(
+        random.choice(queues).ingest(event) for event in events[:2]
+    ))
+    rest = random.sample(events[2:], len(events) - 2)
+    for event in rest:
+        await asyncio.sleep(random.random() / 100)
+        await random.choice(queues).ingest(event)
+
+
+async def main(customers: int, processes: int) -> int:
+    database = db_init()
+    await database.connect()
+    run = uuid.uuid4().hex[:8]
+    gateway = FakeStripeGateway()
+    product_id, price_row_id = uuid.uuid4(), uuid.uuid4()
+    price_id = f'price_{run}'
+    await database.execute(Product.__table__.insert().values(
+        id=product_id, stripe_product_id=f'prod_{run}', name=f'replay {run}',
+        active=True,
+    ))
+    await database.execute(Price.__table__.insert().values(
+        id=price_row_id, stripe_product_id=f'prod_{run}',
+        stripe_price_id=price_id, name='replay', active=True,
+        type='recurring', unit_amount=100, currency='usd', permission_id=1,
+        product_id=product_id,
+    ))
+
+    expected = {}
+    streams = []
+    for number in range(customers):
+        customer_id, status, events = customer_stream(
+            run, number, price_id, gateway)
+        expected[customer_id] = status
+        # Stripe redelivers: some events arrive twice.
+        events += random.sample(events, 2)
+        streams.append(events)
+
+    queues = []
+    # A Database shares one connection per task, so each simulated
+    # process needs its own to take its advisory locks separately.
+    process_databases = [db_init() for _ in range(processes)]
+    for process_database in process_databases:
+        await process_database.connect()
+        outbox = AuthOutboxService(process_database, None, batch_size=100,
+                                   poll_interval=60, lease=60, max_backoff=60)
+        service = WebhookSubscriptionService(
+            process_database, gateway, outbox,
+            SubscriptionMirrorService(process_database, gateway),
+            SubscriptionStatusCache(maxsize=customers, ttl=30),
+        )
+        queue = WebhookEventQueue(process_database, service, workers=8,
+                                  background=True)
+        await queue.start()
+        queues.append(queue)
+
+    customer_ids = list(expected)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            feed(queues, events) for events in streams
+        ))
+        while await database.fetch_val(
+            select(func.count()).select_from(StripeEvent).where(
+                StripeEvent.customer_id.in_(customer_ids),
+                StripeEvent.status == StripeEventStatus.pending.value,
+            )
+        ):
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        unique_events = len({
+            event['id'] for events in streams for event in events
+        })
+        print(f'{unique_events} events of {customers} customers in '
+              f'{elapsed:.2f}s ({unique_events / elapsed:.0f}/s), '
+              f'{processes} process(es)')
+        return await check(database, expected)
+    finally:
+        for queue in queues:
+            await queue.stop()
+        for process_database in process_databases:
+            await process_database.disconnect()
+        await cleanup(database, customer_ids, product_id, price_row_id)
+        await database.disconnect()
+
+
+async def check(database, expected) -> int:
+    customer_ids = list(expected)
+    errors = []
+    failed = await database.fetch_all(
+        select(StripeEvent.id, StripeEvent.error).where(
+            StripeEvent.customer_id.in_(customer_ids),
+            StripeEvent.status == StripeEventStatus.failed.value,
+        )
+    )
+    errors += [f'event {row.id} failed: {row.error}' for row in failed]
+
+    mapped = await database.fetch_all(
+        select(StripeCustomer.stripe_customer_id, func.count()).where(
+            StripeCustomer.stripe_customer_id.in_(customer_ids)
+        ).group_by(StripeCustomer.stripe_customer_id)
+    )
+    counts = {row[0]: row[1] for row in mapped}
+    for customer_id in customer_ids:
+        if counts.get(customer_id) != 1:
+            errors.append(f'{customer_id} mapped {counts.get(customer_id, 0)} times')
+
+    history_rows = await database.fetch_val(
+        select(func.count()).select_from(BillingHistory).join(
+            StripeCustomer, StripeCustomer.id == BillingHistory.stripe_customer
+        ).where(StripeCustomer.stripe_customer_id.in_(customer_ids))
+    )
+    # Subscription created, then an invoice and an update per month.
+    expected_rows = len(customer_ids) * (1 + 2 * (len(STATUSES) - 1))
+    if history_rows != expected_rows:
+        errors.append(f'{history_rows} history rows, expected {expected_rows}')
+
+    mirrored = await database.fetch_all(
+        select(Subscription.stripe_customer_id, Subscription.status).where(
+            Subscription.stripe_customer_id.in_(customer_ids)
+        )
+    )
+    for row in mirrored:
+        if row.status != expected[row.stripe_customer_id]:
+            errors.append(f'{row.stripe_customer_id} mirrored as '
+                          f'{row.status}, expected '
+                          f'{expected[row.stripe_customer_id]}')
+
+    for error in errors[:20]:
+        print('FAIL', error)
+    print('ok' if not errors else f'{len(errors)} problems')
+    return 1 if errors else 0
+
+
+async def cleanup(database, customer_ids, product_id, price_row_id):
+    customer_rows = select(StripeCustomer.id).where(
+        StripeCustomer.stripe_customer_id.in_(customer_ids)
+    )
+    user_ids = select(StripeCustomer.user_id).where(
+        StripeCustomer.stripe_customer_id.in_(customer_ids)
+    )
+    await database.execute(delete(BillingHistory).where(
+        BillingHistory.stripe_customer.in_(customer_rows)))
+    await database.execute(delete(AuthOutbox).where(
+        AuthOutbox.user_id.in_(user_ids)))
+    await database.execute(delete(Subscription).where(
+        Subscription.stripe_customer_id.in_(customer_ids)))
+    await database.execute(delete(StripeCustomer).where(
+        StripeCustomer.stripe_customer_id.in_(customer_ids)))
+    await database.execute(delete(StripeEvent).where(
+        StripeEvent.customer_id.in_(customer_ids)))
+    await database.execute(delete(Price).where(Price.id == price_row_id))
+    await database.execute(delete(Product).where(Product.id == product_id))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    sys.exit(asyncio.run(main(*(args + [200, 1][len(args):]))))
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class AuthNotifier:
+    """Keep-alive pooled HTTP client pushing entitlements to the auth service."""
+
+    def __init__(
+            self,
+            url: str,
+            api_key: str,
+            timeout: float,
+            max_connections: int,
+            retries: int,
+            backoff: float,
+    ):
+        self.url = url
+        self.retries = retries
+        self.backoff = backoff
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            headers={'APIKEY': api_key},
+        )
+
+    async def push(self, payload: dict):
+        """POST payload, retrying transport errors and 5xx with backoff."""
+        attempt = 0
+        while True:
+            try:
+                response = await self._client.post(self.url, json=payload)
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    return
+                error = httpx.HTTPStatusError(
+                    f'Auth service answered {response.status_code}',
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as transport_error:
+                error = transport_error
+            attempt += 1
+            if attempt > self.retries:
+                raise error
+            delay = self.backoff * 2 ** (attempt - 1)
+            logger.warning('Auth push failed (%s), retry in %.2fs', error, delay)
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+notifier: Optional[AuthNotifier] = None
+
+
+async def get_auth_notifier() -> AuthNotifier:
+    return notifier
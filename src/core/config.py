@@ -1,30 +1,115 @@
 import os
-from logging import config as logging_config
+from functools import lru_cache
 
 from pydantic import BaseSettings, Field
 
-from core.logger import LOGGING
+from core.logger import configure_logging
 
 
 class Settings(BaseSettings):
     project_name: str = Field('billing_app', env='PROJECT_NAME')
+    # Логи одной JSON-строкой, запись в stdout из отдельного потока
+    log_json: bool = Field(False, env='LOG_JSON')
+    log_queue: bool = Field(True, env='LOG_QUEUE')
+    # Доля успешных запросов в логе доступа uvicorn, ошибки пишутся все
+    log_access_sample_rate: float = Field(1.0, env='LOG_ACCESS_SAMPLE_RATE')
+    # Замер времени запросов по маршрутам и доля БД, Stripe, auth и сериализации
+    profiling_enabled: bool = Field(False, env='PROFILING_ENABLED')
+    # Доля запросов, для которых сохраняется профиль, и токен заголовка X-Profile
+    profiling_sample_rate: float = Field(0.0, env='PROFILING_SAMPLE_RATE')
+    profiling_token: str = Field('', env='PROFILING_TOKEN')
+    profiling_dir: str = Field('/tmp/billing-profiles', env='PROFILING_DIR')
     auth_grpc_host: str = Field('localhost', env='AUTH_GRPC_HOST')
     auth_grpc_port: int = Field(50051, env='AUTH_GRPC_PORT')
+    auth_grpc_target: str = Field('', env='AUTH_GRPC_TARGET')
+    auth_grpc_timeout: float = Field(0.5, env='AUTH_GRPC_TIMEOUT')
+    # Попыток на вызов, включая первую; 0 или 1 — без повторов
+    auth_grpc_retries: int = Field(3, env='AUTH_GRPC_RETRIES')
+    auth_grpc_keepalive_time_ms: int = Field(30000, env='AUTH_GRPC_KEEPALIVE_TIME_MS')
+    auth_grpc_keepalive_timeout_ms: int = Field(10000, env='AUTH_GRPC_KEEPALIVE_TIMEOUT_MS')
+    # Пинги и без активных вызовов: сервер должен разрешать их
+    # (grpc.keepalive_permit_without_calls=1 и
+    # grpc.http2.min_ping_interval_without_data_ms не больше интервала),
+    # иначе он закрывает соединение с GOAWAY too_many_pings
+    auth_grpc_keepalive_without_calls: bool = Field(
+        False, env='AUTH_GRPC_KEEPALIVE_WITHOUT_CALLS'
+    )
+    auth_breaker_failures: int = Field(5, env='AUTH_BREAKER_FAILURES')
+    auth_breaker_reset: float = Field(10.0, env='AUTH_BREAKER_RESET')
+    auth_cache_size: int = Field(10000, env='AUTH_CACHE_SIZE')
+    auth_cache_ttl: float = Field(60.0, env='AUTH_CACHE_TTL')
+    auth_cache_negative_ttl: float = Field(10.0, env='AUTH_CACHE_NEGATIVE_TTL')
+    # Сколько секунд после истечения TTL отдавать токен из кеша при недоступном auth
+    auth_cache_stale_ttl: float = Field(0.0, env='AUTH_CACHE_STALE_TTL')
 
     db_postgres_host: str = Field('localhost', env='POSTGRES_HOST')
     db_postgres_user: str = Field('postgres_bill', env='POSTGRES_USER')
     db_postgres_password: str = Field('postgres_bill', env='POSTGRES_PASSWORD')
     db_postgres_port: int = Field(5432, env='POSTGRES_PORT')
     db_postgres_name: str = Field('bill', env='POSTGRES_DB')
+    # Пул соединений asyncpg: держим max_size * число воркеров < max_connections
+    db_pool_min_size: int = Field(5, env='DB_POOL_MIN_SIZE')
+    db_pool_max_size: int = Field(20, env='DB_POOL_MAX_SIZE')
+    db_statement_cache_size: int = Field(100, env='DB_STATEMENT_CACHE_SIZE')
+    db_command_timeout: float = Field(30.0, env='DB_COMMAND_TIMEOUT')
+    db_max_inactive_connection_lifetime: float = Field(
+        300.0, env='DB_MAX_INACTIVE_CONNECTION_LIFETIME')
 
     stripe_key: str = Field(
         'sk_test_51LJIvZL2WckhhXcwi3Rj0gpSLpBO9tS1jXaMdYvwWVgzWAqbc4puXZj5xTL4TdK6GfD0hmCmIt4q77sWOm34d9nU00nuX5ZXSd',
         env='STRIPE_KEY')
 
+    stripe_max_workers: int = Field(8, env='STRIPE_MAX_WORKERS')
+    stripe_max_concurrency: int = Field(32, env='STRIPE_MAX_CONCURRENCY')
+    stripe_timeout: float = Field(10.0, env='STRIPE_TIMEOUT')
+    # Лимит запросов к Stripe в секунду на процесс и запас на всплески
+    stripe_rate: float = Field(25.0, env='STRIPE_RATE')
+    stripe_burst: int = Field(25, env='STRIPE_BURST')
+    # Сколько раз повторять запрос после ответа 429
+    stripe_rate_limit_retries: int = Field(3, env='STRIPE_RATE_LIMIT_RETRIES')
+    # Адрес API Stripe, для локальной заглушки например http://localhost:12111
+    stripe_api_base: str = Field('', env='STRIPE_API_BASE')
+    backfill_batch_size: int = Field(2000, env='BACKFILL_BATCH_SIZE')
+    # Массовая смена тарифов: параллельных запросов к Stripe. Темп задает
+    # очередь batch в планировщике Stripe (STRIPE_RATE)
+    migration_concurrency: int = Field(8, env='MIGRATION_CONCURRENCY')
+
     stripe_webhook_secret: str = Field(
         '',
         env='WEBHOOK_SECRET',
     )
+    # Рассылать сброс кеша каталога другим воркерам через Postgres NOTIFY
+    catalog_listen: bool = Field(True, env='CATALOG_LISTEN')
+    # Каталог в памяти перечитывается не реже, чем раз в столько секунд
+    catalog_cache_max_age: float = Field(300.0, env='CATALOG_CACHE_MAX_AGE')
+    # Сколько секунд помнить, есть ли у пользователя активная подписка
+    subscription_status_ttl: float = Field(30.0, env='SUBSCRIPTION_STATUS_TTL')
+    subscription_status_cache_size: int = Field(
+        100000, env='SUBSCRIPTION_STATUS_CACHE_SIZE'
+    )
+    subscription_status_listen: bool = Field(
+        True, env='SUBSCRIPTION_STATUS_LISTEN'
+    )
+
+    webhook_background: bool = Field(True, env='WEBHOOK_BACKGROUND')
+    webhook_workers: int = Field(8, env='WEBHOOK_WORKERS')
+    # Повтор упавших событий: число попыток, пауза с удвоением и ее предел
+    webhook_max_attempts: int = Field(10, env='WEBHOOK_MAX_ATTEMPTS')
+    webhook_retry_backoff: float = Field(5.0, env='WEBHOOK_RETRY_BACKOFF')
+    webhook_retry_max_backoff: float = Field(
+        3600.0, env='WEBHOOK_RETRY_MAX_BACKOFF'
+    )
+    webhook_retry_poll_interval: float = Field(
+        10.0, env='WEBHOOK_RETRY_POLL_INTERVAL'
+    )
+
+    # Повторные клики в пределах окна получают ту же сессию Stripe
+    checkout_idempotency_window: int = Field(
+        60, env='CHECKOUT_IDEMPOTENCY_WINDOW'
+    )
+    # Время жизни сессии оплаты, Stripe допускает от 30 минут до 24 часов
+    checkout_session_ttl: int = Field(3600, env='CHECKOUT_SESSION_TTL')
+
     subscription_url: str = Field(
         'http://127.0.0.1:8000/api/v1/subscription',
         env='SUBSCRIPTION_URL',
@@ -39,13 +124,31 @@ class Settings(BaseSettings):
         'http://127.0.0.1:80/api/v1/user/role',
         env='AUTH_PATH_URL',
     )
+    auth_push_timeout: float = Field(5.0, env='AUTH_PUSH_TIMEOUT')
+    auth_push_max_connections: int = Field(10, env='AUTH_PUSH_MAX_CONNECTIONS')
+    auth_push_retries: int = Field(3, env='AUTH_PUSH_RETRIES')
+    auth_push_backoff: float = Field(0.5, env='AUTH_PUSH_BACKOFF')
+    auth_outbox_batch_size: int = Field(100, env='AUTH_OUTBOX_BATCH_SIZE')
+    auth_outbox_poll_interval: float = Field(5.0, env='AUTH_OUTBOX_POLL_INTERVAL')
+    auth_outbox_lease: float = Field(60.0, env='AUTH_OUTBOX_LEASE')
+    auth_outbox_max_backoff: float = Field(600.0, env='AUTH_OUTBOX_MAX_BACKOFF')
 
     class Config:
         env_file = '.env'
 
 
+@lru_cache()
+def get_settings() -> Settings:
+    """The process wide settings, ``.env`` is read only on the first call."""
+    return Settings()
+
+
 # Применяем настройки логирования
-logging_config.dictConfig(LOGGING)
+configure_logging(
+    json_format=get_settings().log_json,
+    use_queue=get_settings().log_queue,
+    access_sample_rate=get_settings().log_access_sample_rate,
+)
 
 # Корень проекта
 
@@ -3,6 +3,9 @@
 # Occurs whenever a new customer is created by checkout session.
 CUSTOMER_CREATED_EVENT = 'checkout.session.completed'
 
+# Checkout session expired without payment.
+CHECKOUT_SESSION_EXPIRED = 'checkout.session.expired'
+
 # Occurs whenever a customer is signed up for a new plan.
 CUSTOMER_SUBSCRIPTION_CREATED = 'customer.subscription.created'
 
@@ -14,3 +17,6 @@ PAYMENT_FAILED = 'invoice.payment_failed'
 
 # Occurs whenever a customer is changed up for a new plan or canceled subscription.
 CUSTOMER_SUBSCRIPTION_UPDATED = 'customer.subscription.updated'
+
+# Occurs whenever a customer's subscription ends.
+CUSTOMER_SUBSCRIPTION_DELETED = 'customer.subscription.deleted'
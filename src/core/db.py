@@ -1,20 +1,16 @@
-# import os
-#
-# from sqlmodel import SQLModel
-#
-# from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-# from sqlalchemy.orm import sessionmaker
-#
+import time
 from typing import Optional
 
 import databases
 import sqlalchemy
 from databases import Database
-from sqlalchemy.ext.asyncio import create_async_engine
+from databases.backends.postgres import PostgresBackend, PostgresConnection
 
-from core.config import Settings
+from core.config import get_settings
+from core.metrics import Counter, Gauge, Histogram
+from core.profiling import timed
 
-settings = Settings()
+settings = get_settings()
 
 pg: Optional[Database] = None
 db_postgres_url: str = 'postgresql+asyncpg://{}:{}@{}:{}/{}'.format(
@@ -24,14 +20,95 @@ db_postgres_url: str = 'postgresql+asyncpg://{}:{}@{}:{}/{}'.format(
     settings.db_postgres_port,
     settings.db_postgres_name
 )
-engine = create_async_engine(db_postgres_url, echo=True, future=True)
+db_postgres_dsn: str = db_postgres_url.replace('postgresql+asyncpg', 'postgresql')
 
 metadata = sqlalchemy.MetaData()
 
+db_pool_connections = Gauge(
+    'db_pool_connections',
+    'Connections of the asyncpg pool by state',
+    labels=('state',),
+)
+db_pool_acquire_seconds = Histogram(
+    'db_pool_acquire_seconds',
+    'Time spent waiting for a free pool connection',
+)
+db_queries = Counter(
+    'db_queries_total',
+    'Statements sent to Postgres',
+)
+
+
+class InstrumentedPostgresConnection(PostgresConnection):
+    """Records the pool wait time, the queries and how many connections
+    are busy.
+
+    Waits and queries also count as ``db`` time of the current request.
+    """
+
+    async def acquire(self) -> None:
+        started = time.perf_counter()
+        with timed('db'):
+            await super().acquire()
+        db_pool_acquire_seconds.observe(time.perf_counter() - started)
+        self._report()
+
+    async def release(self) -> None:
+        await super().release()
+        self._report()
+
+    async def fetch_all(self, query):
+        db_queries.inc()
+        with timed('db'):
+            return await super().fetch_all(query)
+
+    async def fetch_one(self, query):
+        db_queries.inc()
+        with timed('db'):
+            return await super().fetch_one(query)
+
+    async def execute(self, query):
+        db_queries.inc()
+        with timed('db'):
+            return await super().execute(query)
+
+    async def execute_many(self, queries):
+        db_queries.inc(len(queries))
+        with timed('db'):
+            return await super().execute_many(queries)
+
+    def _report(self):
+        pool = self._database._pool
+        if pool is None:
+            return
+        size, idle = pool.get_size(), pool.get_idle_size()
+        db_pool_connections.set(size - idle, state='in_use')
+        db_pool_connections.set(idle, state='idle')
+        db_pool_connections.set(pool.get_max_size(), state='max')
+
+
+class InstrumentedPostgresBackend(PostgresBackend):
+    def connection(self) -> InstrumentedPostgresConnection:
+        return InstrumentedPostgresConnection(self, self._dialect)
+
+
+class PoolDatabase(databases.Database):
+    SUPPORTED_BACKENDS = {
+        **databases.Database.SUPPORTED_BACKENDS,
+        'postgresql+asyncpg': 'core.db:InstrumentedPostgresBackend',
+    }
+
 
 def db_init():
-    database = databases.Database(db_postgres_url)
-    return database
+    # Параметры передаются в asyncpg.create_pool
+    return PoolDatabase(
+        db_postgres_url,
+        min_size=settings.db_pool_min_size,
+        max_size=settings.db_pool_max_size,
+        statement_cache_size=settings.db_statement_cache_size,
+        command_timeout=settings.db_command_timeout,
+        max_inactive_connection_lifetime=settings.db_max_inactive_connection_lifetime,
+    )
 
 
 async def get_pg() -> Database:
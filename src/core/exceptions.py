@@ -1,2 +1,6 @@
 class ValidateSubscriptionError(Exception):
     pass
+
+
+class StripeGatewayTimeoutError(Exception):
+    pass
@@ -0,0 +1,71 @@
+"""Ids attached to every log record of the current request or event.
+
+``ContextFilter`` copies them onto the records, where the JSON formatter
+writes them out. ``RequestIdMiddleware`` takes ``X-Request-ID`` from the
+caller, or makes one up, and echoes it in the response; the webhook
+queue binds the Stripe event and customer it is applying.
+"""
+import logging
+import re
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+REQUEST_ID_HEADER = b'x-request-id'
+VALID_REQUEST_ID = re.compile(rb'[A-Za-z0-9._-]{1,64}')
+
+request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+stripe_event_id: ContextVar[Optional[str]] = ContextVar(
+    'stripe_event_id', default=None
+)
+stripe_customer_id: ContextVar[Optional[str]] = ContextVar(
+    'stripe_customer_id', default=None
+)
+
+FIELDS = {
+    'request_id': request_id,
+    'stripe_event_id': stripe_event_id,
+    'stripe_customer_id': stripe_customer_id,
+}
+
+
+def bind_stripe_event(event_id: str, customer_id: Optional[str] = None):
+    stripe_event_id.set(event_id)
+    stripe_customer_id.set(customer_id)
+
+
+class ContextFilter(logging.Filter):
+    """Sets the context ids on a record, once.
+
+    Must run in the thread that logs: a record queued for the listener
+    thread already carries them and is left alone there.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, variable in FIELDS.items():
+            if not hasattr(record, name):
+                setattr(record, name, variable.get())
+        return True
+
+
+class RequestIdMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        value = dict(scope['headers']).get(REQUEST_ID_HEADER, b'')
+        if not VALID_REQUEST_ID.fullmatch(value):
+            value = uuid.uuid4().hex.encode()
+        request_id.set(value.decode())
+
+        async def send_with_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [
+                    *message.get('headers', []), (REQUEST_ID_HEADER, value),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_id)
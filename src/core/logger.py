@@ -1,3 +1,17 @@
+import atexit
+import copy
+import datetime
+import logging
+import queue
+import random
+from logging import config as logging_config
+from logging.handlers import QueueHandler, QueueListener
+from typing import List
+
+import orjson
+
+from core.log_context import ContextFilter
+
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_DEFAULT_HANDLERS = ['console', ]
 
@@ -23,21 +37,29 @@ LOGGING = {
             'fmt': "%(levelprefix)s %(client_addr)s - '%(request_line)s' %(status_code)s",
         },
     },
+    'filters': {
+        'context': {
+            '()': 'core.log_context.ContextFilter',
+        },
+    },
     'handlers': {
         'console': {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
+            'filters': ['context'],
         },
         'default': {
             'formatter': 'default',
             'class': 'logging.StreamHandler',
             'stream': 'ext://sys.stdout',
+            'filters': ['context'],
         },
         'access': {
             'formatter': 'access',
             'class': 'logging.StreamHandler',
             'stream': 'ext://sys.stdout',
+            'filters': ['context'],
         },
     },
     'loggers': {
@@ -45,6 +67,11 @@ LOGGING = {
             'handlers': LOG_DEFAULT_HANDLERS,
             'level': 'INFO',
         },
+        'uvicorn': {
+            'handlers': ['default'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'uvicorn.error': {
             'level': 'INFO',
         },
@@ -60,3 +87,123 @@ LOGGING = {
         'handlers': LOG_DEFAULT_HANDLERS,
     },
 }
+
+# Логгеры со своими обработчиками; в режиме очереди их вывод уходит в поток
+QUEUED_LOGGERS = ('', 'uvicorn', 'uvicorn.access')
+# Неизменяемые аргументы записи можно передать в поток вывода как есть
+SCALARS = (str, int, float, bool, type(None))
+
+_listeners: List[QueueListener] = []
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the context ids when they are set."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in ('request_id', 'stripe_event_id', 'stripe_customer_id'):
+            value = getattr(record, name, None)
+            if value:
+                entry[name] = value
+        if record.name == 'uvicorn.access' and len(record.args or ()) == 5:
+            client, method, path, _, status = record.args
+            entry.update(client=client, method=method, path=path,
+                         status=status)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = record.stack_info
+        return orjson.dumps(entry, default=str).decode()
+
+
+class AccessLogSampler(logging.Filter):
+    """Keeps ``rate`` of the uvicorn access lines, all 4xx and 5xx ones."""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        status = record.args[-1] if isinstance(record.args, tuple) else None
+        if isinstance(status, int) and status >= 400:
+            return True
+        return random.random() < self.rate
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to a ``QueueListener`` thread, formatted there.
+
+    Unlike ``QueueHandler.prepare`` the message is only merged when an
+    argument could change before the listener gets to it; uvicorn's
+    access formatter needs its arguments.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+        record = copy.copy(record)
+        record.exc_info = None
+        if record.args and not (isinstance(record.args, tuple) and all(
+                isinstance(arg, SCALARS) for arg in record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def get_logging(json_format: bool = False,
+                access_sample_rate: float = 1.0) -> dict:
+    config = copy.deepcopy(LOGGING)
+    if json_format:
+        config['formatters']['json'] = {'()': 'core.logger.JsonFormatter'}
+        for handler in config['handlers'].values():
+            handler['formatter'] = 'json'
+    if access_sample_rate < 1:
+        config['filters']['access_sample'] = {
+            '()': 'core.logger.AccessLogSampler',
+            'rate': access_sample_rate,
+        }
+        config['loggers']['uvicorn.access']['filters'] = ['access_sample']
+    return config
+
+
+def configure_logging(json_format: bool = False, use_queue: bool = False,
+                      access_sample_rate: float = 1.0):
+    """Apply the config; with ``use_queue`` the handlers write from a thread."""
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+    logging_config.dictConfig(get_logging(json_format, access_sample_rate))
+    if not use_queue:
+        return
+    for name in QUEUED_LOGGERS:
+        logger = logging.getLogger(name)
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(records, *logger.handlers,
+                                 respect_handler_level=True)
+        handler = LogQueueHandler(records)
+        # The ids live in context variables of the logging thread.
+        handler.addFilter(ContextFilter())
+        logger.handlers = [handler]
+        listener.start()
+        _listeners.append(listener)
+
+
+@atexit.register
+def _stop_listeners():
+    # Writes out what is still queued.
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
@@ -0,0 +1,141 @@
+"""In-process metrics shared by the service layers."""
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+REGISTRY: Dict[str, 'Metric'] = {}
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str,
+                 labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _series(self) -> list:
+        with self._lock:
+            return [(key, value if not isinstance(value, dict) else {
+                **value, 'buckets': list(value['buckets']),
+            }) for key, value in self.values.items()]
+
+    def _label_text(self, key: Tuple[str, ...], *extra) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(
+            '{}="{}"'.format(name, _escape(value)) for name, value in pairs
+        )
+
+    def samples(self) -> List[str]:
+        """Lines of the Prometheus text format for every label set."""
+        return [f'{self.name}{self._label_text(key)} {_number(value)}'
+                for key, value in self._series()]
+
+
+class Counter(Metric):
+    """Monotonic counter."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str,
+                 labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Latency histogram with fixed upper bounds per bucket."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str,
+                 labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[Tuple[str, ...], dict] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+            series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self) -> List[str]:
+        # Buckets are stored per interval, Prometheus wants them cumulative.
+        lines = []
+        for key, series in self._series():
+            total = 0
+            for bound, count in zip(self.buckets, series['buckets']):
+                total += count
+                lines.append(f'{self.name}_bucket'
+                             f'{self._label_text(key, ("le", _number(bound)))}'
+                             f' {total}')
+            lines.append(f'{self.name}_bucket'
+                         f'{self._label_text(key, ("le", "+Inf"))}'
+                         f' {series["count"]}')
+            lines.append(f'{self.name}_sum{self._label_text(key)} '
+                         f'{_number(series["sum"])}')
+            lines.append(f'{self.name}_count{self._label_text(key)} '
+                         f'{series["count"]}')
+        return lines
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. connections in use."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str,
+                 labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
@@ -0,0 +1,172 @@
+"""Per-route latency, split by where the time went, and sampled profiles.
+
+``ProfilingMiddleware`` (on with ``PROFILING_ENABLED``) times every
+request into ``http_request_duration_seconds`` by route template, and
+the parts spent in Postgres, Stripe, the auth gRPC calls and JSON/HTML
+rendering into ``http_request_component_seconds``. The parts are
+collected with ``timed(component)`` into a dict held by a context
+variable; tasks started by a request copy the context and so add to the
+same dict. Parts that ran concurrently can add up to more than the wall
+time.
+
+A request is also profiled when ``X-Profile`` carries
+``PROFILING_TOKEN``, or at random with ``PROFILING_SAMPLE_RATE``. The
+profile goes to ``PROFILING_DIR``: a pyinstrument HTML page when
+pyinstrument is installed, a cProfile ``.prof`` dump otherwise. Only one
+request is profiled at a time.
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from fastapi.responses import ORJSONResponse
+from starlette.routing import Match
+
+from core.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+COMPONENTS = ('db', 'stripe', 'auth', 'serialization')
+PROFILE_HEADER = b'x-profile'
+
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    'request_timings', default=None
+)
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Request latency by route template',
+    labels=('method', 'route', 'status'),
+)
+http_request_component = Histogram(
+    'http_request_component_seconds',
+    'Time of a request spent in Postgres, Stripe, auth or serialization',
+    labels=('route', 'component'),
+)
+
+
+@contextmanager
+def timed(component: str):
+    """Add the time of the block to ``component`` of the current request."""
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[component] = (timings.get(component, 0.0)
+                              + time.perf_counter() - started)
+
+
+class TimedORJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        with timed('serialization'):
+            return super().render(content)
+
+
+def route_template(scope) -> str:
+    """``/api/v1/admin/subscriptions/{user_uuid}`` rather than the raw path,
+    so user ids do not become label values."""
+    for route in scope['app'].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, sample_rate: float = 0.0, token: str = '',
+                 directory: str = '/tmp/billing-profiles'):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.token = token.encode()
+        self.directory = directory
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        timings: Dict[str, float] = {}
+        token = request_timings.set(timings)
+        profiler = self._profiler(scope)
+        started = time.perf_counter()
+        try:
+            if profiler is None:
+                await self.app(scope, receive, send_status)
+            else:
+                with profiler:
+                    await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_timings.reset(token)
+            route = route_template(scope)
+            http_request_duration.observe(
+                elapsed, method=scope['method'], route=route, status=status,
+            )
+            for component, seconds in timings.items():
+                http_request_component.observe(
+                    seconds, route=route, component=component,
+                )
+            if profiler is not None:
+                self._profiling = False
+                await self._dump(profiler, scope, elapsed)
+
+    def _profiler(self, scope):
+        if self._profiling:
+            return None
+        wanted = bool(self.token) and dict(scope['headers']).get(
+            PROFILE_HEADER) == self.token
+        if not wanted and not (self.sample_rate
+                               and random.random() < self.sample_rate):
+            return None
+        self._profiling = True
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            return cProfile.Profile()
+        return Profiler(async_mode='enabled')
+
+    async def _dump(self, profiler, scope, elapsed: float):
+        name = '{}-{}-{}'.format(
+            time.strftime('%Y%m%d-%H%M%S'), scope['method'],
+            re.sub(r'[^A-Za-z0-9]+', '_', scope['path']).strip('_')[:80],
+        )
+        if isinstance(profiler, cProfile.Profile):
+            path = os.path.join(self.directory, f'{name}.prof')
+            write = profiler.dump_stats
+        else:
+            path = os.path.join(self.directory, f'{name}.html')
+
+            def write(target):
+                with open(target, 'w') as file:
+                    file.write(profiler.output_html())
+
+        def save():
+            os.makedirs(self.directory, exist_ok=True)
+            write(path)
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, save)
+        except OSError as e:
+            logger.warning('Could not save profile %s: %s', path, e)
+            return
+        logger.info('Profile of %s %s (%.0f ms) saved to %s', scope['method'],
+                    scope['path'], elapsed * 1000, path)
@@ -0,0 +1,93 @@
+"""Hot Core queries compiled once and run as asyncpg prepared statements.
+
+``databases`` compiles every ``select(...)`` on each call. Queries
+registered here are compiled at import time to ``$n`` SQL; asyncpg then
+keeps one prepared statement per SQL text and connection (see
+``DB_STATEMENT_CACHE_SIZE``). Parameters are declared with
+``bindparam('name')`` and passed as keyword arguments.
+"""
+from typing import Dict, List, Optional
+
+from databases import Database
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import ClauseElement
+
+from core.db import db_queries
+from core.profiling import timed
+
+QUERIES: Dict[str, 'CompiledQuery'] = {}
+
+
+def to_asyncpg(query: ClauseElement):
+    """Render a Core query with $n placeholders and its bound values."""
+    compiled = query.compile(
+        dialect=postgresql.dialect(paramstyle='pyformat'),
+        compile_kwargs={'render_postcompile': True},
+    )
+    names = list(compiled.params)
+    sql = compiled.string % {
+        name: f'${number}' for number, name in enumerate(names, start=1)
+    }
+    return sql, names, compiled
+
+
+class Row:
+    """Attribute access over an asyncpg record, like ``databases`` rows."""
+
+    __slots__ = ('_row',)
+
+    def __init__(self, row):
+        self._row = row
+
+    @property
+    def _mapping(self):
+        return self._row
+
+    def __getitem__(self, key):
+        return self._row[key]
+
+    def __getattr__(self, name):
+        try:
+            return self._row[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self):
+        return iter(self._row.keys())
+
+    def __len__(self):
+        return len(self._row)
+
+
+class CompiledQuery:
+    def __init__(self, name: str, query: ClauseElement):
+        self.name = name
+        self.query = query
+        self.sql, self.names, compiled = to_asyncpg(query)
+        self.defaults = compiled.params
+        QUERIES[name] = self
+
+    def args(self, values: dict) -> list:
+        return [values.get(name, self.defaults[name]) for name in self.names]
+
+    async def fetch_one(self, db: Database, **values) -> Optional[Row]:
+        # The task-local connection, so an open transaction is reused. Its
+        # query lock keeps coroutines sharing it from overlapping on asyncpg.
+        async with db.connection() as connection:
+            db_queries.inc()
+            with timed('db'):
+                async with connection._query_lock:
+                    row = await connection.raw_connection.fetchrow(
+                        self.sql, *self.args(values)
+                    )
+        return Row(row) if row is not None else None
+
+    async def fetch_all(self, db: Database, **values) -> List[Row]:
+        async with db.connection() as connection:
+            db_queries.inc()
+            with timed('db'):
+                async with connection._query_lock:
+                    rows = await connection.raw_connection.fetch(
+                        self.sql, *self.args(values)
+                    )
+        return [Row(row) for row in rows]
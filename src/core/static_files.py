@@ -0,0 +1,44 @@
+import hashlib
+import os
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+from starlette.staticfiles import StaticFiles
+
+from core.config import STATIC_DIR
+
+STATIC_URL = '/static'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+@lru_cache(maxsize=None)
+def content_hash(path: str) -> str:
+    """Short digest of a static file, read once per process."""
+    with open(os.path.join(STATIC_DIR, path), 'rb') as file:
+        return hashlib.md5(file.read()).hexdigest()[:12]
+
+
+def static_url(path: str) -> str:
+    """URL of a static file with its content hash, for the templates."""
+    path = path.lstrip('/')
+    return f'{STATIC_URL}/{path}?v={content_hash(path)}'
+
+
+class CachedStaticFiles(StaticFiles):
+    """Static files cacheable for a year when requested by ``static_url``.
+
+    The hash in ``v`` changes with the content, so a deploy changes the
+    URLs. Other requests, or an outdated hash, get ``no-cache`` and are
+    revalidated with the ETag.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope,
+                                          status_code)
+        version = parse_qs(scope.get('query_string', b'').decode()).get('v')
+        path = os.path.relpath(full_path, STATIC_DIR)
+        if version and version[0] == content_hash(path):
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
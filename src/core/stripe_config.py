@@ -1,16 +1,24 @@
-import stripe
+from typing import Optional
 
-from core.config import Settings
+from core.config import get_settings
+from core.stripe_gateway import StripeGateway
 
-settings = Settings()
-stripe_loc = None
+settings = get_settings()
+stripe_loc: Optional[StripeGateway] = None
 
 
-def stripe_init():
-    stripe_loc = stripe
-    stripe_loc.api_key = settings.stripe_key
-    return stripe_loc
+def stripe_init() -> StripeGateway:
+    return StripeGateway(
+        api_key=settings.stripe_key,
+        max_workers=settings.stripe_max_workers,
+        max_concurrency=settings.stripe_max_concurrency,
+        timeout=settings.stripe_timeout,
+        api_base=settings.stripe_api_base,
+        rate=settings.stripe_rate,
+        burst=settings.stripe_burst,
+        rate_limit_retries=settings.stripe_rate_limit_retries,
+    )
 
 
-async def get_stripe() -> stripe:
+async def get_stripe() -> StripeGateway:
     return stripe_loc
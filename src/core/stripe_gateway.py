@@ -0,0 +1,189 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from typing import AsyncIterator, Optional
+
+from core.exceptions import StripeGatewayTimeoutError
+from core.metrics import Counter, Histogram
+from core.profiling import timed
+from core.stripe_scheduler import Priority, StripeScheduler, stripe_rate_limited
+
+stripe_latency = Histogram(
+    'stripe_request_duration_seconds',
+    'Stripe API call latency',
+    labels=('endpoint',),
+)
+stripe_errors = Counter(
+    'stripe_request_errors_total',
+    'Failed Stripe API calls',
+    labels=('endpoint', 'reason'),
+)
+
+
+def retry_after(error, attempt: int) -> float:
+    """Seconds to hold off after a 429, from ``Retry-After`` if sent."""
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After') or headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return min(0.5 * 2 ** attempt, 8.0)
+
+
+class StripeGateway:
+    """Async facade over the blocking stripe SDK.
+
+    Calls run on a bounded thread pool so a slow Stripe round trip never
+    blocks the event loop. The requests client keeps one keep-alive session
+    per worker thread, so the pool doubles as the connection pool.
+
+    The SDK takes a noticeable share of the boot time to import, so it is
+    loaded by the first call, on a worker thread.
+
+    Every HTTP request first takes a token from the ``StripeScheduler``,
+    in the lane of the caller. A 429 pauses the scheduler for the
+    ``Retry-After`` of the answer and the call is retried, up to
+    ``rate_limit_retries`` times. The timeout of a request covers all of
+    it: the waits for a token, the calls and the pauses between them.
+    """
+
+    def __init__(
+            self,
+            api_key: str,
+            max_workers: int,
+            max_concurrency: int,
+            timeout: float,
+            api_base: Optional[str] = None,
+            rate: float = 25.0,
+            burst: int = 25,
+            rate_limit_retries: int = 3,
+    ):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.timeout = timeout
+        self.scheduler = StripeScheduler(rate, burst)
+        self.rate_limit_retries = rate_limit_retries
+        self._stripe = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='stripe'
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def request(
+            self,
+            endpoint: str,
+            *args,
+            timeout: Optional[float] = None,
+            priority: Optional[Priority] = None,
+            **params,
+    ):
+        """Call ``stripe.<endpoint>``, e.g. ``request('Price.create', ...)``."""
+        def call():
+            return attrgetter(endpoint)(self.sdk())(*args, **params)
+
+        return await self._run(endpoint, call, timeout, priority)
+
+    async def list_all(
+            self,
+            endpoint: str,
+            timeout: Optional[float] = None,
+            priority: Optional[Priority] = None,
+            **params,
+    ) -> list:
+        """Fetch every page of a list endpoint, e.g. ``Subscription.list``.
+
+        Pages are requested one by one, each paced by the scheduler.
+        """
+        items = []
+        async for page in self.pages(endpoint, timeout, priority, **params):
+            items.extend(page)
+        return items
+
+    async def pages(
+            self,
+            endpoint: str,
+            timeout: Optional[float] = None,
+            priority: Optional[Priority] = None,
+            **params,
+    ) -> AsyncIterator[list]:
+        """The pages of a list endpoint, for lists too long to hold."""
+        while True:
+            page = await self.request(endpoint, timeout=timeout,
+                                      priority=priority, **params)
+            if page.data:
+                yield page.data
+            if not page.has_more or not page.data:
+                return
+            params['starting_after'] = page.data[-1].id
+
+    async def _run(self, endpoint: str, call, timeout: Optional[float],
+                   priority: Optional[Priority]):
+        timeout = timeout or self.timeout
+        with timed('stripe'):
+            return await self._attempts(endpoint, call, timeout, priority)
+
+    async def _attempts(self, endpoint: str, call, timeout: float,
+                        priority: Optional[Priority]):
+        deadline = time.monotonic() + timeout
+        for attempt in range(self.rate_limit_retries + 1):
+            try:
+                await asyncio.wait_for(self.scheduler.acquire(priority),
+                                       max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                stripe_errors.inc(endpoint=endpoint, reason='queue_timeout')
+                raise StripeGatewayTimeoutError(endpoint)
+            try:
+                return await self._call(endpoint, call,
+                                        max(deadline - time.monotonic(), 0))
+            except Exception as error:
+                if (getattr(error, 'http_status', None) != 429
+                        or attempt == self.rate_limit_retries):
+                    raise
+                stripe_rate_limited.inc(endpoint=endpoint)
+                pause = retry_after(error, attempt)
+                self.scheduler.pause(pause)
+                # The retry could not start before the deadline.
+                if time.monotonic() + pause >= deadline:
+                    raise
+
+    async def _call(self, endpoint: str, call, timeout: float):
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, call), timeout,
+                )
+            except asyncio.TimeoutError:
+                stripe_errors.inc(endpoint=endpoint, reason='timeout')
+                raise StripeGatewayTimeoutError(endpoint)
+            except Exception as error:
+                stripe_errors.inc(endpoint=endpoint,
+                                  reason=type(error).__name__)
+                raise
+            finally:
+                stripe_latency.observe(time.perf_counter() - started,
+                                       endpoint=endpoint)
+
+    def sdk(self):
+        """The configured ``stripe`` module, imported on first use."""
+        if self._stripe is None:
+            import stripe
+
+            stripe.api_key = self.api_key
+            if self.api_base:
+                stripe.api_base = self.api_base
+            stripe.default_http_client = stripe.http_client.RequestsClient(
+                timeout=self.timeout
+            )
+            self._stripe = stripe
+        return self._stripe
+
+    def construct_event(self, payload: bytes, signature: str, secret: str):
+        """Verify a webhook signature and parse the event."""
+        return self.sdk().Webhook.construct_event(
+            payload=payload, sig_header=signature, secret=secret,
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,140 @@
+"""Account wide pacing of Stripe calls, by priority.
+
+Stripe limits the requests per second of an account, and a backfill or a
+bulk admin action can use all of it. Every call takes a token from one
+bucket refilled at ``rate`` per second; when the bucket is empty callers
+queue in priority lanes and the highest lane is served first. A 429
+answer pauses the bucket for its ``Retry-After``.
+
+The lane comes from the ``stripe_priority`` context variable, interactive
+by default; webhook workers, admin routes and jobs set their own.
+"""
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+from core.metrics import Counter, Gauge, Histogram
+
+
+class Priority(IntEnum):
+    interactive = 0
+    webhook = 1
+    admin = 2
+    batch = 3
+
+
+stripe_priority: ContextVar[Priority] = ContextVar(
+    'stripe_priority', default=Priority.interactive
+)
+
+stripe_queue_depth = Gauge(
+    'stripe_scheduler_queue_depth',
+    'Stripe calls waiting for a rate limit token',
+    labels=('priority',),
+)
+stripe_queue_wait = Histogram(
+    'stripe_scheduler_wait_seconds',
+    'Time a Stripe call waited for a rate limit token',
+    labels=('priority',),
+)
+stripe_rate_limited = Counter(
+    'stripe_rate_limited_total',
+    'Stripe answers with status 429',
+    labels=('endpoint',),
+)
+
+
+async def admin_priority():
+    """Router dependency: Stripe calls of the request use the admin lane."""
+    stripe_priority.set(Priority.admin)
+
+
+class StripeScheduler:
+    """Token bucket with strict priority lanes."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lanes: Dict[Priority, Deque[asyncio.Future]] = {
+            priority: deque() for priority in Priority
+        }
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, priority: Optional[Priority] = None):
+        priority = stripe_priority.get() if priority is None else priority
+        if self._take():
+            stripe_queue_wait.observe(0, priority=priority.name)
+            return
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        lane = self._lanes[priority]
+        lane.append(waiter)
+        stripe_queue_depth.set(len(lane), priority=priority.name)
+        self._schedule()
+        try:
+            await waiter
+        finally:
+            # Cancelled while queued, e.g. by a timeout.
+            if waiter.cancelled() and waiter in lane:
+                lane.remove(waiter)
+            stripe_queue_depth.set(len(lane), priority=priority.name)
+        stripe_queue_wait.observe(time.monotonic() - started,
+                                  priority=priority.name)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens, after a 429 from Stripe."""
+        self._paused_until = max(self._paused_until,
+                                 time.monotonic() + seconds)
+        # Refill from the end of the pause, not in a burst at its end.
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self.burst, self._tokens
+                               + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def _take(self) -> bool:
+        """Take a token right away, only if nobody is queued."""
+        now = time.monotonic()
+        if now < self._paused_until or any(self._lanes.values()):
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _schedule(self):
+        if self._timer is not None:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        delay = max(self._paused_until - now,
+                    (1 - self._tokens) / self.rate, 0)
+        self._timer = asyncio.get_running_loop().call_later(
+            delay, self._dispatch
+        )
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        if now >= self._paused_until:
+            self._refill(now)
+            for lane in self._lanes.values():
+                while lane and self._tokens >= 1:
+                    waiter = lane.popleft()
+                    if not waiter.done():
+                        waiter.set_result(None)
+                        self._tokens -= 1
+                if lane:
+                    break
+        if any(self._lanes.values()):
+            self._schedule()
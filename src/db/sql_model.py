@@ -1,7 +1,7 @@
 import uuid
 from enum import Enum
 
-from sqlalchemy import Column, ForeignKey, String, DateTime, Integer, Boolean, JSON
+from sqlalchemy import Column, ForeignKey, String, DateTime, Date, Integer, Boolean, JSON, Text, Index
 from sqlalchemy.dialects.postgresql import ENUM as pgEnum
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base
@@ -16,7 +16,7 @@ class Product(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True,
                 default=uuid.uuid4, unique=True, nullable=False)
-    stripe_product_id = Column(String(50), nullable=False)
+    stripe_product_id = Column(String(50), nullable=False, unique=True, index=True)
     name = Column(String(250), nullable=False)
     description = Column(String(250), nullable=True)
     created_at = Column(DateTime(True))
@@ -30,14 +30,14 @@ class Price(Base):
     id = Column(UUID(as_uuid=True), primary_key=True,
                 default=uuid.uuid4, unique=True, nullable=False)
     stripe_product_id = Column(String(50), nullable=False)
-    stripe_price_id = Column(String(50), nullable=False)
+    stripe_price_id = Column(String(50), nullable=False, unique=True, index=True)
     name = Column(String(250), nullable=False)
     active = Column(Boolean)
     type = Column(String(250), nullable=False)
     unit_amount = Column(Integer, nullable=False)
     currency = Column(String(250), nullable=False)
     permission_id = Column(Integer, nullable=False)
-    product_id = Column(ForeignKey('product.id'), nullable=False)
+    product_id = Column(ForeignKey('product.id'), nullable=False, index=True)
     interval = Column(String(250), nullable=True)
     interval_count = Column(Integer, nullable=True)
     using_type = Column(String(250), nullable=True)
@@ -48,8 +48,8 @@ class StripeCustomer(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True,
                 default=uuid.uuid4, unique=True, nullable=False)
-    user_id = Column(UUID, nullable=False)
-    stripe_customer_id = Column(String(50), nullable=False)
+    user_id = Column(UUID, nullable=False, index=True)
+    stripe_customer_id = Column(String(50), nullable=False, unique=True, index=True)
 
 
 class SubscriptionStatus(Enum):
@@ -72,5 +72,116 @@ class BillingHistory(Base):
     stripe_subscription_id = Column(String(50), nullable=False)
     subscription_status = Column(pgEnum(SubscriptionStatus), nullable=False)
     event_type = Column(String(50), nullable=False)
-    created_at = Column(DateTime(True))
+    created_at = Column(DateTime(True), nullable=False, index=True)
     additional_info = Column(JSON, nullable=True)
+    # Invoice or event id the row was built from, for idempotent imports
+    stripe_object_id = Column(String(255), nullable=True, unique=True, index=True)
+
+    __table_args__ = (
+        Index('ix_billing_history_customer_created_at',
+              'stripe_customer', 'created_at', 'id'),
+    )
+
+
+class AuthOutbox(Base):
+    __tablename__ = 'auth_outbox'
+
+    id = Column(UUID(as_uuid=True), primary_key=True,
+                default=uuid.uuid4, unique=True, nullable=False)
+    user_id = Column(UUID(as_uuid=True), unique=True, nullable=False)
+    permission_id = Column(Integer, nullable=False)
+    paid_to_date = Column(Date, nullable=False)
+    attempts = Column(Integer, nullable=False, server_default='0')
+    next_attempt_at = Column(DateTime(True), nullable=False, index=True)
+    created_at = Column(DateTime(True))
+
+
+class StripeEventStatus(Enum):
+    pending = 'pending'
+    processed = 'processed'
+    failed = 'failed'
+
+
+class StripeEvent(Base):
+    __tablename__ = 'stripe_event'
+
+    id = Column(String(255), primary_key=True, nullable=False)
+    type = Column(String(100), nullable=False)
+    customer_id = Column(String(50), nullable=True)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), nullable=False, index=True)
+    received_at = Column(DateTime(True), nullable=False)
+    processed_at = Column(DateTime(True), nullable=True)
+    error = Column(Text, nullable=True)
+    # Failed events are retried at next_attempt_at, NULL once given up
+    attempts = Column(Integer, nullable=False, server_default='0')
+    next_attempt_at = Column(DateTime(True), nullable=True, index=True)
+
+
+class Subscription(Base):
+    __tablename__ = 'subscription'
+
+    id = Column(UUID(as_uuid=True), primary_key=True,
+                default=uuid.uuid4, unique=True, nullable=False)
+    stripe_subscription_id = Column(String(50), unique=True, nullable=False)
+    stripe_customer_id = Column(String(50), nullable=False)
+    status = Column(String(50), nullable=False)
+    stripe_price_id = Column(String(50), nullable=False)
+    current_period_start = Column(DateTime(True), nullable=False)
+    current_period_end = Column(DateTime(True), nullable=False)
+    cancel_at_period_end = Column(Boolean, nullable=False)
+    ended_at = Column(DateTime(True), nullable=True)
+    updated_at = Column(DateTime(True), nullable=False)
+    # When Stripe had the stored state: event creation or retrieval time
+    stripe_state_at = Column(DateTime(True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_subscription_customer_status',
+              'stripe_customer_id', 'status'),
+    )
+
+
+class BackfillCheckpoint(Base):
+    __tablename__ = 'backfill_checkpoint'
+
+    source = Column(String(50), primary_key=True, nullable=False)
+    cursor = Column(String(255), nullable=True)
+    processed = Column(Integer, nullable=False, server_default='0')
+    finished = Column(Boolean, nullable=False, server_default='false')
+    updated_at = Column(DateTime(True), nullable=False)
+
+
+class CheckoutSession(Base):
+    __tablename__ = 'checkout_session'
+
+    # The last session opened by a user for a product, reused while open
+    user_id = Column(UUID(as_uuid=True), primary_key=True, nullable=False)
+    product_id = Column(UUID(as_uuid=True), primary_key=True, nullable=False)
+    stripe_session_id = Column(String(255), nullable=False, unique=True, index=True)
+    url = Column(Text, nullable=False)
+    expires_at = Column(DateTime(True), nullable=False)
+
+
+class MigrationItemStatus(Enum):
+    pending = 'pending'
+    done = 'done'
+    skipped = 'skipped'
+    failed = 'failed'
+
+
+class SubscriptionMigrationItem(Base):
+    __tablename__ = 'subscription_migration_item'
+
+    migration_id = Column(String(100), primary_key=True, nullable=False)
+    stripe_subscription_id = Column(String(50), primary_key=True, nullable=False)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
+    price_id = Column(UUID(as_uuid=True), nullable=False)
+    status = Column(String(20), nullable=False)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime(True), nullable=False)
+    attempts = Column(Integer, nullable=False, server_default='0')
+
+    __table_args__ = (
+        Index('ix_subscription_migration_item_status',
+              'migration_id', 'status'),
+    )
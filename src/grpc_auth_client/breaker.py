@@ -0,0 +1,76 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import grpc
+
+from core.metrics import Counter
+
+T = TypeVar('T')
+
+UNHEALTHY_CODES = (
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+)
+
+breaker_rejections = Counter(
+    'auth_breaker_rejected_total',
+    'Auth calls failed fast by the open circuit breaker',
+)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_unhealthy(error: Exception) -> bool:
+    return (isinstance(error, grpc.RpcError)
+            and error.code() in UNHEALTHY_CODES)
+
+
+class CircuitBreaker:
+    """Fails fast after ``failure_threshold`` consecutive unhealthy answers.
+
+    After ``reset_timeout`` seconds one trial call is let through; its
+    success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        if self.is_open:
+            expired = time.monotonic() - self.opened_at >= self.reset_timeout
+            if self._trial or not expired:
+                breaker_rejections.inc()
+                raise CircuitOpenError
+            self._trial = True
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            self._trial = False
+            raise
+        except Exception as error:
+            self._record(healthy=not is_unhealthy(error))
+            raise
+        self._record(healthy=True)
+        return result
+
+    def _record(self, healthy: bool):
+        self._trial = False
+        if healthy:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.is_open or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import grpc
+
+from core.metrics import Counter
+
+token_cache_requests = Counter(
+    'auth_token_cache_requests_total',
+    'Auth token cache lookups by result',
+    labels=('result',),
+)
+
+
+class AuthInfo(NamedTuple):
+    user_id: str
+    permissions: List[str]
+
+
+class TokenRejected(grpc.RpcError):
+    """A remembered UNAUTHENTICATED answer, raised anew on every hit.
+
+    Raising one stored exception again would grow its traceback with the
+    frames of every request that hit it.
+    """
+
+    def __init__(self, details: str):
+        super().__init__(details)
+        self._details = details
+
+    def code(self) -> grpc.StatusCode:
+        return grpc.StatusCode.UNAUTHENTICATED
+
+    def details(self) -> str:
+        return self._details
+
+
+class _Entry(NamedTuple):
+    expires_at: float
+    value: Optional[AuthInfo]
+    # Details of the UNAUTHENTICATED answer, for negative entries
+    error: Optional[str]
+
+
+class TokenCache:
+    """LRU cache of token lookups with TTL, negative caching and single flight.
+
+    Concurrent misses for one token share a single in-flight lookup, and
+    UNAUTHENTICATED answers are remembered for ``negative_ttl`` seconds.
+    Expired answers stay available to ``get_stale`` for ``stale_ttl`` more
+    seconds, to ride out an auth service outage.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float,
+                 stale_ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def get(self, token: str,
+                  loader: Callable[[], Awaitable[AuthInfo]]) -> AuthInfo:
+        entry = self._entries.get(token)
+        if entry and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(token)
+            if entry.error is not None:
+                token_cache_requests.inc(result='negative_hit')
+                raise TokenRejected(entry.error)
+            token_cache_requests.inc(result='hit')
+            return entry.value
+
+        task = self._inflight.get(token)
+        if task:
+            token_cache_requests.inc(result='coalesced')
+        else:
+            token_cache_requests.inc(result='miss')
+            task = asyncio.ensure_future(loader())
+            self._inflight[token] = task
+            task.add_done_callback(lambda done: self._store(token, done))
+        # The lookup keeps running for the other waiters if we are cancelled.
+        return await asyncio.shield(task)
+
+    def get_stale(self, token: str) -> Optional[AuthInfo]:
+        entry = self._entries.get(token)
+        if (entry and entry.value
+                and entry.expires_at + self.stale_ttl > time.monotonic()):
+            token_cache_requests.inc(result='stale_hit')
+            return entry.value
+        return None
+
+    def _store(self, token: str, task: asyncio.Task):
+        self._inflight.pop(token, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None:
+            self._put(token, _Entry(time.monotonic() + self.ttl,
+                                    task.result(), None))
+        elif (isinstance(error, grpc.RpcError)
+              and error.code() == grpc.StatusCode.UNAUTHENTICATED):
+            self._put(token, _Entry(time.monotonic() + self.negative_ttl,
+                                    None, error.details() or ''))
+
+    def _put(self, token: str, entry: _Entry):
+        self._entries[token] = entry
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+token_cache: Optional[TokenCache] = None
+
+
+async def get_token_cache() -> TokenCache:
+    return token_cache
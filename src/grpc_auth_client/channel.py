@@ -0,0 +1,54 @@
+import json
+
+import grpc
+
+from core.config import Settings
+
+AUTH_SERVICE = 'gateway_backend.Auth'
+
+
+def service_config(settings: Settings) -> str:
+    """Round robin over resolved backends and retries of UNAVAILABLE.
+
+    ``AUTH_GRPC_RETRIES`` is the number of attempts of a call. gRPC
+    rejects a retry policy with fewer than 2, so 0 or 1 means no policy.
+    """
+    method_config = {'name': [{'service': AUTH_SERVICE}]}
+    if settings.auth_grpc_retries >= 2:
+        method_config['retryPolicy'] = {
+            'maxAttempts': settings.auth_grpc_retries,
+            'initialBackoff': '0.05s',
+            'maxBackoff': '0.5s',
+            'backoffMultiplier': 2,
+            'retryableStatusCodes': ['UNAVAILABLE'],
+        }
+    return json.dumps({
+        'loadBalancingConfig': [{'round_robin': {}}],
+        'methodConfig': [method_config],
+    })
+
+
+def create_channel(settings: Settings) -> grpc.aio.Channel:
+    """Channel to the auth service.
+
+    ``AUTH_GRPC_TARGET`` accepts any gRPC target, e.g. ``dns:///auth:50051``
+    or ``ipv4:10.0.0.1:50051,10.0.0.2:50051`` for several endpoints.
+
+    Keepalive pings only run during calls by default: a server with
+    default settings accepts an idle ping every 5 minutes at most and
+    answers more frequent ones with GOAWAY ``too_many_pings``.
+    """
+    target = (settings.auth_grpc_target
+              or f'{settings.auth_grpc_host}:{settings.auth_grpc_port}')
+    options = [
+        ('grpc.service_config', service_config(settings)),
+        ('grpc.enable_retries', 1),
+        ('grpc.keepalive_time_ms', settings.auth_grpc_keepalive_time_ms),
+        ('grpc.keepalive_timeout_ms', settings.auth_grpc_keepalive_timeout_ms),
+    ]
+    if settings.auth_grpc_keepalive_without_calls:
+        options += [
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+        ]
+    return grpc.aio.insecure_channel(target, options=options)
@@ -1,11 +1,34 @@
 from typing import Optional
 
+import grpc
+
+from core.config import get_settings
+from grpc_auth_client.breaker import CircuitBreaker
+from grpc_auth_client.channel import create_channel
 from grpc_auth_client.protos import auth_pb2_grpc
 
-channel = None
+channel: Optional[grpc.aio.Channel] = None
 
 stub: Optional[auth_pb2_grpc.AuthStub] = None
 
+breaker: Optional[CircuitBreaker] = None
+
 
 async def get_stub() -> auth_pb2_grpc.AuthStub:
+    """The auth stub, its channel is opened by the first authorised request."""
+    global channel, stub
+    if stub is None:
+        channel = create_channel(get_settings())
+        stub = auth_pb2_grpc.AuthStub(channel)
     return stub
+
+
+async def get_breaker() -> CircuitBreaker:
+    return breaker
+
+
+async def close():
+    global channel, stub
+    if channel is not None:
+        await channel.close()
+    channel = stub = None
@@ -1,37 +1,58 @@
+import asyncio
 from http import HTTPStatus
 
 import grpc
 from fastapi import Depends, HTTPException
 
-from grpc_auth_client.client import get_stub
+from core.config import get_settings
+from core.profiling import timed
+from grpc_auth_client.breaker import CircuitBreaker, CircuitOpenError, is_unhealthy
+from grpc_auth_client.cache import AuthInfo, TokenCache, get_token_cache
+from grpc_auth_client.client import get_breaker, get_stub
 from grpc_auth_client.protos import auth_pb2, auth_pb2_grpc
 from .helpers import get_auth_token
 
+settings = get_settings()
+
 
 def invalid_response(error):
-    if error.code() == grpc.StatusCode.UNAUTHENTICATED:
+    if isinstance(error, grpc.RpcError) and error.code() == grpc.StatusCode.UNAUTHENTICATED:
         raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail=error.details())
 
     raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail='GRPC is unavailable')
 
 
-async def get_user_id(token: str = Depends(get_auth_token),
-                      stub: auth_pb2_grpc.AuthStub = Depends(get_stub)):
+async def fetch_auth_info(stub: auth_pb2_grpc.AuthStub, token: str) -> AuthInfo:
+    """Ask for user and permissions in parallel: one round trip per token."""
     grpc_token = auth_pb2.Token(token=token)
-    try:
-        response = await stub.GetUser(grpc_token)
-        return response.user_id
+    user, permissions = await asyncio.gather(
+        stub.GetUser(grpc_token, timeout=settings.auth_grpc_timeout),
+        stub.GetPermissions(grpc_token, timeout=settings.auth_grpc_timeout),
+    )
+    return AuthInfo(user.user_id, list(permissions.permissions))
 
-    except grpc.RpcError as error:
+
+async def get_auth_info(token: str = Depends(get_auth_token),
+                        stub: auth_pb2_grpc.AuthStub = Depends(get_stub),
+                        cache: TokenCache = Depends(get_token_cache),
+                        breaker: CircuitBreaker = Depends(get_breaker)) -> AuthInfo:
+    try:
+        with timed('auth'):
+            return await cache.get(
+                token, lambda: breaker.call(lambda: fetch_auth_info(stub, token))
+            )
+
+    except (grpc.RpcError, CircuitOpenError) as error:
+        if isinstance(error, CircuitOpenError) or is_unhealthy(error):
+            auth_info = cache.get_stale(token)
+            if auth_info:
+                return auth_info
         invalid_response(error)
 
 
-async def get_permissions(token: str = Depends(get_auth_token),
-                          stub: auth_pb2_grpc.AuthStub = Depends(get_stub)):
-    grpc_token = auth_pb2.Token(token=token)
-    try:
-        response = await stub.GetPermissions(grpc_token)
-        return response.permissions
+async def get_user_id(auth_info: AuthInfo = Depends(get_auth_info)):
+    return auth_info.user_id
 
-    except grpc.RpcError as error:
-        invalid_response(error)
+
+async def get_permissions(auth_info: AuthInfo = Depends(get_auth_info)):
+    return auth_info.permissions
@@ -0,0 +1,41 @@
+"""Backfill billing history from Stripe invoices and subscription events.
+
+Resumes from the saved checkpoint unless ``--restart`` is given. Point
+``STRIPE_API_BASE`` at a local stub to rehearse a run.
+
+Usage: python -m jobs.backfill_history [invoices|subscription_events] [--restart]
+"""
+import asyncio
+import sys
+
+from core.config import get_settings
+from core.db import db_init
+from core.stripe_config import stripe_init
+from core.stripe_scheduler import Priority, stripe_priority
+from services.history_backfill import SOURCES, HistoryBackfillService
+
+settings = get_settings()
+
+
+async def main(sources, restart=False):
+    stripe_priority.set(Priority.batch)
+    database = db_init()
+    stripe_loc = stripe_init()
+    await database.connect()
+    try:
+        service = HistoryBackfillService(
+            database, stripe_loc, batch_size=settings.backfill_batch_size
+        )
+        for source in sources:
+            print(source, await service.run(source, restart))
+    finally:
+        await database.disconnect()
+        stripe_loc.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    asyncio.run(main(
+        [arg for arg in args if arg in SOURCES] or list(SOURCES),
+        restart='--restart' in args,
+    ))
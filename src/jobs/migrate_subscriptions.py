@@ -0,0 +1,64 @@
+"""Move a cohort of subscriptions to new prices.
+
+The CSV has a header and the columns ``user_uuid,subscription_id,price_uuid``.
+Its rows are added to the migration, then the pending rows are processed;
+running again with the same migration id resumes. Without a file the
+stored rows of the migration are processed. ``--dry-run`` with a file
+only checks its rows and stores nothing.
+
+Usage: python -m jobs.migrate_subscriptions <migration_id> [rows.csv]
+                                           [--dry-run] [--retry-failed]
+"""
+import asyncio
+import csv
+import sys
+
+from core.config import get_settings
+from core.db import db_init
+from core.stripe_config import stripe_init
+from core.stripe_scheduler import Priority, stripe_priority
+from models.history import SubscriptionUpdate
+from services.subscription_migration import SubscriptionMigrationService
+
+settings = get_settings()
+
+
+def read_rows(path: str):
+    with open(path, newline='') as file:
+        return [SubscriptionUpdate(**row) for row in csv.DictReader(file)]
+
+
+async def main(migration_id, path=None, dry_run=False, retry_failed=False):
+    stripe_priority.set(Priority.batch)
+    database = db_init()
+    stripe_loc = stripe_init()
+    await database.connect()
+    try:
+        service = SubscriptionMigrationService(
+            database, stripe_loc,
+            concurrency=settings.migration_concurrency,
+        )
+        if path and dry_run:
+            summary = await service.check(migration_id, read_rows(path))
+        else:
+            if path:
+                added = await service.submit(migration_id, read_rows(path))
+                print(f'{added} new rows')
+            summary = await service.run(migration_id, dry_run, retry_failed)
+        print(summary.json(indent=2))
+    finally:
+        await database.disconnect()
+        stripe_loc.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    positional = [arg for arg in args if not arg.startswith('--')]
+    if not positional:
+        sys.exit(__doc__)
+    asyncio.run(main(
+        positional[0],
+        positional[1] if len(positional) > 1 else None,
+        dry_run='--dry-run' in args,
+        retry_failed='--retry-failed' in args,
+    ))
@@ -0,0 +1,33 @@
+"""Reload the local subscription mirror from Stripe.
+
+Must run once after the migration creating the mirror (c3e8b5a7f610):
+the start page only reads the mirror, and webhooks fill it only for
+subscriptions that change afterwards.
+
+Usage: python -m jobs.reconcile_subscriptions [stripe_customer_id]
+"""
+import asyncio
+import sys
+
+from core.db import db_init
+from core.stripe_config import stripe_init
+from core.stripe_scheduler import Priority, stripe_priority
+from services.subscription_mirror import SubscriptionMirrorService
+
+
+async def main(stripe_customer_id=None):
+    stripe_priority.set(Priority.batch)
+    database = db_init()
+    stripe_loc = stripe_init()
+    await database.connect()
+    try:
+        await SubscriptionMirrorService(database, stripe_loc).reconcile(
+            stripe_customer_id
+        )
+    finally:
+        await database.disconnect()
+        stripe_loc.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:2]))
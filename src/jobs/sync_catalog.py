@@ -0,0 +1,36 @@
+"""Load the product catalog from Stripe into the local tables.
+
+Usage: python -m jobs.sync_catalog [--dry-run]
+"""
+import asyncio
+import sys
+
+from core.db import db_init
+from core.stripe_config import stripe_init
+from core.stripe_scheduler import Priority, stripe_priority
+from services.catalog_cache import CATALOG_CHANNEL, catalog_cache
+from services.catalog_sync import CatalogSyncService
+
+
+async def main(dry_run=False):
+    stripe_priority.set(Priority.batch)
+    database = db_init()
+    stripe_loc = stripe_init()
+    await database.connect()
+    try:
+        summary = await CatalogSyncService(
+            database, stripe_loc, catalog_cache
+        ).sync(dry_run)
+        print(summary.json(indent=2))
+        changed = (summary.products.created + summary.products.updated
+                   + summary.prices.created + summary.prices.updated)
+        if changed and not dry_run:
+            # Running app workers drop their cached catalog.
+            await database.execute(f'NOTIFY {CATALOG_CHANNEL}')
+    finally:
+        await database.disconnect()
+        stripe_loc.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main('--dry-run' in sys.argv[1:]))
@@ -1,19 +1,29 @@
-import grpc
 import uvicorn
-from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
-from starlette.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, status
 
+from api import metrics
 from api.v1 import products, subscription, prices, admin
-from core import db
+from core import auth_notifier, db
 from core import stripe_config
-from core.config import Settings, STATIC_DIR
+from core.config import get_settings, STATIC_DIR
+from core.log_context import RequestIdMiddleware
+from core.profiling import ProfilingMiddleware, TimedORJSONResponse
+from core.static_files import STATIC_URL, CachedStaticFiles
 from core.db import db_init
+from core.exceptions import StripeGatewayTimeoutError
 from core.stripe_config import stripe_init
-from grpc_auth_client import client
-from grpc_auth_client.protos import auth_pb2_grpc
+from core.auth_notifier import AuthNotifier
+from grpc_auth_client import cache, client
+from grpc_auth_client.breaker import CircuitBreaker
+from grpc_auth_client.cache import TokenCache
+from services import auth_outbox, webhook_queue
+from services.catalog_cache import catalog_cache
+from services.auth_outbox import AuthOutboxService
+from services.container import ServiceContainer
+from services.subscription_status import SubscriptionStatusCache
+from services.webhook_queue import WebhookEventQueue
 
-settings = Settings()
+settings = get_settings()
 
 app = FastAPI(
     # Конфигурируем название проекта. Оно будет отображаться в документации
@@ -22,7 +32,7 @@ app = FastAPI(
     docs_url='/api/openapi',
     # Адрес документации в формате OpenAPI
     openapi_url='/api/openapi.json',
-    default_response_class=ORJSONResponse,
+    default_response_class=TimedORJSONResponse,
     description='billing',
     version='1.0.0',
 )
@@ -32,23 +42,94 @@ app = FastAPI(
 async def startup():
     db.pg = db_init()
     stripe_config.stripe_loc = stripe_init()
-    client.channel = grpc.aio.insecure_channel(
-        f'{settings.auth_grpc_host}:{settings.auth_grpc_port}')
-    client.stub = auth_pb2_grpc.AuthStub(client.channel)
+    client.breaker = CircuitBreaker(
+        failure_threshold=settings.auth_breaker_failures,
+        reset_timeout=settings.auth_breaker_reset,
+    )
+    cache.token_cache = TokenCache(
+        maxsize=settings.auth_cache_size,
+        ttl=settings.auth_cache_ttl,
+        negative_ttl=settings.auth_cache_negative_ttl,
+        stale_ttl=settings.auth_cache_stale_ttl,
+    )
     await db.pg.connect()
+    if settings.catalog_listen:
+        await catalog_cache.listen(db.db_postgres_dsn)
+    auth_notifier.notifier = AuthNotifier(
+        url=settings.auth_path_url,
+        api_key=settings.auth_api_key,
+        timeout=settings.auth_push_timeout,
+        max_connections=settings.auth_push_max_connections,
+        retries=settings.auth_push_retries,
+        backoff=settings.auth_push_backoff,
+    )
+    auth_outbox.outbox = AuthOutboxService(
+        db.pg,
+        auth_notifier.notifier,
+        batch_size=settings.auth_outbox_batch_size,
+        poll_interval=settings.auth_outbox_poll_interval,
+        lease=settings.auth_outbox_lease,
+        max_backoff=settings.auth_outbox_max_backoff,
+    )
+    auth_outbox.outbox.start()
+    status_cache = SubscriptionStatusCache(
+        maxsize=settings.subscription_status_cache_size,
+        ttl=settings.subscription_status_ttl,
+    )
+    if settings.subscription_status_listen:
+        await status_cache.listen(db.db_postgres_dsn)
+    app.state.services = ServiceContainer(
+        db.pg, stripe_config.stripe_loc, catalog_cache, auth_outbox.outbox,
+        status_cache,
+    )
+    webhook_queue.webhook_queue = WebhookEventQueue(
+        db.pg,
+        app.state.services.webhooks,
+        workers=settings.webhook_workers,
+        background=settings.webhook_background,
+        max_attempts=settings.webhook_max_attempts,
+        retry_backoff=settings.webhook_retry_backoff,
+        retry_max_backoff=settings.webhook_retry_max_backoff,
+        retry_poll_interval=settings.webhook_retry_poll_interval,
+    )
+    await webhook_queue.webhook_queue.start()
 
 
 @app.on_event('shutdown')
 async def shutdown():
-    await client.channel.close()
+    await webhook_queue.webhook_queue.stop()
+    await auth_outbox.outbox.stop()
+    await auth_notifier.notifier.close()
+    await client.close()
+    stripe_config.stripe_loc.close()
+    await catalog_cache.close()
+    await app.state.services.subscription_status.close()
     await db.pg.disconnect()
 
 
+@app.exception_handler(StripeGatewayTimeoutError)
+async def stripe_timeout_handler(request: Request, exc: StripeGatewayTimeoutError):
+    return TimedORJSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={'detail': f'Stripe request {exc} timed out'},
+    )
+
+
+if settings.profiling_enabled:
+    app.add_middleware(
+        ProfilingMiddleware,
+        sample_rate=settings.profiling_sample_rate,
+        token=settings.profiling_token,
+        directory=settings.profiling_dir,
+    )
+app.add_middleware(RequestIdMiddleware)
+
+app.include_router(metrics.router)
 app.include_router(products.router, prefix='/api/v1/products')
 app.include_router(prices.router, prefix='/api/v1/prices')
 app.include_router(admin.router, prefix='/api/v1/admin')
 app.include_router(subscription.router, prefix='/api/v1/subscription')
-app.mount('/static', StaticFiles(directory=STATIC_DIR), name='static')
+app.mount(STATIC_URL, CachedStaticFiles(directory=STATIC_DIR), name='static')
 
 if __name__ == '__main__':
     uvicorn.run(
@@ -0,0 +1,30 @@
+"""product stripe id unique
+
+Revision ID: 3a6d2f8e9b41
+Revises: e7f2a9c4b153
+Create Date: 2022-08-12 11:05:42.118305
+
+The catalog sync upserts products on stripe_product_id. As with the hot
+lookup indexes the build is CONCURRENT: on failure drop the INVALID index,
+remove the duplicated products and upgrade again.
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3a6d2f8e9b41'
+down_revision = 'e7f2a9c4b153'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_product_stripe_product_id', 'product',
+                        ['stripe_product_id'], unique=True,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_product_stripe_product_id', table_name='product',
+                      postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""auth outbox
+
+Revision ID: 5b1e0c7d2a94
+Revises: 14ce4e48b30d
+Create Date: 2022-08-08 10:12:41.507318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '5b1e0c7d2a94'
+down_revision = '14ce4e48b30d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('auth_outbox',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('permission_id', sa.Integer(), nullable=False),
+    sa.Column('paid_to_date', sa.Date(), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('id'),
+    sa.UniqueConstraint('user_id')
+    )
+    op.create_index(op.f('ix_auth_outbox_next_attempt_at'), 'auth_outbox', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_auth_outbox_next_attempt_at'), table_name='auth_outbox')
+    op.drop_table('auth_outbox')
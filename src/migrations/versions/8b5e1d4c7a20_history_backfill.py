@@ -0,0 +1,40 @@
+"""history backfill
+
+Revision ID: 8b5e1d4c7a20
+Revises: 3a6d2f8e9b41
+Create Date: 2022-08-15 10:22:31.407519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8b5e1d4c7a20'
+down_revision = '3a6d2f8e9b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('backfill_checkpoint',
+    sa.Column('source', sa.String(length=50), nullable=False),
+    sa.Column('cursor', sa.String(length=255), nullable=True),
+    sa.Column('processed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('finished', sa.Boolean(), server_default='false', nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+    op.add_column('billing_history', sa.Column('stripe_object_id', sa.String(length=255), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_billing_history_stripe_object_id'), 'billing_history',
+                        ['stripe_object_id'], unique=True,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_billing_history_stripe_object_id'),
+                      table_name='billing_history',
+                      postgresql_concurrently=True)
+    op.drop_column('billing_history', 'stripe_object_id')
+    op.drop_table('backfill_checkpoint')
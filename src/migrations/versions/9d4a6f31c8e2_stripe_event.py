@@ -0,0 +1,35 @@
+"""stripe event
+
+Revision ID: 9d4a6f31c8e2
+Revises: 5b1e0c7d2a94
+Create Date: 2022-08-09 14:37:05.118264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9d4a6f31c8e2'
+down_revision = '5b1e0c7d2a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('stripe_event',
+    sa.Column('id', sa.String(length=255), nullable=False),
+    sa.Column('type', sa.String(length=100), nullable=False),
+    sa.Column('customer_id', sa.String(length=50), nullable=True),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('received_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_stripe_event_status'), 'stripe_event', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_stripe_event_status'), table_name='stripe_event')
+    op.drop_table('stripe_event')
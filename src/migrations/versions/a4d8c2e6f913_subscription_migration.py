@@ -0,0 +1,37 @@
+"""subscription migration
+
+Revision ID: a4d8c2e6f913
+Revises: f1c7a3d9e5b2
+Create Date: 2022-08-19 09:41:27.305816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'a4d8c2e6f913'
+down_revision = 'f1c7a3d9e5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('subscription_migration_item',
+    sa.Column('migration_id', sa.String(length=100), nullable=False),
+    sa.Column('stripe_subscription_id', sa.String(length=50), nullable=False),
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('price_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('migration_id', 'stripe_subscription_id')
+    )
+    op.create_index('ix_subscription_migration_item_status', 'subscription_migration_item',
+                    ['migration_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_subscription_migration_item_status',
+                  table_name='subscription_migration_item')
+    op.drop_table('subscription_migration_item')
@@ -0,0 +1,30 @@
+"""history created_at not null
+
+Revision ID: a9d4f2b6c817
+Revises: f3c8e1a5b702
+Create Date: 2022-08-24 10:07:31.582264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4f2b6c817'
+down_revision = 'f3c8e1a5b702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Rows without a time sort as the oldest ones, after every page.
+    op.execute("UPDATE billing_history SET created_at = to_timestamp(0) "
+               "WHERE created_at IS NULL")
+    op.alter_column('billing_history', 'created_at',
+                    existing_type=sa.DateTime(timezone=True),
+                    nullable=False)
+
+
+def downgrade() -> None:
+    op.alter_column('billing_history', 'created_at',
+                    existing_type=sa.DateTime(timezone=True),
+                    nullable=True)
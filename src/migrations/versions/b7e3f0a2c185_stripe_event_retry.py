@@ -0,0 +1,35 @@
+"""stripe event retry
+
+Revision ID: b7e3f0a2c185
+Revises: a4d8c2e6f913
+Create Date: 2022-08-22 10:12:44.901372
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3f0a2c185'
+down_revision = 'a4d8c2e6f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('stripe_event', sa.Column('attempts', sa.Integer(),
+                                            server_default='0', nullable=False))
+    op.add_column('stripe_event', sa.Column('next_attempt_at',
+                                            sa.DateTime(timezone=True),
+                                            nullable=True))
+    op.create_index(op.f('ix_stripe_event_next_attempt_at'), 'stripe_event',
+                    ['next_attempt_at'], unique=False)
+    # Events that failed so far get another chance.
+    op.execute("UPDATE stripe_event SET next_attempt_at = now() "
+               "WHERE status = 'failed'")
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_stripe_event_next_attempt_at'),
+                  table_name='stripe_event')
+    op.drop_column('stripe_event', 'next_attempt_at')
+    op.drop_column('stripe_event', 'attempts')
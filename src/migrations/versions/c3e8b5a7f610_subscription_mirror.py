@@ -0,0 +1,40 @@
+"""subscription mirror
+
+Revision ID: c3e8b5a7f610
+Revises: 9d4a6f31c8e2
+Create Date: 2022-08-10 11:05:52.640131
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8b5a7f610'
+down_revision = '9d4a6f31c8e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('subscription',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('stripe_subscription_id', sa.String(length=50), nullable=False),
+    sa.Column('stripe_customer_id', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('stripe_price_id', sa.String(length=50), nullable=False),
+    sa.Column('current_period_start', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('current_period_end', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('cancel_at_period_end', sa.Boolean(), nullable=False),
+    sa.Column('ended_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('id'),
+    sa.UniqueConstraint('stripe_subscription_id')
+    )
+    op.create_index('ix_subscription_customer_status', 'subscription', ['stripe_customer_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_subscription_customer_status', table_name='subscription')
+    op.drop_table('subscription')
@@ -0,0 +1,25 @@
+"""subscription state time
+
+Revision ID: d2a7c5e9f104
+Revises: b7e3f0a2c185
+Create Date: 2022-08-22 15:03:18.227640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7c5e9f104'
+down_revision = 'b7e3f0a2c185'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('subscription', sa.Column('stripe_state_at',
+                                            sa.DateTime(timezone=True),
+                                            nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('subscription', 'stripe_state_at')
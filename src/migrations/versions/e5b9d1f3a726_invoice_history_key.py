@@ -0,0 +1,42 @@
+"""invoice history key
+
+Revision ID: e5b9d1f3a726
+Revises: d2a7c5e9f104
+Create Date: 2022-08-23 09:26:51.473019
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e5b9d1f3a726'
+down_revision = 'd2a7c5e9f104'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Invoice rows are keyed by invoice id and outcome, "in_...:invoice.paid".
+    op.execute(
+        "UPDATE billing_history "
+        "SET stripe_object_id = stripe_object_id || ':' || event_type "
+        "WHERE stripe_object_id LIKE 'in\\_%' "
+        "AND stripe_object_id NOT LIKE '%:%'"
+    )
+
+
+def downgrade() -> None:
+    # Several outcomes of one invoice collapse into the first one.
+    op.execute(
+        "DELETE FROM billing_history AS later "
+        "USING billing_history AS earlier "
+        "WHERE later.stripe_object_id LIKE 'in\\_%:%' "
+        "AND earlier.stripe_object_id LIKE 'in\\_%:%' "
+        "AND split_part(later.stripe_object_id, ':', 1) "
+        "= split_part(earlier.stripe_object_id, ':', 1) "
+        "AND (later.created_at, later.id) > (earlier.created_at, earlier.id)"
+    )
+    op.execute(
+        "UPDATE billing_history "
+        "SET stripe_object_id = split_part(stripe_object_id, ':', 1) "
+        "WHERE stripe_object_id LIKE 'in\\_%:%'"
+    )
@@ -0,0 +1,40 @@
+"""hot lookup indexes
+
+Revision ID: e7f2a9c4b153
+Revises: c3e8b5a7f610
+Create Date: 2022-08-11 16:48:19.904412
+
+Indexes are built CONCURRENTLY outside of a transaction, so the tables stay
+writable. A failed unique build (duplicated stripe ids) leaves an INVALID
+index behind: drop it, clean the duplicates and run the upgrade again.
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e7f2a9c4b153'
+down_revision = 'c3e8b5a7f610'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_stripe_customer_stripe_customer_id', 'stripe_customer', ['stripe_customer_id'], True),
+    ('ix_stripe_customer_user_id', 'stripe_customer', ['user_id'], False),
+    ('ix_price_stripe_price_id', 'price', ['stripe_price_id'], True),
+    ('ix_price_product_id', 'price', ['product_id'], False),
+    ('ix_billing_history_customer_created_at', 'billing_history', ['stripe_customer', 'created_at', 'id'], False),
+    ('ix_billing_history_created_at', 'billing_history', ['created_at'], False),
+)
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique,
+                            postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True)
@@ -0,0 +1,35 @@
+"""checkout session
+
+Revision ID: f1c7a3d9e5b2
+Revises: 8b5e1d4c7a20
+Create Date: 2022-08-17 14:05:12.618204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'f1c7a3d9e5b2'
+down_revision = '8b5e1d4c7a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('checkout_session',
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('product_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('stripe_session_id', sa.String(length=255), nullable=False),
+    sa.Column('url', sa.Text(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('user_id', 'product_id')
+    )
+    op.create_index(op.f('ix_checkout_session_stripe_session_id'), 'checkout_session',
+                    ['stripe_session_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_checkout_session_stripe_session_id'),
+                  table_name='checkout_session')
+    op.drop_table('checkout_session')
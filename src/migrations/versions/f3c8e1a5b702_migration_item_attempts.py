@@ -0,0 +1,25 @@
+"""migration item attempts
+
+Revision ID: f3c8e1a5b702
+Revises: e5b9d1f3a726
+Create Date: 2022-08-23 14:52:06.318940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8e1a5b702'
+down_revision = 'e5b9d1f3a726'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('subscription_migration_item',
+                  sa.Column('attempts', sa.Integer(), server_default='0',
+                            nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('subscription_migration_item', 'attempts')
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, Json
 from uuid import UUID
 
@@ -12,3 +13,4 @@ class BillingHistory(BaseModel):
     event_type: str
     created_at: datetime
     additional_info: Json
+    stripe_object_id: Optional[str]
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+
+class SyncCounts(BaseModel):
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+
+
+class CatalogSyncSummary(BaseModel):
+    dry_run: bool
+    products: SyncCounts
+    prices: SyncCounts
@@ -1,6 +1,6 @@
 from datetime import datetime, date
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel
@@ -39,6 +39,11 @@ class BillingHistory(BaseModel):
         use_enum_values = True
 
 
+class BillingHistoryPage(BaseModel):
+    items: List[BillingHistory]
+    next_cursor: Optional[str] = None
+
+
 class SubscriptionUpdate(BaseModel):
     user_uuid: UUID
     price_uuid: UUID
@@ -0,0 +1,18 @@
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class MigrationCounts(BaseModel):
+    pending: int = 0
+    done: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+
+class SubscriptionMigrationSummary(BaseModel):
+    migration_id: str
+    dry_run: bool = False
+    counts: MigrationCounts
+    # Subscription id -> reason, for the first skipped or failed rows
+    problems: Dict[str, str] = {}
@@ -0,0 +1,44 @@
+"""Slotted records for trusted database rows.
+
+Same fields as the matching models in ``models.history``, without
+validation: rows read from our own tables are already well typed, and
+orjson serialises the dataclasses natively. Routes returning them opt out
+of ``response_model`` validation with ``api.v1.responses.json_response``.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import List, Optional
+from uuid import UUID
+
+
+@dataclass
+class HistoryRecord:
+    __slots__ = ('id', 'created_at', 'subscription', 'subscription_id',
+                 'subscription_status', 'event_type', 'user_id')
+    id: UUID
+    created_at: datetime
+    subscription: str
+    subscription_id: str
+    subscription_status: str
+    event_type: str
+    user_id: UUID
+
+
+@dataclass
+class HistoryPageRecord:
+    __slots__ = ('items', 'next_cursor')
+    items: List[HistoryRecord]
+    next_cursor: Optional[str]
+
+
+@dataclass
+class SubscriptionRecord:
+    __slots__ = ('status', 'start_date', 'end_date', 'subscription_id',
+                 'price_id', 'price_name', 'product_name')
+    status: str
+    start_date: date
+    end_date: date
+    subscription_id: str
+    price_id: Optional[UUID]
+    price_name: Optional[str]
+    product_name: Optional[str]
@@ -1,34 +1,65 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime
-from functools import lru_cache
 from http import HTTPStatus
+from typing import AsyncIterator, Optional, Tuple
 from uuid import UUID
 
+import orjson
 from databases import Database
-from fastapi import Depends
-from fastapi import HTTPException
-from sqlalchemy import select, and_
+from fastapi import HTTPException, Request
+from sqlalchemy import select, and_, tuple_
 
-from core.config import Settings
-from core.db import get_pg
-from core.stripe_config import get_stripe
+from core.stripe_gateway import StripeGateway
 from db.sql_model import (
     BillingHistory as BillingHistoryTable,
     StripeCustomer as StripeCustomerTable,
     Price as PriceTable,
     Product as ProductTable,
+    Subscription as SubscriptionTable,
 )
-from models.history import BillingHistory, UserSubscriptions
+from models.records import HistoryPageRecord, HistoryRecord, SubscriptionRecord
+from services.subscription_mirror import subscription_price_id
 
-settings = Settings()
+
+SHOWN_STATUSES = ('active', 'trialing', 'canceled', 'ended')
+
+
+def encode_cursor(created_at: datetime, history_id: UUID) -> str:
+    value = f'{created_at.isoformat()}|{history_id}'
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        created_at, history_id = urlsafe_b64decode(
+            cursor.encode()
+        ).decode().split('|')
+        return datetime.fromisoformat(created_at), UUID(history_id)
+    except ValueError:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                            detail='Invalid cursor')
+
+
+def history_record(item) -> HistoryRecord:
+    status = item.subscription_status
+    return HistoryRecord(
+        id=item.id,
+        created_at=item.created_at,
+        subscription=item.name,
+        subscription_id=item.stripe_subscription_id,
+        subscription_status=getattr(status, 'value', status),
+        event_type=item.event_type,
+        user_id=item.user_id,
+    )
 
 
 class BillingHistoryService:
-    def __init__(self, db: Database, stripe_loc):
+    def __init__(self, db: Database, stripe_loc: StripeGateway):
         self.db = db
         self.stripe = stripe_loc
 
-    async def get_user_history(self, uuid: UUID):
-        query = select([
+    def _history_query(self):
+        return select([
             BillingHistoryTable.id,
             BillingHistoryTable.created_at,
             PriceTable.name,
@@ -40,70 +71,156 @@ class BillingHistoryService:
            StripeCustomerTable, isouter=True
         ).join(
             PriceTable, isouter=True
-        ).where(
+        )
+
+    def _user_history_query(self, uuid: UUID):
+        return self._history_query().where(
             StripeCustomerTable.user_id == uuid
         ).order_by(
-            BillingHistoryTable.created_at.desc()
+            BillingHistoryTable.created_at.desc(),
+            BillingHistoryTable.id.desc(),
+        )
+
+    async def get_user_history(
+            self, uuid: UUID, limit: int, cursor: Optional[str] = None
+    ) -> HistoryPageRecord:
+        """One page of the user history, newest first."""
+        query = self._user_history_query(uuid)
+        if cursor:
+            query = query.where(
+                tuple_(BillingHistoryTable.created_at, BillingHistoryTable.id)
+                < tuple_(*decode_cursor(cursor))
+            )
+        result = await self.db.fetch_all(query.limit(limit + 1))
+
+        next_cursor = None
+        if len(result) > limit:
+            result = result[:limit]
+            next_cursor = encode_cursor(result[-1].created_at, result[-1].id)
+        return HistoryPageRecord(
+            items=[history_record(item) for item in result],
+            next_cursor=next_cursor,
         )
 
-        result = await self.db.fetch_all(query)
-        history = None
-        if result:
-            history = [BillingHistory(
-                id=item.id,
-                created_at=item.created_at,
-                subscription=item.name,
-                subscription_id=item.stripe_subscription_id,
-                subscription_status=item.subscription_status,
-                event_type=item.event_type,
-                user_id=item.user_id
-            ) for item in result]
-        return history
-
-    async def get_user_subscriptions(self, uuid: UUID):
+    async def stream_user_history(self, uuid: UUID) -> AsyncIterator[bytes]:
+        """Whole user history as NDJSON, read through a DB cursor."""
+        async for item in self.db.iterate(self._user_history_query(uuid)):
+            yield orjson.dumps(history_record(item)) + b'\n'
+
+    async def stream_history(
+            self, date_from: datetime, date_to: datetime
+    ) -> AsyncIterator[bytes]:
+        """History of all users for ``date_from <= created_at < date_to``."""
+        query = self._history_query().where(
+            and_(
+                BillingHistoryTable.created_at >= date_from,
+                BillingHistoryTable.created_at < date_to,
+            )
+        ).order_by(
+            BillingHistoryTable.created_at,
+            BillingHistoryTable.id,
+        )
+        async for item in self.db.iterate(query):
+            yield orjson.dumps(history_record(item)) + b'\n'
+
+    async def get_user_subscriptions(self, uuid: UUID, live: bool = False):
+        """Subscriptions of a user from the local mirror or, if live, Stripe."""
+        if live:
+            return await self._get_live_subscriptions(uuid)
+
+        query = select([
+            SubscriptionTable.stripe_subscription_id,
+            SubscriptionTable.status,
+            SubscriptionTable.current_period_start,
+            SubscriptionTable.current_period_end,
+            SubscriptionTable.ended_at,
+            PriceTable.id,
+            PriceTable.name.label('price_name'),
+            ProductTable.name.label('product_name'),
+        ]).join(
+            StripeCustomerTable,
+            StripeCustomerTable.stripe_customer_id == SubscriptionTable.stripe_customer_id,
+        ).join(
+            PriceTable,
+            PriceTable.stripe_price_id == SubscriptionTable.stripe_price_id,
+            isouter=True,
+        ).join(
+            ProductTable, isouter=True
+        ).where(
+            and_(
+                StripeCustomerTable.user_id == uuid,
+                SubscriptionTable.status.in_(SHOWN_STATUSES),
+            )
+        ).order_by(
+            SubscriptionTable.current_period_start.desc()
+        )
+        return [SubscriptionRecord(
+            status=row.status,
+            start_date=row.current_period_start.date(),
+            end_date=(row.ended_at or row.current_period_end).date(),
+            subscription_id=row.stripe_subscription_id,
+            price_id=row.id,
+            price_name=row.price_name,
+            product_name=row.product_name,
+        ) for row in await self.db.fetch_all(query)]
+
+    async def _get_live_subscriptions(self, uuid: UUID):
         query = select([
             StripeCustomerTable.stripe_customer_id,
         ]).where(
             StripeCustomerTable.user_id == uuid
         )
         stripe_customer = await self.db.fetch_one(query)
-        data_dict = {
-            'customer': stripe_customer.stripe_customer_id,
-            'status': 'all'
+        if not stripe_customer:
+            return []
+        subscriptions = [
+            subscription for subscription in await self.stripe.list_all(
+                'Subscription.list',
+                customer=stripe_customer.stripe_customer_id,
+                status='all',
+                limit=100,
+            ) if subscription.status in SHOWN_STATUSES
+        ]
+        if not subscriptions:
+            return []
+
+        query = select([
+            PriceTable.stripe_price_id,
+            PriceTable.id,
+            PriceTable.name.label('price_name'),
+            ProductTable.name.label('product_name'),
+        ]).join(
+            ProductTable, isouter=True
+        ).where(
+            PriceTable.stripe_price_id.in_(
+                list({subscription_price_id(subscription)
+                      for subscription in subscriptions} - {None})
+            )
+        )
+        prices = {
+            row.stripe_price_id: row
+            for row in await self.db.fetch_all(query)
         }
-        subscriptions = self.stripe.Subscription.list(**data_dict)
 
         result = []
-        for subscription in subscriptions.data:
-            if subscription.status in ['active', 'trialing',
-                                       'canceled', 'ended']:
-                start_date = datetime.fromtimestamp(
-                    subscription.current_period_start
-                ).date()
-                ended_at = (subscription.ended_at
-                            if subscription.ended_at
-                            else subscription.current_period_end)
-                end_date = datetime.fromtimestamp(ended_at).date()
-                price_id = subscription.plan.id
-                query = select([
-                    PriceTable.id,
-                    PriceTable.name,
-                    ProductTable.name,
-                ]).join(
-                    ProductTable, isouter=True
-                ).where(
-                    PriceTable.stripe_price_id == price_id
-                )
-                query_res = await self.db.fetch_one(query)
-                result.append(UserSubscriptions(
-                    status=subscription.status,
-                    start_date=start_date,
-                    end_date=end_date,
-                    subscription_id=subscription.id,
-                    price_id=query_res.id if query_res else None,
-                    price_name=query_res.name if query_res else None,
-                    product_name=query_res.name if query_res else None,
-                ))
+        for subscription in subscriptions:
+            start_date = datetime.fromtimestamp(
+                subscription.current_period_start
+            ).date()
+            ended_at = (subscription.ended_at
+                        if subscription.ended_at
+                        else subscription.current_period_end)
+            end_date = datetime.fromtimestamp(ended_at).date()
+            price = prices.get(subscription_price_id(subscription))
+            result.append(SubscriptionRecord(
+                status=subscription.status,
+                start_date=start_date,
+                end_date=end_date,
+                subscription_id=subscription.id,
+                price_id=price.id if price else None,
+                price_name=price.price_name if price else None,
+                product_name=price.product_name if price else None,
+            ))
         return result
 
     async def update_user_subscriptions(
@@ -129,7 +246,7 @@ class BillingHistoryService:
                 status_code=HTTPStatus.BAD_REQUEST,
                 detail='This user did not have the specified subscription.'
             )
-        subscription = self.stripe.Subscription.retrieve(subscription_id)
+        subscription = await self.stripe.request('Subscription.retrieve', subscription_id)
         query = select(
             PriceTable.stripe_price_id
         ).where(
@@ -137,7 +254,8 @@ class BillingHistoryService:
         )
         stripe_price = await self.db.fetch_one(query)
 
-        self.stripe.Subscription.modify(
+        await self.stripe.request(
+            'Subscription.modify',
             subscription.id,
             cancel_at_period_end=False,
             proration_behavior='always_invoice',
@@ -149,9 +267,5 @@ class BillingHistoryService:
         return 'Subscription change request sent successfully.'
 
 
-@lru_cache()
-def get_billing_history_service(
-        db: Database = Depends(get_pg),
-        stripe_loc=Depends(get_stripe)
-) -> BillingHistoryService:
-    return BillingHistoryService(db, stripe_loc)
+async def get_billing_history_service(request: Request) -> BillingHistoryService:
+    return request.app.state.services.billing_history
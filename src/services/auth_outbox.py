@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+import logging
+import uuid
+from typing import Optional
+from uuid import UUID
+
+import httpx
+from databases import Database
+from sqlalchemy import delete, func, select, update, and_
+from sqlalchemy.dialects.postgresql import insert
+
+from core.auth_notifier import AuthNotifier
+from db.sql_model import AuthOutbox as outbox_table
+
+logger = logging.getLogger(__name__)
+
+
+class AuthOutboxService:
+    """Durable queue of ``paid_to_date`` pushes to the auth service.
+
+    Webhooks only upsert a row per user, so repeated pushes for the same
+    user coalesce into one. A background loop delivers due rows and
+    reschedules failed ones with exponential backoff.
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            notifier: AuthNotifier,
+            batch_size: int,
+            poll_interval: float,
+            lease: float,
+            max_backoff: float,
+    ):
+        self.db = db
+        self.notifier = notifier
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = datetime.timedelta(seconds=lease)
+        self.max_backoff = max_backoff
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def enqueue(self, user_id: UUID, permission_id: int,
+                      paid_to_date: datetime.date):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        query = insert(outbox_table).values(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            permission_id=permission_id,
+            paid_to_date=paid_to_date,
+            attempts=0,
+            next_attempt_at=now,
+            created_at=now,
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[outbox_table.user_id],
+            set_={
+                'permission_id': query.excluded.permission_id,
+                'paid_to_date': func.greatest(
+                    outbox_table.paid_to_date, query.excluded.paid_to_date
+                ),
+                'attempts': 0,
+                'next_attempt_at': now,
+            },
+        )
+        await self.db.execute(query)
+        self._wakeup.set()
+
+    async def _claim(self):
+        """Lease due rows so concurrent workers never deliver the same row."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        due = select(outbox_table.id).where(
+            outbox_table.next_attempt_at <= now
+        ).order_by(
+            outbox_table.next_attempt_at
+        ).limit(
+            self.batch_size
+        ).with_for_update(skip_locked=True)
+        query = update(outbox_table).where(
+            outbox_table.id.in_(due.scalar_subquery())
+        ).values(
+            attempts=outbox_table.attempts + 1,
+            next_attempt_at=now + self.lease,
+        ).returning(outbox_table.__table__)
+        return await self.db.fetch_all(query)
+
+    async def _deliver(self, row):
+        payload = {
+            'user_id': str(row.user_id),
+            'permission_id': row.permission_id,
+            'paid_to_date': str(row.paid_to_date),
+        }
+        try:
+            await self.notifier.push(payload)
+        except httpx.HTTPError as error:
+            delay = min(self.poll_interval * 2 ** row.attempts,
+                        self.max_backoff)
+            logger.error('Auth push for user %s failed: %s', row.user_id, error)
+            query = update(outbox_table).where(
+                outbox_table.id == row.id
+            ).values(
+                next_attempt_at=datetime.datetime.now(datetime.timezone.utc)
+                + datetime.timedelta(seconds=delay),
+            )
+            await self.db.execute(query)
+            return
+        # A newer paid_to_date may have been coalesced while we were pushing.
+        query = delete(outbox_table).where(
+            and_(
+                outbox_table.id == row.id,
+                outbox_table.paid_to_date == row.paid_to_date,
+                outbox_table.attempts == row.attempts,
+            )
+        )
+        await self.db.execute(query)
+
+    async def drain(self) -> int:
+        rows = await self._claim()
+        if rows:
+            await asyncio.gather(*(self._deliver(row) for row in rows))
+        return len(rows)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.drain() == self.batch_size:
+                    continue
+            except Exception:
+                logger.exception('Auth outbox drain failed')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+outbox: Optional[AuthOutboxService] = None
+
+
+async def get_auth_outbox() -> AuthOutboxService:
+    return outbox
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import asyncpg
+from databases import Database
+
+from core.config import get_settings
+from core.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = 'catalog_changed'
+RECONNECT_MAX_DELAY = 60.0
+
+catalog_cache_requests = Counter(
+    'catalog_cache_requests_total',
+    'Catalog cache lookups by result',
+    labels=('result',),
+)
+
+
+class CatalogCache:
+    """In-memory copy of the product and price catalog.
+
+    Writes go through the product and price services, which call
+    ``invalidate``. With ``listen`` started, invalidations are broadcast to
+    the other workers through Postgres NOTIFY. The version guards against
+    storing a value loaded before a concurrent invalidation, and with the
+    id of the process it is the ETag of catalog responses.
+
+    Entries are reloaded after ``max_age`` seconds anyway, in case a
+    notification is lost. A dropped listener connection is reopened with
+    backoff, and the cache is cleared when it drops and when it is back.
+    An expired entry that reloads different clears the cache as well, as
+    a notification was missed.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.version = 0
+        self._instance = uuid.uuid4().hex[:12]
+        self._values: Dict[Hashable, Tuple[float, Any]] = {}
+        self._dsn: Optional[str] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._reconnect: Optional[asyncio.Task] = None
+
+    async def get_or_load(self, key: Hashable,
+                          loader: Callable[[], Awaitable[Any]]):
+        entry = self._values.get(key)
+        if entry and entry[0] > time.monotonic():
+            catalog_cache_requests.inc(result='hit')
+            return entry[1]
+        catalog_cache_requests.inc(result='miss')
+        version = self.version
+        value = await loader()
+        if version != self.version:
+            return value
+        if entry and value != entry[1]:
+            self.clear()
+        if value is not None:
+            self._values[key] = (time.monotonic() + self.max_age, value)
+        return value
+
+    def etag(self) -> str:
+        """Changes with every change of the cached catalog."""
+        return f'"{self._instance}-{self.version}"'
+
+    def clear(self, *args):
+        self.version += 1
+        self._values.clear()
+
+    async def invalidate(self, db: Database):
+        self.clear()
+        # Also while the own listener reconnects, the others still listen.
+        if self._dsn:
+            await db.execute(f'NOTIFY {CATALOG_CHANNEL}')
+
+    async def listen(self, dsn: str):
+        self._dsn = dsn
+        await self._connect()
+
+    async def _connect(self):
+        listener = await asyncpg.connect(self._dsn)
+        await listener.add_listener(CATALOG_CHANNEL, self.clear)
+        listener.add_termination_listener(self._lost)
+        self._listener = listener
+        logger.info('Listening for catalog changes on %s', CATALOG_CHANNEL)
+
+    def _lost(self, connection):
+        if connection is not self._listener:
+            return
+        logger.warning('Catalog listener connection lost, reconnecting')
+        self._listener = None
+        # Changes are not heard until the connection is back.
+        self.clear()
+        self._reconnect = asyncio.ensure_future(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        delay = 1.0
+        while True:
+            try:
+                await self._connect()
+            except Exception as error:
+                logger.warning('Catalog listener reconnect failed: %s', error)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            # Notifications sent while disconnected are lost.
+            self.clear()
+            return
+
+    async def close(self):
+        self._dsn = None
+        if self._reconnect:
+            self._reconnect.cancel()
+            self._reconnect = None
+        listener, self._listener = self._listener, None
+        if listener:
+            await listener.close()
+
+
+catalog_cache = CatalogCache(max_age=get_settings().catalog_cache_max_age)
+
+
+async def get_catalog_cache() -> CatalogCache:
+    return catalog_cache
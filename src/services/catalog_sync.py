@@ -0,0 +1,172 @@
+import datetime
+import logging
+import uuid
+from typing import Dict, List, Optional
+
+from databases import Database
+from fastapi import Request
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from core.stripe_gateway import StripeGateway
+from db.sql_model import Price as PriceSql
+from db.sql_model import Product as ProductSql
+from models.catalog import CatalogSyncSummary, SyncCounts
+from models.prices import TypePrice
+from services.catalog_cache import CatalogCache
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT, well below the 32767 bind parameters asyncpg accepts.
+UPSERT_BATCH = 500
+DEFAULT_PERMISSION_ID = 1
+
+PRODUCT_FIELDS = (
+    'name', 'description', 'created_at', 'updated_at', 'active',
+)
+PRICE_FIELDS = (
+    'stripe_product_id', 'product_id', 'name', 'active', 'type',
+    'unit_amount', 'currency', 'permission_id', 'interval',
+    'interval_count', 'using_type',
+)
+
+
+def _from_timestamp(timestamp: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def _changed(row, values: dict, fields) -> bool:
+    return any(getattr(row, field) != values[field] for field in fields)
+
+
+class CatalogSyncService:
+    """Loads the Stripe product catalog into the ``product``/``price`` tables.
+
+    Stripe is the source of truth: missing rows are created and differing
+    ones updated, local rows unknown to Stripe are left alone. All changes
+    are written with multi-row upserts in a single transaction.
+    """
+
+    def __init__(self, db: Database, stripe_loc: StripeGateway,
+                 catalog: CatalogCache):
+        self.db = db
+        self.stripe = stripe_loc
+        self.catalog = catalog
+
+    async def sync(self, dry_run: bool = False) -> CatalogSyncSummary:
+        stripe_products = await self.stripe.list_all('Product.list', limit=100)
+        stripe_prices = await self.stripe.list_all('Price.list', limit=100)
+        products = {
+            row.stripe_product_id: row
+            for row in await self.db.fetch_all(select(ProductSql))
+        }
+        prices = {
+            row.stripe_price_id: row
+            for row in await self.db.fetch_all(select(PriceSql))
+        }
+
+        product_counts = SyncCounts()
+        product_rows = []
+        product_ids: Dict[str, uuid.UUID] = {}
+        names: Dict[str, str] = {}
+        for item in stripe_products:
+            row = products.get(item['id'])
+            values = {
+                'name': item['name'],
+                'description': item.get('description'),
+                'created_at': _from_timestamp(item['created']),
+                'updated_at': _from_timestamp(item['updated']),
+                'active': item['active'],
+            }
+            product_ids[item['id']] = row.id if row else uuid.uuid4()
+            names[item['id']] = item['name']
+            if row is None:
+                product_counts.created += 1
+            elif _changed(row, values, PRODUCT_FIELDS):
+                product_counts.updated += 1
+            else:
+                product_counts.unchanged += 1
+                continue
+            product_rows.append({
+                'id': product_ids[item['id']],
+                'stripe_product_id': item['id'],
+                **values,
+            })
+
+        price_counts = SyncCounts()
+        price_rows = []
+        for item in stripe_prices:
+            row = prices.get(item['id'])
+            values = self._price_values(item, row, product_ids, names)
+            if values is None:
+                price_counts.skipped += 1
+                continue
+            if row is None:
+                price_counts.created += 1
+            elif _changed(row, values, PRICE_FIELDS):
+                price_counts.updated += 1
+            else:
+                price_counts.unchanged += 1
+                continue
+            price_rows.append({
+                'id': row.id if row else uuid.uuid4(),
+                'stripe_price_id': item['id'],
+                **values,
+            })
+
+        if not dry_run and (product_rows or price_rows):
+            async with self.db.transaction():
+                await self._upsert(ProductSql, ProductSql.stripe_product_id,
+                                   product_rows, PRODUCT_FIELDS)
+                await self._upsert(PriceSql, PriceSql.stripe_price_id,
+                                   price_rows, PRICE_FIELDS)
+            await self.catalog.invalidate(self.db)
+
+        summary = CatalogSyncSummary(
+            dry_run=dry_run, products=product_counts, prices=price_counts,
+        )
+        logger.info('Catalog sync: %s', summary)
+        return summary
+
+    @staticmethod
+    def _price_values(item: dict, row, product_ids: Dict[str, uuid.UUID],
+                      names: Dict[str, str]) -> Optional[dict]:
+        """Columns of a Stripe price, None when it cannot be stored."""
+        product_id = product_ids.get(item['product'])
+        if product_id is None or item.get('unit_amount') is None:
+            return None
+        recurring = item.get('recurring') or {}
+        metadata = item.get('metadata') or {}
+        if 'permission_id' in metadata:
+            permission_id = int(metadata['permission_id'])
+        elif row is not None:
+            permission_id = row.permission_id
+        else:
+            permission_id = DEFAULT_PERMISSION_ID
+        return {
+            'stripe_product_id': item['product'],
+            'product_id': product_id,
+            'name': (item.get('nickname')
+                     or (row.name if row else names[item['product']])),
+            'active': item['active'],
+            'type': item.get('type') or TypePrice.recurring.value,
+            'unit_amount': item['unit_amount'],
+            'currency': item['currency'],
+            'permission_id': permission_id,
+            'interval': recurring.get('interval'),
+            'interval_count': recurring.get('interval_count'),
+            'using_type': recurring.get('usage_type'),
+        }
+
+    async def _upsert(self, table, key, rows: List[dict], fields):
+        for start in range(0, len(rows), UPSERT_BATCH):
+            query = insert(table).values(rows[start:start + UPSERT_BATCH])
+            query = query.on_conflict_do_update(
+                index_elements=[key],
+                set_={field: query.excluded[field] for field in fields},
+            )
+            await self.db.execute(query)
+
+
+async def get_catalog_sync_service(request: Request) -> CatalogSyncService:
+    return request.app.state.services.catalog_sync
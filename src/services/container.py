@@ -0,0 +1,52 @@
+from databases import Database
+
+from core.config import get_settings
+from core.stripe_gateway import StripeGateway
+from services.admin_services import BillingHistoryService
+from services.auth_outbox import AuthOutboxService
+from services.catalog_cache import CatalogCache
+from services.catalog_sync import CatalogSyncService
+from services.prices_service import PriceService
+from services.products_service import ProductService
+from services.subscription_migration import SubscriptionMigrationService
+from services.subscription_mirror import SubscriptionMirrorService
+from services.subscription_service import SubscriptionService
+from services.subscription_status import SubscriptionStatusCache
+from services.webhook_service import WebhookSubscriptionService
+
+settings = get_settings()
+
+
+class ServiceContainer:
+    """App scoped services, built once at startup and kept on ``app.state``.
+
+    The ``get_*_service`` dependencies only look the instance up, so a
+    request pays no construction. Request scoped values (the user, a
+    transaction) come from their own dependencies, never from here.
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            stripe_loc: StripeGateway,
+            catalog: CatalogCache,
+            auth_outbox: AuthOutboxService,
+            status_cache: SubscriptionStatusCache,
+    ):
+        self.products = ProductService(db, stripe_loc, catalog)
+        self.prices = PriceService(db, self.products, stripe_loc, catalog)
+        self.subscriptions = SubscriptionService(
+            db, self.prices, self.products, stripe_loc, status_cache
+        )
+        self.billing_history = BillingHistoryService(db, stripe_loc)
+        self.subscription_mirror = SubscriptionMirrorService(db, stripe_loc)
+        self.subscription_status = status_cache
+        self.catalog_sync = CatalogSyncService(db, stripe_loc, catalog)
+        self.subscription_migration = SubscriptionMigrationService(
+            db, stripe_loc,
+            concurrency=settings.migration_concurrency,
+        )
+        self.webhooks = WebhookSubscriptionService(
+            db, stripe_loc, auth_outbox, self.subscription_mirror,
+            status_cache,
+        )
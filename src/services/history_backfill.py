@@ -0,0 +1,189 @@
+import datetime
+import logging
+from typing import Dict, List, Optional
+
+from databases import Database
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from core.constants import CUSTOMER_SUBSCRIPTION_CREATED, CUSTOMER_SUBSCRIPTION_UPDATED
+from core.stripe_gateway import StripeGateway
+from db.sql_model import BackfillCheckpoint as checkpoint_table
+from db.sql_model import BillingHistory as history_table
+from db.sql_model import Price as price_table
+from db.sql_model import StripeCustomer as customer_table
+from services.webhook_service import (
+    insert_history,
+    invoice_price_id,
+    payment_history,
+    subscription_history,
+)
+from services.subscription_mirror import subscription_price_id
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+# billing_history has 10 columns, asyncpg accepts 32767 bind parameters.
+INSERT_CHUNK = 1000
+
+SOURCES = {
+    'invoices': ('Invoice.list', {'expand': ['data.subscription']}),
+    'subscription_events': ('Event.list', {
+        'types': [CUSTOMER_SUBSCRIPTION_CREATED, CUSTOMER_SUBSCRIPTION_UPDATED],
+    }),
+}
+
+
+def _from_timestamp(timestamp: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+class HistoryBackfillService:
+    """Rebuilds ``billing_history`` from Stripe invoices and events.
+
+    Pages are streamed from Stripe and written every ``batch_size`` objects
+    together with the checkpoint, in one transaction, so an interrupted run
+    resumes after the last written page and memory stays bounded by the
+    batch. Rows are keyed by the invoice id and outcome or by the event
+    id, like the webhook ones, so overlapping runs and live webhooks never
+    duplicate a row.
+    """
+
+    def __init__(self, db: Database, stripe_loc: StripeGateway,
+                 batch_size: int):
+        self.db = db
+        self.stripe = stripe_loc
+        self.batch_size = batch_size
+
+    async def run(self, source: str, restart: bool = False) -> dict:
+        endpoint, params = SOURCES[source]
+        checkpoint = await self.db.fetch_one(
+            select(checkpoint_table).where(checkpoint_table.source == source)
+        )
+        if checkpoint and checkpoint.finished and not restart:
+            logger.info('Backfill of %s already finished', source)
+            return {'processed': checkpoint.processed, 'inserted': 0, 'skipped': 0}
+        cursor = checkpoint.cursor if checkpoint and not restart else None
+        processed = checkpoint.processed if checkpoint and not restart else 0
+
+        totals = {'processed': processed, 'inserted': 0, 'skipped': 0}
+        batch: List[dict] = []
+        while True:
+            page = await self.stripe.request(
+                endpoint,
+                limit=PAGE_SIZE,
+                **({'starting_after': cursor} if cursor else {}),
+                **params,
+            )
+            batch.extend(page['data'])
+            if page['data']:
+                cursor = page['data'][-1]['id']
+            finished = not page['has_more']
+            if len(batch) >= self.batch_size or finished:
+                inserted, skipped = await self._write(
+                    source, batch, cursor, finished, totals['processed']
+                )
+                totals['processed'] += len(batch)
+                totals['inserted'] += inserted
+                totals['skipped'] += skipped
+                logger.info('Backfill of %s: %s', source, totals)
+                batch = []
+            if finished:
+                return totals
+
+    async def _write(self, source: str, objects: List[dict],
+                     cursor: Optional[str], finished: bool,
+                     processed: int):
+        """Insert the rows of a batch and move the checkpoint atomically."""
+        if source == 'invoices':
+            rows = await self._invoice_rows(objects)
+        else:
+            rows = await self._event_rows(objects)
+        inserted = 0
+        async with self.db.transaction():
+            for start in range(0, len(rows), INSERT_CHUNK):
+                result = await self.db.fetch_all(
+                    insert_history(rows[start:start + INSERT_CHUNK])
+                    .returning(history_table.id)
+                )
+                inserted += len(result)
+            values = {
+                'cursor': cursor,
+                'processed': processed + len(objects),
+                'finished': finished,
+                'updated_at': datetime.datetime.now(datetime.timezone.utc),
+            }
+            await self.db.execute(
+                insert(checkpoint_table).values(source=source, **values)
+                .on_conflict_do_update(
+                    index_elements=[checkpoint_table.source], set_=values,
+                )
+            )
+        return inserted, len(objects) - len(rows)
+
+    async def _lookups(self, customer_ids, price_ids):
+        customers: Dict[str, object] = {}
+        prices: Dict[str, object] = {}
+        if customer_ids:
+            query = select(
+                customer_table.id, customer_table.stripe_customer_id
+            ).where(customer_table.stripe_customer_id.in_(customer_ids))
+            customers = {
+                row.stripe_customer_id: row.id
+                for row in await self.db.fetch_all(query)
+            }
+        if price_ids:
+            query = select(
+                price_table.id, price_table.stripe_price_id
+            ).where(price_table.stripe_price_id.in_(price_ids))
+            prices = {
+                row.stripe_price_id: row.id
+                for row in await self.db.fetch_all(query)
+            }
+        return customers, prices
+
+    async def _invoice_rows(self, invoices: List[dict]) -> List[dict]:
+        invoices = [
+            invoice for invoice in invoices
+            if invoice.get('subscription') and invoice['lines']['data']
+            and (invoice['status'] == 'paid' or invoice.get('attempted'))
+        ]
+        customers, prices = await self._lookups(
+            {invoice['customer'] for invoice in invoices},
+            {invoice_price_id(invoice) for invoice in invoices},
+        )
+        rows = []
+        for invoice in invoices:
+            customer = customers.get(invoice['customer'])
+            price = prices.get(invoice_price_id(invoice))
+            if customer is None or price is None:
+                continue
+            # Expanded, so the status needs no Subscription.retrieve call.
+            subscription = invoice['subscription']
+            history = payment_history(
+                dict(invoice, subscription=subscription['id']),
+                customer, price, subscription['status'],
+                created_at=_from_timestamp(invoice['created']),
+            )
+            rows.append(history.dict())
+        return rows
+
+    async def _event_rows(self, events: List[dict]) -> List[dict]:
+        customers, prices = await self._lookups(
+            {event['data']['object']['customer'] for event in events},
+            {subscription_price_id(event['data']['object'])
+             for event in events} - {None},
+        )
+        rows = []
+        for event in events:
+            subscription = event['data']['object']
+            customer = customers.get(subscription['customer'])
+            price = prices.get(subscription_price_id(subscription))
+            if customer is None or price is None:
+                continue
+            history = subscription_history(
+                event['id'], event['data'], customer, price,
+                created_at=_from_timestamp(event['created']),
+            )
+            rows.append(history.dict())
+        return rows
@@ -1,28 +1,54 @@
 import uuid
-from functools import lru_cache
 from typing import Optional
 
 from databases import Database
-from fastapi import Depends
-from sqlalchemy import select, insert, update, and_
+from fastapi import Request
+from sqlalchemy import bindparam, select, insert, update, and_
 
-from core.config import Settings
-from core.db import get_pg
-from core.stripe_config import get_stripe
+from core.queries import CompiledQuery
+from core.stripe_gateway import StripeGateway
 from db.sql_model import Price as PriceSql
 from models.prices import TypePrice, Price, TypeRecurring
-from services.products_service import ProductService, get_products_service
+from services.catalog_cache import CatalogCache
+from services.products_service import ProductService
 
-settings = Settings()
+
+price_by_id = CompiledQuery(
+    'price_by_id',
+    select(PriceSql).where(PriceSql.id == bindparam('id')),
+)
 
 
 class PriceService:
-    def __init__(self, db: Database, products_service: ProductService, stripe_loc):
+    def __init__(
+            self,
+            db: Database,
+            products_service: ProductService,
+            stripe_loc: StripeGateway,
+            catalog: CatalogCache,
+    ):
         self.db = db
         self.products_service = products_service
         self.stripe = stripe_loc
+        self.catalog = catalog
 
     async def get_all_in_product(self, uuid):
+        return await self.catalog.get_or_load(
+            ('product_prices', str(uuid)), lambda: self._load_all_in_product(uuid)
+        )
+
+    async def get_line_items(self, uuid) -> Optional[list]:
+        """Checkout ``line_items`` of a product, built once per catalog version."""
+        return await self.catalog.get_or_load(
+            ('line_items', str(uuid)), lambda: self._load_line_items(uuid)
+        )
+
+    async def get_one(self, uuid: str) -> Optional[Price]:
+        return await self.catalog.get_or_load(
+            ('price', str(uuid)), lambda: self._load_one(uuid)
+        )
+
+    async def _load_all_in_product(self, uuid):
         query = select(PriceSql).filter(and_(PriceSql.product_id == uuid, PriceSql.active == True))
         result = await self.db.fetch_all(query)
         prices = None
@@ -31,9 +57,16 @@ class PriceService:
             prices = [Price.from_orm(item) for item in result]
         return prices
 
-    async def get_one(self, uuid: str) -> Optional[Price]:
-        query = select(PriceSql).where(PriceSql.id == uuid)
-        result = await self.db.fetch_one(query)
+    async def _load_line_items(self, uuid) -> Optional[list]:
+        prices = await self.get_all_in_product(uuid)
+        if not prices:
+            return None
+        return [
+            {'price': price.stripe_price_id, 'quantity': 1} for price in prices
+        ]
+
+    async def _load_one(self, uuid: str) -> Optional[Price]:
+        result = await price_by_id.fetch_one(self.db, id=uuid)
         price = None
         if result:
             price = Price.from_orm(result)
@@ -69,7 +102,8 @@ class PriceService:
         )
 
         # Todo проверить на наличие прайса
-        price_new = self.stripe.Price.create(
+        price_new = await self.stripe.request(
+            'Price.create',
             unit_amount=price.unit_amount,
             currency=price.currency,
             recurring={
@@ -84,6 +118,7 @@ class PriceService:
         price_base = Price(**price.dict())
         query = insert(PriceSql).values(**price_base.dict())
         await self.db.execute(query)
+        await self.catalog.invalidate(self.db)
         return price
 
     # async def edit(self, uuid, name):
@@ -100,18 +135,15 @@ class PriceService:
 
     async def delete(self, uuid):
         price_old = await self.get_one(uuid)
-        self.stripe.Price.modify(
+        await self.stripe.request(
+            'Price.modify',
             price_old.stripe_price_id,
             active=False,
         )
         query = update(PriceSql).where(PriceSql.id == uuid).values(active=False)
         await self.db.execute(query)
+        await self.catalog.invalidate(self.db)
 
 
-@lru_cache()
-def get_price_service(
-        db: Database = Depends(get_pg),
-        products_service: ProductService = Depends(get_products_service),
-        stripe_loc=Depends(get_stripe)
-) -> PriceService:
-    return PriceService(db, products_service, stripe_loc)
+async def get_price_service(request: Request) -> PriceService:
+    return request.app.state.services.prices
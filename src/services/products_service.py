@@ -1,26 +1,38 @@
 import uuid
 from datetime import datetime
-from functools import lru_cache
 
 from databases import Database
-from fastapi import Depends
-from sqlalchemy import select, insert, update, and_
+from fastapi import Request
+from sqlalchemy import bindparam, select, insert, update, and_
 
-from core.config import Settings
-from core.db import get_pg
-from core.stripe_config import get_stripe
+from core.queries import CompiledQuery
+from core.stripe_gateway import StripeGateway
 from db.sql_model import Product as Product_sql
 from models.products import Product
+from services.catalog_cache import CatalogCache
 
-settings = Settings()
+
+product_by_id = CompiledQuery(
+    'product_by_id',
+    select(Product_sql).where(Product_sql.id == bindparam('id')),
+)
 
 
 class ProductService:
-    def __init__(self, db: Database, stripe_loc):
+    def __init__(self, db: Database, stripe_loc: StripeGateway, catalog: CatalogCache):
         self.db = db
         self.stripe = stripe_loc
+        self.catalog = catalog
 
     async def get_all(self):
+        return await self.catalog.get_or_load('products', self._load_all)
+
+    async def get_one(self, uuid: str):
+        return await self.catalog.get_or_load(
+            ('product', str(uuid)), lambda: self._load_one(uuid)
+        )
+
+    async def _load_all(self):
         query = select(Product_sql).where(Product_sql.active == True)
         result = await self.db.fetch_all(query)
         products = None
@@ -28,9 +40,8 @@ class ProductService:
             products = [Product.from_orm(item) for item in result]
         return products
 
-    async def get_one(self, uuid: str):
-        query = select(Product_sql).where(Product_sql.id == uuid)
-        result = await self.db.fetch_one(query)
+    async def _load_one(self, uuid: str):
+        result = await product_by_id.fetch_one(self.db, id=uuid)
         product = None
         if result:
             product = Product.from_orm(result)
@@ -45,7 +56,7 @@ class ProductService:
 
     async def create(self, name: str):
 
-        product_new = self.stripe.Product.create(name=name)
+        product_new = await self.stripe.request('Product.create', name=name)
 
         new_id = uuid.uuid4()
         product = Product(
@@ -59,32 +70,33 @@ class ProductService:
         )
         query = insert(Product_sql).values(**product.dict())
         await self.db.execute(query)
+        await self.catalog.invalidate(self.db)
         return Product(**product.dict())
 
     async def edit(self, uuid, name):
         product_old = await self.get_one(uuid)
-        self.stripe.Product.modify(
+        await self.stripe.request(
+            'Product.modify',
             product_old.stripe_product_id,
             name=name,
         )
         query = update(Product_sql).where(Product_sql.id == uuid).values(name=name)
         await self.db.execute(query)
+        await self.catalog.invalidate(self.db)
         result = await self.get_one(uuid)
         return result
 
     async def delete(self, uuid):
         product_old = await self.get_one(uuid)
-        self.stripe.Product.modify(
+        await self.stripe.request(
+            'Product.modify',
             product_old.stripe_product_id,
             active=False,
         )
         query = update(Product_sql).where(Product_sql.id == uuid).values(active=False)
         await self.db.execute(query)
+        await self.catalog.invalidate(self.db)
 
 
-@lru_cache()
-def get_products_service(
-        db: Database = Depends(get_pg),
-        stripe_loc=Depends(get_stripe)
-) -> ProductService:
-    return ProductService(db, stripe_loc)
+async def get_products_service(request: Request) -> ProductService:
+    return request.app.state.services.products
@@ -0,0 +1,368 @@
+import asyncio
+import datetime
+import logging
+from http import HTTPStatus
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from databases import Database
+from fastapi import HTTPException, Request
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from core.stripe_gateway import StripeGateway
+from core.stripe_scheduler import Priority
+from db.sql_model import MigrationItemStatus
+from db.sql_model import Price as price_table
+from db.sql_model import StripeCustomer as customer_table
+from db.sql_model import Subscription as subscription_table
+from db.sql_model import SubscriptionMigrationItem as item_table
+from models.history import SubscriptionUpdate
+from models.migration import MigrationCounts, SubscriptionMigrationSummary
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+# subscription_migration_item has 7 columns, well below 32767 parameters.
+INSERT_CHUNK = 1000
+MAX_PROBLEMS = 100
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _lock_key(migration_id: str):
+    return func.hashtext(f'subscription_migration:{migration_id}')
+
+
+def _already_running(migration_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=HTTPStatus.CONFLICT,
+        detail=f'Migration {migration_id} is already running',
+    )
+
+
+def _count_checked(dry: SubscriptionMigrationSummary, page, checked):
+    for row in page:
+        problem = checked[row.stripe_subscription_id][1]
+        if problem:
+            dry.counts.skipped += 1
+            if len(dry.problems) < MAX_PROBLEMS:
+                dry.problems[row.stripe_subscription_id] = problem
+        else:
+            dry.counts.pending += 1
+
+
+class SubscriptionMigrationService:
+    """Moves many subscriptions to new prices, resumably.
+
+    Rows are stored per migration id in ``subscription_migration_item``
+    and processed page by page: prices and subscription owners are
+    resolved with one query each, then at most ``concurrency`` rows talk
+    to Stripe at a time. The calls go through the batch lane of the Stripe
+    scheduler, which paces them below every other caller. Each page's
+    outcome is written before the next one is read, so a run that stops
+    continues with the remaining rows. A row already on its target price
+    counts as done without a modification, and modifications carry an
+    idempotency key of the row and its attempt, so a row processed twice
+    is changed once while a retry of a failed row is a new request.
+    """
+
+    def __init__(self, db: Database, stripe_loc: StripeGateway,
+                 concurrency: int):
+        self.db = db
+        self.stripe = stripe_loc
+        self.concurrency = concurrency
+
+    async def submit(self, migration_id: str,
+                     items: List[SubscriptionUpdate]) -> int:
+        """Store the rows of a migration, the ones already there are kept.
+
+        A row already stored for another user or price is an error: 409
+        with the subscription ids, and nothing is stored.
+        """
+        await self._check_changed(migration_id, items)
+        rows = [{
+            'migration_id': migration_id,
+            'stripe_subscription_id': item.subscription_id,
+            'user_id': item.user_uuid,
+            'price_id': item.price_uuid,
+            'status': MigrationItemStatus.pending.value,
+            'updated_at': _now(),
+        } for item in items]
+        added = 0
+        for start in range(0, len(rows), INSERT_CHUNK):
+            result = await self.db.fetch_all(
+                insert(item_table).values(rows[start:start + INSERT_CHUNK])
+                .on_conflict_do_nothing()
+                .returning(item_table.stripe_subscription_id)
+            )
+            added += len(result)
+        return added
+
+    async def _check_changed(self, migration_id: str,
+                             items: List[SubscriptionUpdate]):
+        wanted = {
+            item.subscription_id: (str(item.user_uuid), str(item.price_uuid))
+            for item in items
+        }
+        subscription_ids = list(wanted)
+        changed = []
+        for start in range(0, len(subscription_ids), INSERT_CHUNK):
+            stored = await self.db.fetch_all(
+                select(
+                    item_table.stripe_subscription_id,
+                    item_table.user_id,
+                    item_table.price_id,
+                ).where(
+                    and_(
+                        item_table.migration_id == migration_id,
+                        item_table.stripe_subscription_id.in_(
+                            subscription_ids[start:start + INSERT_CHUNK]
+                        ),
+                    )
+                )
+            )
+            changed += [
+                row.stripe_subscription_id for row in stored
+                if wanted[row.stripe_subscription_id]
+                != (str(row.user_id), str(row.price_id))
+            ]
+        if changed:
+            raise HTTPException(
+                status_code=HTTPStatus.CONFLICT,
+                detail={
+                    'message': f'{len(changed)} rows are already stored in '
+                               f'migration {migration_id} with another user '
+                               f'or price, use a new migration id',
+                    'subscription_ids': changed[:MAX_PROBLEMS],
+                },
+            )
+
+    async def check(self, migration_id: str,
+                    items: List[SubscriptionUpdate]) -> SubscriptionMigrationSummary:
+        """Dry run of rows not stored yet: the checks of a run, no writes."""
+        await self._check_changed(migration_id, items)
+        dry = SubscriptionMigrationSummary(
+            migration_id=migration_id, dry_run=True, counts=MigrationCounts(),
+        )
+        rows = [SimpleNamespace(
+            stripe_subscription_id=item.subscription_id,
+            user_id=item.user_uuid,
+            price_id=item.price_uuid,
+        ) for item in items]
+        for start in range(0, len(rows), PAGE_SIZE):
+            page = rows[start:start + PAGE_SIZE]
+            _count_checked(dry, page, await self._validate(page))
+        return dry
+
+    async def ensure_idle(self, migration_id: str):
+        """409 if a run of the migration holds its lock right now."""
+        async with self.db.connection() as connection:
+            if not await connection.fetch_val(
+                select(func.pg_try_advisory_lock(_lock_key(migration_id)))
+            ):
+                raise _already_running(migration_id)
+            await connection.execute(
+                select(func.pg_advisory_unlock(_lock_key(migration_id)))
+            )
+
+    async def summary(self, migration_id: str) -> SubscriptionMigrationSummary:
+        rows = await self.db.fetch_all(
+            select(item_table.status, func.count()).where(
+                item_table.migration_id == migration_id
+            ).group_by(item_table.status)
+        )
+        problems = await self.db.fetch_all(
+            select(item_table.stripe_subscription_id, item_table.error).where(
+                and_(
+                    item_table.migration_id == migration_id,
+                    item_table.error.isnot(None),
+                )
+            ).limit(MAX_PROBLEMS)
+        )
+        return SubscriptionMigrationSummary(
+            migration_id=migration_id,
+            counts=MigrationCounts(**{row[0]: row[1] for row in rows}),
+            problems={row[0]: row[1] for row in problems},
+        )
+
+    async def run(self, migration_id: str, dry_run: bool = False,
+                  retry_failed: bool = False) -> SubscriptionMigrationSummary:
+        """Process the pending rows; with ``dry_run`` only validate them."""
+        statuses = [MigrationItemStatus.pending.value]
+        if retry_failed:
+            statuses.append(MigrationItemStatus.failed.value)
+        lock_key = _lock_key(migration_id)
+        async with self.db.connection() as connection:
+            if not await connection.fetch_val(
+                select(func.pg_try_advisory_lock(lock_key))
+            ):
+                raise _already_running(migration_id)
+            try:
+                dry_counts = await self._run(
+                    migration_id, statuses, dry_run
+                )
+            finally:
+                await connection.execute(
+                    select(func.pg_advisory_unlock(lock_key))
+                )
+        if dry_run:
+            return dry_counts
+        return await self.summary(migration_id)
+
+    async def run_in_background(self, migration_id: str,
+                                retry_failed: bool = False):
+        """``run`` for a background task, where no one gets a 409 answer.
+
+        A concurrent request may have started the migration after this
+        request checked it, so a run holding the lock is only logged.
+        """
+        try:
+            await self.run(migration_id, retry_failed=retry_failed)
+        except HTTPException as e:
+            if e.status_code != HTTPStatus.CONFLICT:
+                raise
+            logger.warning('Migration %s not started: %s',
+                           migration_id, e.detail)
+
+    async def _run(self, migration_id: str, statuses: List[str],
+                   dry_run: bool) -> SubscriptionMigrationSummary:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        dry = SubscriptionMigrationSummary(
+            migration_id=migration_id, dry_run=True, counts=MigrationCounts(),
+        )
+        last = ''
+        while True:
+            page = await self.db.fetch_all(
+                select(item_table).where(
+                    and_(
+                        item_table.migration_id == migration_id,
+                        item_table.status.in_(statuses),
+                        item_table.stripe_subscription_id > last,
+                    )
+                ).order_by(item_table.stripe_subscription_id).limit(PAGE_SIZE)
+            )
+            if not page:
+                return dry
+            last = page[-1].stripe_subscription_id
+            checked = await self._validate(page)
+            if dry_run:
+                _count_checked(dry, page, checked)
+                continue
+
+            async def migrate(row):
+                stripe_price_id, problem = checked[row.stripe_subscription_id]
+                if problem:
+                    return MigrationItemStatus.skipped, problem
+                async with semaphore:
+                    return await self._migrate(
+                        migration_id, row.stripe_subscription_id,
+                        stripe_price_id, row.attempts,
+                    )
+
+            results = await asyncio.gather(*(migrate(row) for row in page))
+            # One UPDATE per outcome, most rows share "done" or one reason.
+            outcomes: Dict[Tuple[MigrationItemStatus, Optional[str]], List[str]] = {}
+            for row, outcome in zip(page, results):
+                outcomes.setdefault(outcome, []).append(
+                    row.stripe_subscription_id
+                )
+            async with self.db.transaction():
+                for (status, error), subscription_ids in outcomes.items():
+                    await self.db.execute(
+                        update(item_table).where(
+                            and_(
+                                item_table.migration_id == migration_id,
+                                item_table.stripe_subscription_id.in_(
+                                    subscription_ids
+                                ),
+                            )
+                        ).values(
+                            status=status.value, error=error,
+                            updated_at=_now(),
+                            # The next retry uses a new idempotency key.
+                            attempts=item_table.attempts + int(
+                                status == MigrationItemStatus.failed
+                            ),
+                        )
+                    )
+            logger.info('Migration %s: %s rows up to %s written',
+                        migration_id, len(page), last)
+
+    async def _validate(self, page) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """Target Stripe price or the reason to skip, for every row."""
+        prices = {
+            row.id: row.stripe_price_id
+            for row in await self.db.fetch_all(
+                select(price_table.id, price_table.stripe_price_id).where(
+                    price_table.id.in_({row.price_id for row in page})
+                )
+            )
+        }
+        owners = {
+            row.stripe_subscription_id: row
+            for row in await self.db.fetch_all(
+                select(
+                    subscription_table.stripe_subscription_id,
+                    subscription_table.status,
+                    customer_table.user_id,
+                ).join(
+                    customer_table,
+                    customer_table.stripe_customer_id == subscription_table.stripe_customer_id,
+                ).where(
+                    subscription_table.stripe_subscription_id.in_(
+                        [row.stripe_subscription_id for row in page]
+                    )
+                )
+            )
+        }
+        checked = {}
+        for row in page:
+            owner = owners.get(row.stripe_subscription_id)
+            stripe_price_id = prices.get(row.price_id)
+            if stripe_price_id is None:
+                problem = f'Unknown price {row.price_id}'
+            elif owner is None or str(owner.user_id) != str(row.user_id):
+                problem = 'This user did not have the specified subscription.'
+            elif owner.status != 'active':
+                problem = f'Subscription is {owner.status}'
+            else:
+                problem = None
+            checked[row.stripe_subscription_id] = (stripe_price_id, problem)
+        return checked
+
+    async def _migrate(self, migration_id: str, subscription_id: str,
+                       stripe_price_id: str, attempt: int):
+        try:
+            subscription = await self.stripe.request(
+                'Subscription.retrieve', subscription_id,
+                priority=Priority.batch,
+            )
+            item = subscription['items']['data'][0]
+            if item['price']['id'] == stripe_price_id:
+                return MigrationItemStatus.done, None
+            if subscription['status'] != 'active':
+                return (MigrationItemStatus.skipped,
+                        f'Subscription is {subscription["status"]}')
+            await self.stripe.request(
+                'Subscription.modify',
+                subscription_id,
+                cancel_at_period_end=False,
+                proration_behavior='always_invoice',
+                items=[{'id': item['id'], 'price': stripe_price_id}],
+                idempotency_key=(f'subscription-migration:{migration_id}:'
+                                 f'{subscription_id}:{attempt}'),
+                priority=Priority.batch,
+            )
+            return MigrationItemStatus.done, None
+        except Exception as e:
+            logger.warning('Migration %s of %s failed: %s',
+                           migration_id, subscription_id, e)
+            return MigrationItemStatus.failed, str(e) or type(e).__name__
+
+
+async def get_subscription_migration_service(
+        request: Request) -> SubscriptionMigrationService:
+    return request.app.state.services.subscription_migration
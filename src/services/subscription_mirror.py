@@ -0,0 +1,110 @@
+import datetime
+import logging
+import uuid
+from typing import Optional
+
+from databases import Database
+from fastapi import Request
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.postgresql import insert
+
+from core.stripe_gateway import StripeGateway
+from db.sql_model import (
+    StripeCustomer as customer_table,
+    Subscription as subscription_table,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _from_timestamp(timestamp: Optional[int]) -> Optional[datetime.datetime]:
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def subscription_price_id(subscription: dict) -> Optional[str]:
+    """Price of the first item; ``plan`` is None with several items."""
+    items = (subscription.get('items') or {}).get('data') or []
+    if items:
+        return items[0]['price']['id']
+    plan = subscription.get('plan')
+    return plan['id'] if plan else None
+
+
+class SubscriptionMirrorService:
+    """Keeps the local ``subscription`` projection in line with Stripe."""
+
+    def __init__(self, db: Database, stripe_loc: StripeGateway):
+        self.db = db
+        self.stripe = stripe_loc
+
+    async def upsert(self, subscription: dict,
+                     state_at: Optional[datetime.datetime] = None):
+        """Insert or refresh one Stripe subscription object.
+
+        ``state_at`` is when Stripe had this state, the ``created`` time of
+        the event carrying it; an object just retrieved is current. Events
+        arrive in any order, an older state never replaces a newer one.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        values = {
+            'stripe_customer_id': subscription['customer'],
+            'status': subscription['status'],
+            'stripe_price_id': subscription_price_id(subscription),
+            'current_period_start': _from_timestamp(
+                subscription['current_period_start']
+            ),
+            'current_period_end': _from_timestamp(
+                subscription['current_period_end']
+            ),
+            'cancel_at_period_end': subscription['cancel_at_period_end'],
+            'ended_at': _from_timestamp(subscription.get('ended_at')),
+            'updated_at': now,
+            'stripe_state_at': state_at or now,
+        }
+        query = insert(subscription_table).values(
+            id=uuid.uuid4(),
+            stripe_subscription_id=subscription['id'],
+            **values,
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[subscription_table.stripe_subscription_id],
+            set_=values,
+            where=or_(
+                subscription_table.stripe_state_at.is_(None),
+                subscription_table.stripe_state_at
+                <= query.excluded.stripe_state_at,
+            ),
+        )
+        await self.db.execute(query)
+
+    async def reconcile(self, stripe_customer_id: Optional[str] = None) -> int:
+        """Reload subscriptions from Stripe for one or every known customer.
+
+        Every customer is covered by one paged ``Subscription.list``, only
+        the subscriptions of customers mapped to a user are stored.
+        """
+        params = {'status': 'all', 'limit': 100}
+        known = None
+        if stripe_customer_id:
+            params['customer'] = stripe_customer_id
+        else:
+            query = select(customer_table.stripe_customer_id)
+            known = {
+                row.stripe_customer_id
+                for row in await self.db.fetch_all(query)
+            }
+
+        count = 0
+        async for page in self.stripe.pages('Subscription.list', **params):
+            for subscription in page:
+                if known is None or subscription['customer'] in known:
+                    await self.upsert(subscription)
+                    count += 1
+        logger.info('Reconciled %s subscriptions', count)
+        return count
+
+
+async def get_subscription_mirror_service(request: Request) -> SubscriptionMirrorService:
+    return request.app.state.services.subscription_mirror
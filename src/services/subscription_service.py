@@ -1,21 +1,79 @@
+import asyncio
+import datetime
+import hashlib
+import time
+from typing import Dict, Tuple
 from uuid import UUID
 
-from sqlalchemy import select
-from functools import lru_cache
-from fastapi import Depends
+from sqlalchemy import bindparam, select, and_
+from sqlalchemy.dialects.postgresql import insert
+from fastapi import Request
 
-from core.db import get_pg
-from core.config import Settings
+from core.config import get_settings
+from core.queries import CompiledQuery
 from databases import Database
 
-from core.stripe_config import get_stripe
+from core.stripe_gateway import StripeGateway
 from db.sql_model import SubscriptionStatus
+from db.sql_model import CheckoutSession as session_table
 from db.sql_model import StripeCustomer as customer_table
-
-from services.prices_service import PriceService, get_price_service
-from services.products_service import ProductService, get_products_service
-
-settings = Settings()
+from db.sql_model import Subscription as subscription_table
+
+from services.prices_service import PriceService
+from services.products_service import ProductService
+from services.subscription_status import SubscriptionStatusCache
+
+settings = get_settings()
+
+active_subscriber = CompiledQuery(
+    'active_subscriber',
+    select(customer_table).join(
+        subscription_table,
+        subscription_table.stripe_customer_id == customer_table.stripe_customer_id,
+    ).where(
+        and_(
+            customer_table.user_id == bindparam('user_id'),
+            subscription_table.status == SubscriptionStatus.active.value,
+        )
+    ).limit(1),
+)
+customer_by_user_id = CompiledQuery(
+    'customer_by_user_id',
+    select(customer_table).where(customer_table.user_id == bindparam('user_id')),
+)
+open_checkout_session = CompiledQuery(
+    'open_checkout_session',
+    select(session_table.url).where(
+        and_(
+            session_table.user_id == bindparam('user_id'),
+            session_table.product_id == bindparam('product_id'),
+            session_table.expires_at > bindparam('valid_until'),
+        )
+    ),
+)
+
+# A session is only reused if the user has this long left to pay.
+REUSE_MARGIN = 300
+# Stripe answers 409 while a request with the same idempotency key is in
+# flight; once it is done, a retry gets its session.
+CONFLICT_RETRIES = 3
+CONFLICT_DELAY = 0.5
+
+
+def _from_timestamp(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def checkout_idempotency_key(user_id: str, product_id: str, bucket: int,
+                             line_items: list) -> str:
+    """Same key for the clicks of a user on a product in one time bucket.
+
+    The prices are part of the key: Stripe rejects a reused key whose
+    parameters differ, which a catalog change inside the bucket would do.
+    """
+    prices = ','.join(item['price'] for item in line_items)
+    value = f'checkout:{user_id}:{product_id}:{bucket}:{prices}'
+    return hashlib.sha256(value.encode()).hexdigest()
 
 
 class SubscriptionService:
@@ -25,61 +83,102 @@ class SubscriptionService:
         db: Database,
         price_service: PriceService,
         product_service: ProductService,
-        stripe_loc,
+        stripe_loc: StripeGateway,
+        status_cache: SubscriptionStatusCache,
     ):
         self.db = db
         self.price_service = price_service
         self.product_service = product_service
         self.stripe = stripe_loc
+        self.status_cache = status_cache
+        self._checkouts: Dict[Tuple[str, str], asyncio.Task] = {}
 
     async def check_user_has_subscription(self, user_id: UUID):
         """Check if current user already has a subscription."""
-        get_customer_query = select(customer_table).where(customer_table.user_id == user_id)
-        customer = await self.db.fetch_one(get_customer_query)
-
-        if customer and self.stripe.Subscription.list(
-            customer=customer.stripe_customer_id,
-            status=SubscriptionStatus.active.value,
-            limit=1,
-        ):
-            return customer
-
-    async def create_subscription_session(self, user_id: UUID, product_id: str):
-        """Create session to subscribe."""
-        prices = await self.price_service.get_all_in_product(product_id)
-        price_items = [
-            {
-                'price': price.stripe_price_id,
-                'quantity': 1,
-            } for price in prices
-        ]
-
-        get_customer_query = select(customer_table).where(customer_table.user_id == user_id)
-        customer = await self.db.fetch_one(get_customer_query)
+        return await self.status_cache.get(
+            user_id,
+            lambda: active_subscriber.fetch_one(self.db, user_id=user_id),
+        )
+
+    async def create_subscription_session(self, user_id: UUID, product_id: str) -> str:
+        """URL of a checkout session, the open one of the user if any.
+
+        Concurrent clicks in this process share one lookup; across
+        processes the idempotency key makes Stripe return the same session,
+        after a retry if the other request is still in flight.
+        """
+        key = (str(user_id), str(product_id))
+        task = self._checkouts.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._checkout_url(*key))
+            self._checkouts[key] = task
+            task.add_done_callback(lambda done: self._checkouts.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _checkout_url(self, user_id: str, product_id: str) -> str:
+        now = time.time()
+        session = await open_checkout_session.fetch_one(
+            self.db, user_id=user_id, product_id=product_id,
+            valid_until=_from_timestamp(now + REUSE_MARGIN),
+        )
+        if session:
+            return session.url
+
+        line_items = await self.price_service.get_line_items(product_id)
+        if not line_items:
+            raise ValueError(f'Product {product_id} has no active prices')
+        customer = await customer_by_user_id.fetch_one(self.db, user_id=user_id)
         domain_url = settings.subscription_url
+        window = settings.checkout_idempotency_window
+        bucket = int(now // window)
 
         session_params = {
             'success_url': domain_url + '/success?session_id={CHECKOUT_SESSION_ID}',
             'cancel_url': domain_url + '/canceled',
             'payment_method_types': ['card'],
             'mode': 'subscription',
-            'line_items': price_items,
+            'line_items': line_items,
             'metadata': {
                 'user_id': user_id,
-            }
+            },
+            # Derived from the bucket, so a retried call has equal parameters.
+            'expires_at': (bucket + 1) * window + settings.checkout_session_ttl,
+            'idempotency_key': checkout_idempotency_key(
+                user_id, product_id, bucket, line_items
+            ),
         }
         if customer:
             session_params['customer'] = customer.stripe_customer_id
 
-        checkout_session = self.stripe.checkout.Session.create(**session_params)
-        return checkout_session
-
-
-@lru_cache()
-def get_subscription_service(
-    db: Database = Depends(get_pg),
-    price_service: PriceService = Depends(get_price_service),
-    product_service: ProductService = Depends(get_products_service),
-    stripe_loc=Depends(get_stripe),
-) -> SubscriptionService:
-    return SubscriptionService(db, price_service, product_service, stripe_loc)
+        checkout_session = await self._create_session(session_params)
+        values = {
+            'stripe_session_id': checkout_session.id,
+            'url': checkout_session.url,
+            'expires_at': _from_timestamp(checkout_session.expires_at),
+        }
+        await self.db.execute(
+            insert(session_table).values(
+                user_id=user_id, product_id=product_id, **values
+            ).on_conflict_do_update(
+                index_elements=[session_table.user_id, session_table.product_id],
+                set_=values,
+            )
+        )
+        return checkout_session.url
+
+    async def _create_session(self, session_params: dict):
+        """Create the session, retrying while another process holds the key."""
+        for attempt in range(CONFLICT_RETRIES + 1):
+            try:
+                return await self.stripe.request(
+                    'checkout.Session.create', **session_params
+                )
+            except Exception as error:
+                if (getattr(error, 'http_status', None) != 409
+                        or attempt == CONFLICT_RETRIES):
+                    raise
+            await asyncio.sleep(CONFLICT_DELAY * (attempt + 1))
+
+
+async def get_subscription_service(request: Request) -> SubscriptionService:
+    return request.app.state.services.subscriptions
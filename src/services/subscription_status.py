@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+import asyncpg
+from databases import Database
+from sqlalchemy import String, cast, func, select
+
+from core.metrics import Counter
+from db.sql_model import StripeCustomer as customer_table
+
+logger = logging.getLogger(__name__)
+
+STATUS_CHANNEL = 'subscription_status_changed'
+
+status_cache_requests = Counter(
+    'subscription_status_cache_requests_total',
+    'Subscription status cache lookups by result',
+    labels=('result',),
+)
+
+
+class _Entry(NamedTuple):
+    expires_at: float
+    value: Any
+
+
+class SubscriptionStatusCache:
+    """Short lived LRU cache of "has an active subscription" per user.
+
+    Values are the active customer row or None. Concurrent misses for a
+    user share one query. Webhook handling calls ``invalidate_customer``
+    for the customer of every event; with ``listen`` started the user ids
+    are broadcast to the other workers through Postgres NOTIFY, otherwise
+    they see the change after ``ttl`` seconds at most.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._listener: Optional[asyncpg.Connection] = None
+
+    async def get(self, user_id, loader: Callable[[], Awaitable[Any]]):
+        key = str(user_id)
+        entry = self._entries.get(key)
+        if entry and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            status_cache_requests.inc(result='hit')
+            return entry.value
+
+        task = self._inflight.get(key)
+        if task:
+            status_cache_requests.inc(result='coalesced')
+        else:
+            status_cache_requests.inc(result='miss')
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._store(key, done))
+        return await asyncio.shield(task)
+
+    def discard(self, user_id):
+        key = str(user_id)
+        self._entries.pop(key, None)
+        # A lookup started before the change must not be stored.
+        self._inflight.pop(key, None)
+
+    async def invalidate_customer(self, db: Database, stripe_customer_id: str):
+        """Forget the users of a Stripe customer, on every worker."""
+        query = select(customer_table.user_id).where(
+            customer_table.stripe_customer_id == stripe_customer_id
+        )
+        if self._listener:
+            query = query.add_columns(func.pg_notify(
+                STATUS_CHANNEL, cast(customer_table.user_id, String)
+            ))
+        for row in await db.fetch_all(query):
+            self.discard(row[0])
+
+    def _notified(self, connection, pid, channel, payload):
+        self.discard(payload)
+
+    def _store(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is not task:
+            return
+        del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._entries[key] = _Entry(time.monotonic() + self.ttl, task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def listen(self, dsn: str):
+        self._listener = await asyncpg.connect(dsn)
+        await self._listener.add_listener(STATUS_CHANNEL, self._notified)
+        logger.info('Listening for subscription changes on %s', STATUS_CHANNEL)
+
+    async def close(self):
+        if self._listener:
+            await self._listener.close()
+            self._listener = None
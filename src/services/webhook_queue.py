@@ -0,0 +1,266 @@
+import asyncio
+import datetime
+import logging
+import zlib
+from typing import List, Optional
+
+from databases import Database
+from sqlalchemy import func, select, update, and_
+from sqlalchemy.dialects.postgresql import insert
+
+from core.log_context import bind_stripe_event
+from core.stripe_scheduler import Priority, stripe_priority
+from db.sql_model import StripeEvent as event_table, StripeEventStatus
+from services.webhook_service import WebhookSubscriptionService
+
+logger = logging.getLogger(__name__)
+
+
+def event_customer(event: dict) -> Optional[str]:
+    return event['data']['object'].get('customer')
+
+
+class WebhookEventQueue:
+    """Idempotent store and worker pool for verified Stripe events.
+
+    Every event is written to ``stripe_event`` keyed by its Stripe id, so a
+    redelivery is dropped before any side effect. In background mode the
+    webhook returns right after the insert and workers process the event;
+    events of one customer always land on the same lane. Across processes
+    a transaction level advisory lock on the customer id serialises the
+    events of one customer, and under it the oldest pending event of the
+    customer is applied first, whichever process received it.
+
+    A failed event is retried up to ``max_attempts`` times with doubling
+    pauses, by a poller in background mode. A redelivery of a failed event
+    queues it again; in inline mode the error is re-raised, so Stripe gets
+    a 5xx answer and redelivers.
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            webhook_service: WebhookSubscriptionService,
+            workers: int,
+            background: bool,
+            max_attempts: int = 10,
+            retry_backoff: float = 5.0,
+            retry_max_backoff: float = 3600.0,
+            retry_poll_interval: float = 10.0,
+    ):
+        self.db = db
+        self.webhook_service = webhook_service
+        self.background = background
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+        self.retry_poll_interval = retry_poll_interval
+        self._lanes: List[asyncio.Queue] = [
+            asyncio.Queue() for _ in range(workers)
+        ]
+        self._tasks: List[asyncio.Task] = []
+
+    def _lane(self, customer_id: Optional[str]) -> asyncio.Queue:
+        key = (customer_id or '').encode()
+        return self._lanes[zlib.crc32(key) % len(self._lanes)]
+
+    async def ingest(self, event: dict) -> bool:
+        """Store the event; False means it is a redelivery already handled.
+
+        A redelivery of a failed event makes it pending again.
+        """
+        customer_id = event_customer(event)
+        query = insert(event_table).values(
+            id=event['id'],
+            type=event['type'],
+            customer_id=customer_id,
+            payload=event,
+            status=StripeEventStatus.pending.value,
+            received_at=datetime.datetime.now(datetime.timezone.utc),
+        ).on_conflict_do_update(
+            index_elements=[event_table.id],
+            set_={
+                'status': StripeEventStatus.pending.value,
+                'next_attempt_at': None,
+            },
+            where=event_table.status == StripeEventStatus.failed.value,
+        ).returning(event_table.id)
+        if not await self.db.fetch_one(query):
+            return False
+
+        if self.background:
+            self._lane(customer_id).put_nowait(event['id'])
+        else:
+            await self.process(event['id'])
+        return True
+
+    @staticmethod
+    def _pending(event_id: str, customer_id: Optional[str]):
+        """Pending events of the customer, oldest first; or the event alone."""
+        if customer_id:
+            same = event_table.customer_id == customer_id
+        else:
+            same = event_table.id == event_id
+        return select(event_table.id, event_table.payload).where(
+            and_(same, event_table.status == StripeEventStatus.pending.value)
+        ).order_by(event_table.received_at, event_table.id).limit(1)
+
+    async def process(self, event_id: str):
+        """Apply a pending event once, atomically with its status change.
+
+        Pending events of the same customer received before it are applied
+        first. Stripe objects an event needs are fetched before its
+        transaction opens, so no lock is held during a Stripe call.
+        """
+        stripe_priority.set(Priority.webhook)
+        bind_stripe_event(event_id)
+        received_at = select(event_table.received_at).where(
+            and_(
+                event_table.id == event_id,
+                event_table.status == StripeEventStatus.pending.value,
+            )
+        ).scalar_subquery()
+        customer_id = await self.db.fetch_val(
+            select(event_table.customer_id).where(event_table.id == event_id)
+        )
+        while True:
+            # Empty once the event itself is no longer pending.
+            oldest = await self.db.fetch_one(
+                self._pending(event_id, customer_id).where(
+                    event_table.received_at <= received_at
+                )
+            )
+            if not oldest:
+                return
+            bind_stripe_event(oldest.id, customer_id)
+            try:
+                prefetched = await self.webhook_service.prefetch(
+                    oldest.payload
+                )
+                await self._apply(oldest.id, customer_id, prefetched)
+            except Exception as error:
+                logger.exception('Stripe event %s failed', oldest.id)
+                await self._failed(oldest.id, error)
+                if oldest.id == event_id and not self.background:
+                    raise
+
+    async def _apply(self, event_id: str, customer_id: Optional[str],
+                     prefetched: dict):
+        """Apply the event if it is still the customer's oldest pending one.
+
+        Otherwise another process got there first and nothing is done.
+        """
+        async with self.db.transaction():
+            if customer_id:
+                await self.db.execute(select(func.pg_advisory_xact_lock(
+                    func.hashtext(customer_id)
+                )))
+            row = await self.db.fetch_one(
+                self._pending(event_id, customer_id).with_for_update()
+            )
+            if not row or row.id != event_id:
+                return
+            await self.webhook_service.handling_event(row.payload, prefetched)
+            await self._set_status(event_id, StripeEventStatus.processed)
+
+    async def _set_status(self, event_id: str, status: StripeEventStatus,
+                          error: Optional[str] = None):
+        query = update(event_table).where(
+            event_table.id == event_id
+        ).values(
+            status=status.value,
+            processed_at=datetime.datetime.now(datetime.timezone.utc),
+            error=error,
+        )
+        await self.db.execute(query)
+
+    async def _failed(self, event_id: str, error: Exception):
+        """Mark the event failed and schedule its retry, if any is left."""
+        attempts = await self.db.fetch_val(
+            select(event_table.attempts).where(event_table.id == event_id)
+        ) or 0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        next_attempt_at = None
+        if attempts + 1 < self.max_attempts:
+            delay = min(self.retry_backoff * 2 ** attempts,
+                        self.retry_max_backoff)
+            next_attempt_at = now + datetime.timedelta(seconds=delay)
+        query = update(event_table).where(
+            event_table.id == event_id
+        ).values(
+            status=StripeEventStatus.failed.value,
+            processed_at=now,
+            error=repr(error),
+            attempts=attempts + 1,
+            next_attempt_at=next_attempt_at,
+        )
+        await self.db.execute(query)
+
+    async def _retry_due(self) -> int:
+        """Queue again the failed events whose retry is due."""
+        query = update(event_table).where(
+            and_(
+                event_table.status == StripeEventStatus.failed.value,
+                event_table.next_attempt_at <= func.now(),
+            )
+        ).values(
+            status=StripeEventStatus.pending.value,
+            next_attempt_at=None,
+        ).returning(
+            event_table.id, event_table.customer_id, event_table.received_at
+        )
+        rows = await self.db.fetch_all(query)
+        for row in sorted(rows, key=lambda row: row.received_at):
+            self._lane(row.customer_id).put_nowait(row.id)
+        return len(rows)
+
+    async def _retry_loop(self):
+        while True:
+            try:
+                count = await self._retry_due()
+                if count:
+                    logger.info('Retrying %s failed Stripe events', count)
+            except Exception:
+                logger.exception('Re-queueing failed Stripe events failed')
+            await asyncio.sleep(self.retry_poll_interval)
+
+    async def _worker(self, lane: asyncio.Queue):
+        while True:
+            event_id = await lane.get()
+            try:
+                await self.process(event_id)
+            except Exception:
+                logger.exception('Stripe event %s left pending', event_id)
+            finally:
+                lane.task_done()
+
+    async def _recover(self):
+        """Re-queue events left pending by a previous process."""
+        query = select(
+            event_table.id, event_table.customer_id
+        ).where(
+            event_table.status == StripeEventStatus.pending.value
+        ).order_by(event_table.received_at)
+        for row in await self.db.fetch_all(query):
+            self._lane(row.customer_id).put_nowait(row.id)
+
+    async def start(self):
+        if not self.background:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(lane)) for lane in self._lanes
+        ]
+        await self._recover()
+        self._tasks.append(asyncio.create_task(self._retry_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+webhook_queue: Optional[WebhookEventQueue] = None
+
+
+async def get_webhook_queue() -> WebhookEventQueue:
+    return webhook_queue
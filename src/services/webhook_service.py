@@ -1,102 +1,193 @@
 import datetime
 import json
 import uuid
-import requests
-
-import stripe
-from functools import lru_cache
-from fastapi import Depends
+from functools import partial
+from typing import Optional
 
 from core.constants import (
+    CHECKOUT_SESSION_EXPIRED,
     CUSTOMER_CREATED_EVENT,
     CUSTOMER_SUBSCRIPTION_CREATED,
     PAYMENT_SUCCEEDED,
     PAYMENT_FAILED,
     CUSTOMER_SUBSCRIPTION_UPDATED,
+    CUSTOMER_SUBSCRIPTION_DELETED,
 )
-from core.db import get_pg
-from core.config import Settings
+from core.queries import CompiledQuery
+from core.stripe_gateway import StripeGateway
 from databases import Database
 from db.sql_model import StripeCustomer as customer_table, SubscriptionStatus
+from db.sql_model import CheckoutSession as checkout_session_table
 from db.sql_model import BillingHistory as billing_history
 from db.sql_model import Price as price_table
-from sqlalchemy import select, insert
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.postgresql import insert
 
 from models.billing_history import BillingHistory
 from models.customer import UserCustomer
+from services.auth_outbox import AuthOutboxService
+from services.subscription_mirror import (
+    SubscriptionMirrorService,
+    subscription_price_id,
+)
+from services.subscription_status import SubscriptionStatusCache
+
+customer_by_stripe_id = CompiledQuery(
+    'customer_by_stripe_id',
+    select(customer_table).where(
+        customer_table.stripe_customer_id == bindparam('stripe_customer_id')
+    ),
+)
+price_by_stripe_id = CompiledQuery(
+    'price_by_stripe_id',
+    select(price_table).where(
+        price_table.stripe_price_id == bindparam('stripe_price_id')
+    ),
+)
+
+
+def event_time(created: Optional[int]) -> Optional[datetime.datetime]:
+    if created is None:
+        return None
+    return datetime.datetime.fromtimestamp(created, datetime.timezone.utc)
+
+
+def invoice_price_id(invoice: dict) -> str:
+    return invoice['lines']['data'][0]['price']['id']
 
 
-settings = Settings()
-stripe.api_key = settings.stripe_key
+def payment_history(invoice: dict, stripe_customer: uuid.UUID, price: uuid.UUID,
+                    subscription_status: str,
+                    created_at: datetime.datetime) -> BillingHistory:
+    """History row of a paid or failed invoice.
+
+    Keyed by the invoice id and the outcome: a retried payment that
+    succeeds after a failure gets its own row.
+    """
+    success_paid = invoice['status'] == 'paid' and invoice['paid'] is True
+    event_type = PAYMENT_SUCCEEDED if success_paid else PAYMENT_FAILED
+    return BillingHistory(
+        id=uuid.uuid4(),
+        stripe_customer=stripe_customer,
+        price=price,
+        stripe_subscription_id=invoice['subscription'],
+        event_type=event_type,
+        subscription_status=subscription_status,
+        created_at=created_at,
+        stripe_object_id=f'{invoice["id"]}:{event_type}',
+    )
+
+
+def subscription_history(event_id: str, data: dict, stripe_customer: uuid.UUID,
+                         price: uuid.UUID,
+                         created_at: datetime.datetime) -> BillingHistory:
+    """History row of a subscription created/updated event, keyed by the event id."""
+    subscription_data = data['object']
+    updated_data = data.get('previous_attributes')
+    return BillingHistory(
+        id=uuid.uuid4(),
+        stripe_customer=stripe_customer,
+        price=price,
+        stripe_subscription_id=subscription_data['id'],
+        event_type=CUSTOMER_SUBSCRIPTION_UPDATED if updated_data else CUSTOMER_SUBSCRIPTION_CREATED,
+        subscription_status=subscription_data['status'],
+        created_at=created_at,
+        additional_info=json.dumps(updated_data) if updated_data else None,
+        stripe_object_id=event_id,
+    )
+
+
+def insert_history(rows):
+    """Insert history rows, skipping Stripe objects already recorded."""
+    return insert(billing_history).values(rows).on_conflict_do_nothing(
+        index_elements=[billing_history.stripe_object_id]
+    )
 
 
 class WebhookSubscriptionService:
 
-    def __init__(self, db: Database):
+    def __init__(
+        self,
+        db: Database,
+        stripe_loc: StripeGateway,
+        auth_outbox: AuthOutboxService,
+        subscription_mirror: SubscriptionMirrorService,
+        status_cache: SubscriptionStatusCache,
+    ):
         self.db = db
+        self.stripe = stripe_loc
+        self.auth_outbox = auth_outbox
+        self.subscription_mirror = subscription_mirror
+        self.status_cache = status_cache
 
-    async def _customer_created_event(self, data: dict):
+    async def _customer_created_event(self, data: dict, event_id: str):
         """Map user_id with stripe customer if not exists."""
         customer_id = data['object'].get('customer')
         user_id = data['object']['metadata'].get('user_id')
-        get_user_query = select(customer_table).where(customer_table.stripe_customer_id == customer_id)
-        if result := await self.db.fetch_one(get_user_query):
-            return result
         instance_id = uuid.uuid4()
         user_customer = UserCustomer(
             id=instance_id,
             user_id=user_id,
             stripe_customer_id=customer_id,
         )
-        query = insert(customer_table).values(**user_customer.dict())
+        # A concurrent delivery may have mapped the customer already.
+        query = insert(customer_table).values(
+            **user_customer.dict()
+        ).on_conflict_do_nothing(
+            index_elements=[customer_table.stripe_customer_id]
+        )
         await self.db.execute(query)
+        await self._checkout_closed_event(data, event_id)
+
+    async def _checkout_closed_event(self, data: dict, event_id: str):
+        """Paid or expired, the session can no longer be reused."""
+        await self.db.execute(
+            delete(checkout_session_table).where(
+                checkout_session_table.stripe_session_id == data['object']['id']
+            )
+        )
 
-    async def _payment_event(self, data: dict):
+    async def _payment_event(self, data: dict, event_id: str,
+                             subscription: Optional[dict] = None):
         """Invoice paid. Send subscribtion data to auth."""
         paid_data = data['object']
 
         success_paid = paid_data['status'] == 'paid' and paid_data['paid'] is True
         customer_id = paid_data['customer']
-        user_customer_query = select(customer_table).where(customer_table.stripe_customer_id == customer_id)
-        user_customer = await self.db.fetch_one(user_customer_query)
-
-        stripe_price_id = paid_data['lines']['data'][0]['price']['id']
-        price_query = select(price_table).where(price_table.stripe_price_id == stripe_price_id)
-        price = await self.db.fetch_one(price_query)
-
-        stripe_subscription_id = paid_data['subscription']
-        subscription = stripe.Subscription.retrieve(stripe_subscription_id)
-
-        subscription_history = BillingHistory(
-            id=uuid.uuid4(),
-            stripe_customer=user_customer.id,
-            price=price.id,
-            stripe_subscription_id=stripe_subscription_id,
-            event_type=PAYMENT_SUCCEEDED if success_paid else PAYMENT_FAILED,
-            subscription_status=subscription['status'],
+        user_customer = await customer_by_stripe_id.fetch_one(
+            self.db, stripe_customer_id=customer_id
+        )
+
+        stripe_price_id = invoice_price_id(paid_data)
+        price = await price_by_stripe_id.fetch_one(
+            self.db, stripe_price_id=stripe_price_id
+        )
+
+        if subscription is None:
+            subscription = await self.stripe.request(
+                'Subscription.retrieve', paid_data['subscription']
+            )
+        await self.subscription_mirror.upsert(subscription)
+
+        history = payment_history(
+            paid_data, user_customer.id, price.id, subscription['status'],
             created_at=datetime.datetime.now(),
         )
-        history_query = insert(billing_history).values(**subscription_history.dict())
-        await self.db.execute(history_query)
+        await self.db.execute(insert_history([history.dict()]))
         period_end_timestamp = paid_data['period_end']
-        paid_to_date = str(datetime.datetime.fromtimestamp(period_end_timestamp).date())
+        paid_to_date = datetime.datetime.fromtimestamp(period_end_timestamp).date()
 
         if success_paid and subscription['status'] == SubscriptionStatus.active.value:
-            data_to_auth = {
-                'user_id': str(user_customer.user_id),
-                'permission_id': 1,
-                'paid_to_date': paid_to_date,
-            }
-            # TODO Move to different service, think about exceptions
-            response = requests.post(
-                settings.auth_path_url,
-                data=json.dumps(data_to_auth),
-                headers={'APIKEY': settings.auth_api_key, 'Content-Type': 'application/json'},
+            await self.auth_outbox.enqueue(
+                user_id=user_customer.user_id,
+                permission_id=1,
+                paid_to_date=paid_to_date,
             )
 
-        return subscription_history.dict()
+        return history.dict()
 
-    async def _subscription_event(self, data: dict) -> dict:
+    async def _subscription_event(self, data: dict, event_id: str,
+                                  created: Optional[int] = None) -> dict:
         """
         Subscription was created, updated, canceled for customer.
 
@@ -104,49 +195,69 @@ class WebhookSubscriptionService:
         When subscription was canceled, still available until the end of previous billing period.
         """
         subscription_data = data['object']
+        await self.subscription_mirror.upsert(subscription_data,
+                                              event_time(created))
 
         customer_id = subscription_data['customer']
-        user_customer_query = select(customer_table).where(customer_table.stripe_customer_id == customer_id)
-        user_customer = await self.db.fetch_one(user_customer_query)
-
-        stripe_price_id = subscription_data['plan']['id']
-        price_query = select(price_table).where(price_table.stripe_price_id == stripe_price_id)
-        price = await self.db.fetch_one(price_query)
-
-        updated_data = data.get('previous_attributes')
-
-        subscription_history = BillingHistory(
-            id=uuid.uuid4(),
-            stripe_customer=user_customer.id,
-            price=price.id,
-            stripe_subscription_id=subscription_data['id'],
-            event_type=CUSTOMER_SUBSCRIPTION_UPDATED if updated_data else CUSTOMER_SUBSCRIPTION_CREATED,
-            subscription_status=subscription_data['status'],
+        user_customer = await customer_by_stripe_id.fetch_one(
+            self.db, stripe_customer_id=customer_id
+        )
+
+        price = await price_by_stripe_id.fetch_one(
+            self.db, stripe_price_id=subscription_price_id(subscription_data)
+        )
+
+        history = subscription_history(
+            event_id, data, user_customer.id, price.id,
             created_at=datetime.datetime.now(),
-            additional_info=json.dumps(updated_data) if updated_data else None,
         )
-        history_query = insert(billing_history).values(**subscription_history.dict())
-        await self.db.execute(history_query)
+        await self.db.execute(insert_history([history.dict()]))
+
+        return history.dict()
+
+    async def _subscription_deleted_event(self, data: dict, event_id: str,
+                                          created: Optional[int] = None):
+        """Subscription ended, only the local mirror has to follow."""
+        await self.subscription_mirror.upsert(data['object'],
+                                              event_time(created))
+
+    async def prefetch(self, event: dict) -> dict:
+        """Stripe objects the event needs, to fetch before a transaction."""
+        if event['type'] not in (PAYMENT_SUCCEEDED, PAYMENT_FAILED):
+            return {}
+        subscription = await self.stripe.request(
+            'Subscription.retrieve', event['data']['object']['subscription']
+        )
+        return {'subscription': subscription}
 
-        return subscription_history.dict()
+    async def handling_event(self, event, prefetched: Optional[dict] = None):
+        """Handle webhook events.
 
-    async def handling_event(self, event):
-        """Handle webhook events."""
+        ``prefetched`` is what ``prefetch`` returned for the event;
+        without it the Stripe objects are fetched here.
+        """
+        # The event time orders the subscription states of the mirror.
+        subscription_event = partial(self._subscription_event,
+                                     created=event.get('created'))
+        payment_event = partial(self._payment_event,
+                                **(prefetched or {}))
         handlers = {
             CUSTOMER_CREATED_EVENT: self._customer_created_event,
-            PAYMENT_SUCCEEDED: self._payment_event,
-            CUSTOMER_SUBSCRIPTION_CREATED: self._subscription_event,
-            CUSTOMER_SUBSCRIPTION_UPDATED: self._subscription_event,
-            PAYMENT_FAILED: self._payment_event,
+            CHECKOUT_SESSION_EXPIRED: self._checkout_closed_event,
+            PAYMENT_SUCCEEDED: payment_event,
+            CUSTOMER_SUBSCRIPTION_CREATED: subscription_event,
+            CUSTOMER_SUBSCRIPTION_UPDATED: subscription_event,
+            CUSTOMER_SUBSCRIPTION_DELETED: partial(
+                self._subscription_deleted_event, created=event.get('created')
+            ),
+            PAYMENT_FAILED: payment_event,
         }
         data = event['data']
         event_type = event['type']
-        if handler := handlers.get(event_type):
-            await handler(data)
-
+        handler = handlers.get(event_type)
+        if handler:
+            await handler(data, event['id'])
+            customer_id = data['object'].get('customer')
+            if customer_id:
+                await self.status_cache.invalidate_customer(self.db, customer_id)
 
-@lru_cache()
-def get_webhook_service(
-    db: Database = Depends(get_pg),
-) -> WebhookSubscriptionService:
-    return WebhookSubscriptionService(db)
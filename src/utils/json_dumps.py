@@ -0,0 +1,14 @@
+import orjson
+from pydantic import BaseModel
+
+
+def orjson_default(obj):
+    """Fallback for values orjson does not encode natively."""
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError
+
+
+def orjson_dumps(v, *, default=None) -> str:
+    # pydantic expects str from json_dumps, orjson returns bytes
+    return orjson.dumps(v, default=default or orjson_default).decode()